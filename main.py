@@ -12,9 +12,12 @@ if __name__ == "__main__":
     ]
 
     for query in valid_queries:
-        response = rag_pipeline.run_with_retry(query)
         print("-" * 100)
-        print(f"Query: {query}\n\n{response}\n\n")
+        print(f"Query: {query}\n")
+        # The response is printed while it is generated
+        for text in rag_pipeline.run_stream(query):
+            print(text, end="", flush=True)
+        print("\n\n")
     
     # Invalid queries
     invalid_queries = [
@@ -0,0 +1,51 @@
+import sys
+from pathlib import Path
+
+# Add the project root directory to Python path
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from src.async_rag_pipeline import AsyncRAGPipeline
+import argparse
+import asyncio
+import time
+
+# Answer many questions concurrently with one AsyncRAGPipeline, e.g. against the stub server:
+#   python scripts/openai_stub_server.py --delay 2.0
+#   OPENAI_BASE_URL=http://localhost:8000/v1 OPENAI_API_KEY=stub python scripts/benchmark_async_pipeline.py
+parser = argparse.ArgumentParser(description="Measure the throughput of the AsyncRAGPipeline.")
+parser.add_argument("--requests", type=int, default=64)
+parser.add_argument("--concurrency", type=int, default=32)
+args = parser.parse_args()
+
+queries = [
+    "Wie hoch ist die Grundzulage?",
+    "Wie werden Versorgungsleistungen aus einer Direktzusage oder einer Unterstützungskasse steuerlich behandelt?",
+    "Wie werden Leistungen aus einer Direktversicherung, Pensionskasse oder einem Pensionsfonds in der Auszahlungsphase besteuert?",
+    "Wie kann der Wert der Altersversorgung auf den neuen Arbeitgeber übertragen werden?",
+]
+
+
+async def main():
+    pipeline = AsyncRAGPipeline(max_concurrency=args.concurrency)
+    # Disable the answer cache, every request should reach the LLM
+    pipeline.answer_cache = None
+    # Latency histograms of the stages
+    pipeline.tracer.enabled = True
+
+    start = time.time()
+    responses = await asyncio.gather(*[
+        pipeline.arun_with_retry(f"{queries[i % len(queries)]} ({i})") for i in range(args.requests)
+    ])
+    duration = time.time() - start
+    await pipeline.aclose()
+
+    print(f"Answered {len(responses)} questions in {duration:.2f}s "
+          f"({len(responses) / duration:.2f} questions/s, concurrency {args.concurrency})")
+    print(f"Embedding batches: {pipeline.embedding_batcher.stats}")
+    print(f"\n{'stage':<14} {'count':>6} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7}")
+    for stage, stats in pipeline.tracer.stats.items():
+        print(f"{stage:<14} {stats['count']:>6} {stats['p50']:>7.3f} {stats['p95']:>7.3f} {stats['p99']:>7.3f}")
+
+asyncio.run(main())
+print(f"Script finished.")
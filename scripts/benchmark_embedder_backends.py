@@ -0,0 +1,87 @@
+import sys
+from pathlib import Path
+
+# Add the project root directory to Python path
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from settings import EMBEDDER_MODEL, NORMALIZE_EMBEDDINGS, EMBED_TOKEN_BUDGET, PATH_EMBEDDING_STORE
+from src.embedder import Embedder
+from src.embedder_backends import EMBEDDER_BACKENDS
+from src.embedding_store import EmbeddingStore
+import argparse
+import contextlib
+import io
+import json
+import time
+import numpy as np
+
+# Parity and throughput of the inference backends of the Embedder.
+# Parity: cosine similarity of the embeddings of a sample of segments to their float32 embeddings
+# in the embedding store. Throughput: segments per second of embed_documents (corpus embedding)
+# and the latency of embedding single queries.
+parser = argparse.ArgumentParser(description="Compare the parity and throughput of the embedder backends.")
+parser.add_argument("--backends", type=str, nargs="+", default=list(EMBEDDER_BACKENDS), choices=EMBEDDER_BACKENDS)
+parser.add_argument("--threads", type=int, nargs="+", default=[1, 4], help="Intra-op thread counts to compare")
+parser.add_argument("--segments", type=int, default=512, help="Number of sampled segments")
+parser.add_argument("--queries", type=int, default=50, help="Number of single-query embeddings for the latency")
+parser.add_argument("--min-cosine", type=float, default=0.99,
+                    help="Parity fails if the cosine similarity of a segment is below this value")
+parser.add_argument("--output", type=str, default=None, help="Write the report as JSON to this file")
+args = parser.parse_args()
+
+store = EmbeddingStore(str(project_root / PATH_EMBEDDING_STORE))
+embeddings = store.open_embeddings()
+store.index_rows()
+rng = np.random.default_rng(0)
+rows = np.sort(rng.choice(len(embeddings), size=min(args.segments, len(embeddings)), replace=False))
+texts = [segment["text"] for segment in store.read_segments(rows)]
+reference = np.asarray(embeddings[rows], dtype=np.float32)
+reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+# Short texts like questions: the first words of segments
+queries = [" ".join(text.split()[:12]) for text in texts[:args.queries]]
+
+report = []
+for backend in args.backends:
+    for threads in args.threads:
+        start = time.perf_counter()
+        embedder = Embedder(EMBEDDER_MODEL, normalize=NORMALIZE_EMBEDDINGS, backend=backend, num_threads=threads)
+        load_s = time.perf_counter() - start
+        embedder.embed(queries[0])  # warm-up
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # embed_documents prints every batch
+            result = embedder.embed_documents(texts, max_tokens_per_batch=EMBED_TOKEN_BUDGET)
+        corpus_s = time.perf_counter() - start
+
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            embedder.embed(query)
+            latencies.append(time.perf_counter() - start)
+
+        result /= np.linalg.norm(result, axis=1, keepdims=True)
+        cosine = np.sum(result * reference, axis=1)
+        report.append({"backend": backend, "threads": threads, "load_s": load_s,
+                       "segments_per_s": len(texts) / corpus_s,
+                       "query_ms_p50": float(np.median(latencies) * 1000),
+                       "query_ms_p95": float(np.percentile(latencies, 95) * 1000),
+                       "cosine_mean": float(cosine.mean()), "cosine_min": float(cosine.min()),
+                       "parity": bool(cosine.min() >= args.min_cosine)})
+
+print(f"{len(texts)} segments, {len(queries)} queries, model {EMBEDDER_MODEL}")
+print(f"{'backend':<11} {'threads':>7} {'load s':>6} {'seg/s':>7} {'query p50 ms':>12} {'p95 ms':>7} "
+      f"{'cos mean':>9} {'cos min':>8}  parity")
+for row in report:
+    print(f"{row['backend']:<11} {row['threads']:>7} {row['load_s']:>6.2f} {row['segments_per_s']:>7.1f} "
+          f"{row['query_ms_p50']:>12.2f} {row['query_ms_p95']:>7.2f} {row['cosine_mean']:>9.5f} "
+          f"{row['cosine_min']:>8.5f}  {'ok' if row['parity'] else 'FAILED'}")
+
+if args.output:
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"model": EMBEDDER_MODEL, "segments": len(texts), "queries": len(queries),
+                   "min_cosine": args.min_cosine, "results": report}, f, indent=1)
+    print(f"Saved the report to {args.output}")
+print(f"Script finished.")
+if not all(row["parity"] for row in report):
+    sys.exit(1)
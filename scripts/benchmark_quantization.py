@@ -0,0 +1,62 @@
+import sys
+from pathlib import Path
+
+# Add the project root directory to Python path
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from src.document_database_3 import DocumentDatabase
+from src.quantization import QUANTIZATIONS, normalize_rows
+import argparse
+import json
+import time
+import numpy as np
+
+# Recall vs. memory of the quantized embeddings of the numpy backend, compared to exact float32 search.
+# The queries are segment embeddings with gaussian noise, so they are close to, but not equal to, a segment.
+parser = argparse.ArgumentParser(description="Compare the recall and memory of quantized embeddings with exact search.")
+parser.add_argument("--queries", type=int, default=500, help="Number of queries")
+parser.add_argument("--limit", type=int, default=10, help="Recall is measured at this k")
+parser.add_argument("--noise", type=float, default=0.3, help="Expected norm of the noise added to the (unit length) queries")
+parser.add_argument("--rescore", type=int, nargs="+", default=[0, 4], help="Rescore factors to compare (0 = none)")
+parser.add_argument("--output", type=str, default=None, help="Write the report as JSON to this file")
+args = parser.parse_args()
+
+exact = DocumentDatabase(quantization=None)
+rng = np.random.default_rng(0)
+sample = rng.choice(len(exact.segments), size=min(args.queries, len(exact.segments)), replace=False)
+queries = np.asarray(exact.embeddings[np.sort(sample)], dtype=np.float32)
+queries = normalize_rows(queries + rng.normal(scale=args.noise, size=queries.shape).astype(np.float32) / np.sqrt(queries.shape[1]))
+
+
+def measure(database):
+    start = time.perf_counter()
+    rows = np.concatenate([database.search(queries[i:i+32], args.limit)[0] for i in range(0, len(queries), 32)])
+    return rows, (time.perf_counter() - start) / len(queries) * 1000
+
+
+truth, exact_ms = measure(exact)
+report = [{"quantization": "float32", "rescore": 0, "bytes_per_vector": exact.nbytes / len(exact.segments),
+           "memory_mb": exact.nbytes / 2**20, "compression": 1.0, f"recall@{args.limit}": 1.0, "ms_per_query": exact_ms}]
+
+for quantization in QUANTIZATIONS:
+    for rescore in args.rescore:
+        database = DocumentDatabase(quantization=quantization, rescore=rescore)
+        rows, ms = measure(database)
+        recall = np.mean([len(set(r) & set(t)) / len(t) for r, t in zip(rows, truth)])
+        report.append({"quantization": quantization, "rescore": rescore,
+                       "bytes_per_vector": database.nbytes / len(database.segments),
+                       "memory_mb": database.nbytes / 2**20, "compression": exact.nbytes / database.nbytes,
+                       f"recall@{args.limit}": float(recall), "ms_per_query": ms})
+
+print(f"{len(exact.segments)} segments, {len(queries)} queries")
+print(f"{'quantization':<12} {'rescore':>7} {'bytes/vec':>9} {'MB':>8} {'ratio':>6} {f'recall@{args.limit}':>9} {'ms/query':>8}")
+for row in report:
+    print(f"{row['quantization']:<12} {row['rescore']:>7} {row['bytes_per_vector']:>9.0f} {row['memory_mb']:>8.2f} "
+          f"{row['compression']:>5.1f}x {row[f'recall@{args.limit}']:>9.3f} {row['ms_per_query']:>8.3f}")
+
+if args.output:
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"segments": len(exact.segments), "queries": len(queries), "results": report}, f, indent=1)
+    print(f"Saved the report to {args.output}")
+print(f"Script finished.")
@@ -0,0 +1,352 @@
+import sys
+from pathlib import Path
+
+# Add the project root directory to Python path
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from settings import PATH_EMBEDDING_STORE, QUANTIZATION_RESCORE
+from src.document_database_3 import DocumentDatabase, top_k
+from src.embedding_store import EmbeddingStore
+from src.hnsw_index import HnswIndex
+from src.quantization import normalize_rows
+import argparse
+import ctypes
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import numpy as np
+import psutil
+
+# Retrieval benchmark of the vector search of every backend and parameter setting:
+# index build time, load time (reopen and first query), memory, p50/p99 single-query latency,
+# batched QPS and recall@k against exact search. The corpus is the real segment embeddings or a
+# synthetic scale-up: real embeddings plus gaussian noise, so the synthetic vectors keep the
+# anisotropy of the model. Queries are segment embeddings with noise.
+# The results are written as JSON and can be compared with the report of a previous release.
+parser = argparse.ArgumentParser(description="Benchmark build, load, latency, QPS and recall of the retrieval backends.")
+parser.add_argument("--backends", type=str, nargs="+", default=["numpy", "chroma", "hnsw"],
+                    choices=["numpy", "chroma", "hnsw", "docarray"])
+parser.add_argument("--scales", type=int, nargs="+", default=[0],
+                    help="Corpus sizes, 0 for the real segments, e.g. 0 100000 1000000")
+parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+parser.add_argument("--limit", type=int, default=10, help="Recall is measured at this k")
+parser.add_argument("--noise", type=float, default=0.3, help="Expected norm of the noise added to the queries")
+parser.add_argument("--synthetic-noise", type=float, default=0.5,
+                    help="Expected norm of the noise added to the real embeddings of a scale-up")
+parser.add_argument("--batch-size", type=int, default=64, help="Queries per batch for the QPS")
+parser.add_argument("--quantization", type=str, nargs="+", default=["float32", "int8"],
+                    help="Settings of the numpy backend: float32, float16, int8 or binary")
+parser.add_argument("--hnsw-m", type=int, nargs="+", default=[16, 32], help="HNSW M (links per node)")
+parser.add_argument("--construction-ef", type=int, nargs="+", default=[100, 200], help="HNSW ef at build time")
+parser.add_argument("--search-ef", type=int, nargs="+", default=[10, 50, 100, 200], help="HNSW ef at search time")
+parser.add_argument("--threads", type=int, default=os.cpu_count(), help="Threads of the HNSW build")
+parser.add_argument("--workdir", type=str, default=None, help="Directory for the indexes and scale-ups (default: temp)")
+parser.add_argument("--output", type=str, default=None,
+                    help="JSON report, default data/benchmarks/retrieval_<timestamp>.json")
+parser.add_argument("--compare", type=str, default=None, help="Print the changes against this previous report")
+args = parser.parse_args()
+
+
+def rss_mb() -> float:
+    return psutil.Process().memory_info().rss / 2**20
+
+
+def release_memory():
+    # Return the freed heap to the OS, otherwise a new index reuses it and its RSS growth is too small
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def directory_mb(path: str) -> float:
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file()) / 2**20
+
+
+class NumpyBackend:
+    '''Exact (or quantized and rescored) search of src/document_database_3.py.'''
+    name = "numpy"
+
+    def __init__(self, quantization: str):
+        self.quantization = None if quantization == "float32" else quantization
+        self.params = {"quantization": quantization, "rescore": QUANTIZATION_RESCORE if self.quantization else 0}
+
+    def build(self, data, directory):
+        self.database = DocumentDatabase.from_embeddings(data, quantization=self.quantization)
+
+    def load(self, data, directory):
+        # Nothing is persisted besides the embeddings, the database is created again
+        self.database = DocumentDatabase.from_embeddings(data, quantization=self.quantization)
+
+    def search(self, queries, limit):
+        return self.database.search(queries, limit)[0]
+
+    def close(self):
+        self.database = None
+
+
+class ChromaBackend:
+    '''Persistent Chroma collection (src/document_database_2.py), its HNSW parameters are fixed at build time.'''
+    name = "chroma"
+
+    def __init__(self, m: int, construction_ef: int, search_ef: int):
+        self.params = {"M": m, "construction_ef": construction_ef, "search_ef": search_ef}
+
+    def _client(self, directory):
+        import chromadb
+        return chromadb.PersistentClient(directory, settings=chromadb.Settings(anonymized_telemetry=False))
+
+    def build(self, data, directory):
+        client = self._client(directory)
+        collection = client.create_collection("benchmark", metadata={
+            "hnsw:space": "cosine", "hnsw:M": self.params["M"], "hnsw:construction_ef": self.params["construction_ef"],
+            "hnsw:search_ef": self.params["search_ef"], "hnsw:num_threads": args.threads})
+        batch_size = client.get_max_batch_size()
+        for i in range(0, len(data), batch_size):
+            rows = range(i, min(i + batch_size, len(data)))
+            collection.add(ids=[str(row) for row in rows], embeddings=np.asarray(data[i:i+batch_size]).tolist())
+        self.collection = collection
+
+    def load(self, data, directory):
+        from chromadb.api.client import SharedSystemClient
+        self.collection = None
+        SharedSystemClient.clear_system_cache()  # otherwise the open index is reused
+        self.collection = self._client(directory).get_collection("benchmark")
+        # The HNSW index is loaded on the first query
+        self.search(data[:1], 1)
+
+    def search(self, queries, limit):
+        result = self.collection.query(query_embeddings=np.asarray(queries).tolist(), n_results=limit, include=[])
+        return np.array([[int(doc_id) for doc_id in ids] for ids in result["ids"]])
+
+    def close(self):
+        from chromadb.api.client import SharedSystemClient
+        self.collection = None
+        SharedSystemClient.clear_system_cache()
+
+
+class HnswBackend:
+    '''HNSW graph of the "hnsw" backend (src/hnsw_index.py) built with all threads, ef is set per search.'''
+    name = "hnsw"
+
+    def __init__(self, m: int, construction_ef: int):
+        self.params = {"M": m, "construction_ef": construction_ef}
+        self.search_ef = None
+
+    def build(self, data, directory):
+        index = HnswIndex.build(data, m=self.params["M"], construction_ef=self.params["construction_ef"],
+                                num_threads=args.threads)
+        index.save(os.path.join(directory, "hnsw.bin"))
+
+    def load(self, data, directory):
+        self.index = HnswIndex.load(os.path.join(directory, "hnsw.bin"))
+
+    def set_search_ef(self, ef: int):
+        self.search_ef = ef
+        self.params = {**self.params, "search_ef": ef}
+
+    def search(self, queries, limit):
+        return self.index.search(queries, limit, ef=self.search_ef)[0]
+
+    def close(self):
+        self.index = None
+
+
+class DocarrayBackend:
+    '''Exact search of the InMemoryExactNNIndex of src/document_database.py.'''
+    name = "docarray"
+
+    def __init__(self):
+        from docarray import BaseDoc
+        from docarray.typing import NdArray
+
+        class Vector(BaseDoc):
+            row: int
+            embedding: NdArray
+
+        self.schema = Vector
+        self.params = {}
+
+    def build(self, data, directory):
+        from docarray import DocList
+        from docarray.index import InMemoryExactNNIndex
+
+        index = InMemoryExactNNIndex[self.schema]()
+        index.index(DocList[self.schema]([self.schema(row=row, embedding=np.asarray(vector))
+                                          for row, vector in enumerate(data)]))
+        index.persist(os.path.join(directory, "index.bin"))
+
+    def load(self, data, directory):
+        from docarray.index import InMemoryExactNNIndex
+        self.index = InMemoryExactNNIndex[self.schema](index_file_path=os.path.join(directory, "index.bin"))
+
+    def search(self, queries, limit):
+        result = self.index.find_batched(np.asarray(queries), search_field="embedding", limit=limit)
+        return np.array([[doc.row for doc in docs] for docs in result.documents])
+
+    def close(self):
+        self.index = None
+
+
+def configurations(backend: str):
+    if backend == "numpy":
+        return [NumpyBackend(quantization) for quantization in args.quantization]
+    if backend == "chroma":
+        return [ChromaBackend(m, construction_ef, search_ef) for m in args.hnsw_m
+                for construction_ef in args.construction_ef for search_ef in args.search_ef]
+    if backend == "hnsw":
+        return [HnswBackend(m, construction_ef) for m in args.hnsw_m for construction_ef in args.construction_ef]
+    return [DocarrayBackend()]
+
+
+def scale_up(real: np.ndarray, size: int, path: str, chunk_size: int = 65536) -> np.ndarray:
+    '''
+    Write `size` synthetic embeddings (a random real embedding plus noise, normalized) to a memory map.
+    '''
+    rng = np.random.default_rng(size)
+    data = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(size, real.shape[1]))
+    for i in range(0, size, chunk_size):
+        n = min(chunk_size, size - i)
+        noise = rng.normal(scale=args.synthetic_noise / np.sqrt(real.shape[1]), size=(n, real.shape[1]))
+        data[i:i+n] = normalize_rows(real[rng.integers(len(real), size=n)] + noise.astype(np.float32))
+    data.flush()
+    return np.load(path, mmap_mode="r")
+
+
+def exact_top_k(data: np.ndarray, queries: np.ndarray, limit: int, chunk_size: int = 65536) -> np.ndarray:
+    '''
+    Ground truth: the exact top-k rows per query, scanning the corpus in chunks.
+    '''
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+    best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+    for i in range(0, len(data), chunk_size):
+        scores = queries @ np.asarray(data[i:i+chunk_size], dtype=np.float32).T
+        rows, scores = top_k(scores, min(limit, scores.shape[1]))
+        merged_rows = np.concatenate([best_rows, rows + i], axis=1)
+        merged_scores = np.concatenate([best_scores, scores], axis=1)
+        order, best_scores = top_k(merged_scores, min(limit, merged_scores.shape[1]))
+        best_rows = np.take_along_axis(merged_rows, order, axis=1)
+    return best_rows
+
+
+def measure(backend, data, queries, truth, directory, build_s, load_s, memory_mb) -> dict:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        backend.search(query[None, :], args.limit)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    rows = np.concatenate([backend.search(queries[i:i+args.batch_size], args.limit)
+                           for i in range(0, len(queries), args.batch_size)])
+    batched_s = time.perf_counter() - start
+
+    recall = np.mean([len(set(r) & set(t)) / len(t) for r, t in zip(rows, truth)])
+    return {"backend": backend.name, "params": dict(backend.params), "corpus_size": len(data),
+            "build_s": build_s, "load_s": load_s, "memory_mb": memory_mb,
+            "disk_mb": directory_mb(directory) if os.path.isdir(directory) else 0.0,
+            "latency_p50_ms": float(np.percentile(latencies, 50) * 1000),
+            "latency_p99_ms": float(np.percentile(latencies, 99) * 1000),
+            "batched_qps": len(queries) / batched_s, f"recall@{args.limit}": float(recall)}
+
+
+def result_key(result: dict) -> str:
+    return json.dumps([result["backend"], result["params"], result["corpus_size"]], sort_keys=True)
+
+
+workdir = args.workdir or tempfile.mkdtemp(prefix="benchmark_retrieval_")
+os.makedirs(workdir, exist_ok=True)
+
+store = EmbeddingStore(str(project_root / PATH_EMBEDDING_STORE))
+real = normalize_rows(np.asarray(store.open_embeddings(), dtype=np.float32))
+rng = np.random.default_rng(0)
+sample = rng.choice(len(real), size=args.queries, replace=len(real) < args.queries)
+queries = normalize_rows(real[sample] + rng.normal(scale=args.noise / np.sqrt(real.shape[1]),
+                                                   size=(args.queries, real.shape[1])).astype(np.float32))
+
+results = []
+for scale in args.scales:
+    if scale == 0:
+        data = real
+    else:
+        start = time.perf_counter()
+        data = scale_up(real, scale, os.path.join(workdir, f"vectors_{scale}.npy"))
+        print(f"Generated {scale} synthetic embeddings in {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    truth = exact_top_k(data, queries, args.limit)
+    print(f"Corpus of {len(data)} embeddings, ground truth in {time.perf_counter() - start:.1f}s")
+
+    for backend_name in args.backends:
+        for backend in configurations(backend_name):
+            directory = os.path.join(workdir, f"{backend.name}_{len(results)}")
+            os.makedirs(directory)
+            release_memory()
+            memory_before = rss_mb()
+            start = time.perf_counter()
+            backend.build(data, directory)
+            build_s = time.perf_counter() - start
+            backend.close()
+            release_memory()
+
+            start = time.perf_counter()
+            backend.load(data, directory)
+            load_s = time.perf_counter() - start
+            # Memory of the loaded index (resident memory growth of the process, includes pages of memory maps)
+            memory_mb = rss_mb() - memory_before
+
+            search_efs = args.search_ef if isinstance(backend, HnswBackend) else [None]
+            for search_ef in search_efs:
+                if search_ef is not None:
+                    backend.set_search_ef(search_ef)
+                results.append(measure(backend, data, queries, truth, directory, build_s, load_s, memory_mb))
+                row = results[-1]
+                print(f"{row['backend']:<9} {json.dumps(row['params']):<62} build {row['build_s']:7.2f}s "
+                      f"load {row['load_s']:6.2f}s mem {row['memory_mb']:7.1f}MB p50 {row['latency_p50_ms']:7.2f}ms "
+                      f"p99 {row['latency_p99_ms']:7.2f}ms {row['batched_qps']:8.0f} QPS "
+                      f"recall@{args.limit} {row[f'recall@{args.limit}']:.3f}")
+            backend.close()
+            shutil.rmtree(directory, ignore_errors=True)
+
+try:
+    commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=project_root, capture_output=True, text=True,
+                            check=True).stdout.strip()
+except (OSError, subprocess.CalledProcessError):
+    commit = None
+report = {"created": datetime.datetime.now().isoformat(timespec="seconds"), "commit": commit,
+          "machine": {"platform": platform.platform(), "cpus": os.cpu_count(),
+                      "memory_gb": psutil.virtual_memory().total / 2**30},
+          "config": vars(args), "results": results}
+
+output = args.output or str(project_root / "data" / "benchmarks" /
+                            f"retrieval_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+os.makedirs(os.path.dirname(output), exist_ok=True)
+with open(output, "w", encoding="utf-8") as f:
+    json.dump(report, f, indent=1)
+print(f"Saved the report to {output}")
+
+if args.compare:
+    with open(args.compare, encoding="utf-8") as f:
+        previous = {result_key(result): result for result in json.load(f)["results"]}
+    print(f"\nChanges against {args.compare}:")
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None:
+            continue
+        changes = []
+        for metric in ("latency_p50_ms", "latency_p99_ms", "batched_qps", "build_s", f"recall@{args.limit}"):
+            if metric in before and before[metric]:
+                changes.append(f"{metric} {result[metric] - before[metric]:+.3f} "
+                               f"({(result[metric] / before[metric] - 1) * 100:+.0f}%)")
+        print(f"{result['backend']:<9} {json.dumps(result['params'])} n={result['corpus_size']}: " + ", ".join(changes))
+
+if args.workdir is None:
+    shutil.rmtree(workdir, ignore_errors=True)
+print(f"Script finished.")
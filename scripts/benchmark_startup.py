@@ -0,0 +1,53 @@
+from pathlib import Path
+import argparse
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+
+# Cold start of a new worker: every run is a fresh Python process that imports the pipeline,
+# initializes its components (RAGPipeline.startup_times) and answers a first retrieval (without
+# the LLM). Build the startup snapshot first (scripts/build_startup_snapshot.py) to measure
+# the production setup.
+project_root = Path(__file__).parent.parent
+
+parser = argparse.ArgumentParser(description="Measure the cold start of the RAG pipeline in fresh processes.")
+parser.add_argument("--runs", type=int, default=3, help="Number of fresh processes")
+parser.add_argument("--query", type=str, default="Wie hoch ist die Grundzulage?")
+parser.add_argument("--output", type=str, default=None, help="Write the measurements as JSON to this file")
+args = parser.parse_args()
+
+WORKER = """
+import json, sys, time
+start = time.time()
+from src.rag_pipeline import RAGPipeline
+imports = time.time() - start
+pipeline = RAGPipeline()
+first_query = time.time()
+embedding = pipeline.embedder.embed(sys.argv[1])[0]
+pipeline.document_database.find(embedding, query_text=sys.argv[1])
+now = time.time()
+print(json.dumps({"Imports": imports, **pipeline.startup_times, "First query": now - first_query,
+                  "Cold start": now - start}))
+"""
+
+# The client refuses to start without a key, no request is sent
+env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY") or "benchmark"}
+runs = []
+for i in range(args.runs):
+    result = subprocess.run([sys.executable, "-c", WORKER, args.query], cwd=project_root, env=env,
+                            capture_output=True, text=True, check=True)
+    runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    print(f"Run {i+1} of {args.runs}: cold start {runs[-1]['Cold start']:.2f}s")
+
+print(f"\n{'component':<20} {'median s':>9} {'max s':>7}")
+for component in runs[0]:
+    times = [run[component] for run in runs]
+    print(f"{component:<20} {np.median(times):>9.2f} {max(times):>7.2f}")
+
+if args.output:
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"query": args.query, "runs": runs}, f, indent=1)
+    print(f"Saved the measurements to {args.output}")
+print(f"Script finished.")
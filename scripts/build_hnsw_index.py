@@ -0,0 +1,79 @@
+import sys
+from pathlib import Path
+
+# Add the project root directory to Python path
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from settings import (HNSW_M, HNSW_CONSTRUCTION_EF, HNSW_SEARCH_EF, HNSW_NUM_THREADS, PATH_HNSW_INDEX,
+                      PATH_EMBEDDING_STORE)
+from src.document_database_3 import top_k
+from src.embedding_store import EmbeddingStore, segments_fingerprint
+from src.hnsw_index import HnswIndex
+from src.quantization import normalize_rows
+import argparse
+import time
+import numpy as np
+
+# Builds the HNSW graph of the "hnsw" document database backend offline, with all cores, and saves
+# it to PATH_HNSW_INDEX, where the backend loads it on start. The recall@k against exact search and the
+# latency of single queries are measured for every search ef and stored with the index, so the ef for a
+# latency budget can be chosen with a known recall. Queries are segment embeddings with noise.
+parser = argparse.ArgumentParser(description="Build the HNSW index of the segments and measure its recall.")
+parser.add_argument("--m", type=int, default=HNSW_M, help="Links per node")
+parser.add_argument("--construction-ef", type=int, default=HNSW_CONSTRUCTION_EF)
+parser.add_argument("--threads", type=int, default=HNSW_NUM_THREADS, help="Threads of the build, default all cores")
+parser.add_argument("--search-ef", type=int, nargs="+", default=sorted({10, 50, HNSW_SEARCH_EF, 200, 400}))
+parser.add_argument("--queries", type=int, default=500, help="Number of queries of the recall measurement")
+parser.add_argument("--limit", type=int, default=10, help="Recall is measured at this k")
+parser.add_argument("--noise", type=float, default=0.3, help="Expected norm of the noise added to the queries")
+parser.add_argument("--path", type=str, default=PATH_HNSW_INDEX, help="Relative to the project root")
+args = parser.parse_args()
+path = str(project_root / args.path)
+
+path_store = str(project_root / PATH_EMBEDDING_STORE)
+store = EmbeddingStore(path_store)
+embeddings = store.open_embeddings()
+print(f"Building the HNSW graph of {len(embeddings)} embeddings (M={args.m}, construction_ef={args.construction_ef})")
+start = time.time()
+index = HnswIndex.build(embeddings, m=args.m, construction_ef=args.construction_ef, num_threads=args.threads,
+                        fingerprint=segments_fingerprint(path_store), verbose=True)
+print(f"Built the graph in {time.time() - start:.1f}s")
+
+rng = np.random.default_rng(0)
+sample = rng.choice(len(embeddings), size=args.queries, replace=len(embeddings) < args.queries)
+queries = normalize_rows(normalize_rows(np.asarray(embeddings[np.sort(sample)], dtype=np.float32))
+                         + rng.normal(scale=args.noise / np.sqrt(embeddings.shape[1]),
+                                      size=(args.queries, embeddings.shape[1])).astype(np.float32))
+limit = min(args.limit, len(embeddings))
+
+# Exact top-k, scanning the embeddings in chunks
+best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+for i in range(0, len(embeddings), 65536):
+    rows, scores = top_k(queries @ normalize_rows(np.asarray(embeddings[i:i+65536], dtype=np.float32)).T, limit)
+    rows = np.concatenate([best_rows, rows + i], axis=1)
+    order, best_scores = top_k(np.concatenate([best_scores, scores], axis=1), limit)
+    best_rows = np.take_along_axis(rows, order, axis=1)
+
+print(f"\n{'ef':>5} {f'recall@{limit}':>10} {'p50 ms':>7} {'p99 ms':>7}")
+for ef in args.search_ef:
+    latencies = []
+    recalls = []
+    for query, truth in zip(queries, best_rows):
+        start = time.perf_counter()
+        rows, _ = index.search(query, limit, ef=ef)
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len(set(rows[0]) & set(truth)) / limit)
+    index.recall[str(ef)] = {f"recall@{limit}": float(np.mean(recalls)),
+                             "latency_ms_p50": float(np.percentile(latencies, 50) * 1000),
+                             "latency_ms_p99": float(np.percentile(latencies, 99) * 1000)}
+    print(f"{ef:>5} {np.mean(recalls):>10.3f} {np.percentile(latencies, 50) * 1000:>7.2f} "
+          f"{np.percentile(latencies, 99) * 1000:>7.2f}")
+
+index.save(path)
+print(f"\nSaved the index to {path}")
+if args.m != HNSW_M or args.construction_ef != HNSW_CONSTRUCTION_EF:
+    print(f"Set HNSW_M = {args.m} and HNSW_CONSTRUCTION_EF = {args.construction_ef} in settings.py, "
+          f"otherwise the backend builds the graph again on start")
+print(f"Script finished.")
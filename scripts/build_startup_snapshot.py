@@ -0,0 +1,62 @@
+import sys
+from pathlib import Path
+
+# Add the project root directory to Python path
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from settings import (EMBEDDER_MODEL, STARTUP_SNAPSHOT_PATH, OPENAI_MODEL_NAME, RERANK, ANSWERABILITY_GATE,
+                      ANSWERABILITY_MIN_CROSS_SCORE, CROSS_ENCODER_MODEL, EMBEDDER_BACKEND)
+import argparse
+import os
+import time
+
+# Prepares everything a new worker loads on start, so it starts in a few seconds:
+# the models as safetensors in a local directory (no Hugging Face Hub lookups), the tiktoken
+# encodings and the persisted search index, lexical index and tables of the document database.
+# Run it after the segments or the models changed, e.g. as a step of the deployment. The snapshot is
+# written to STARTUP_SNAPSHOT_PATH, the directory the workers read it from.
+parser = argparse.ArgumentParser(description="Build the startup snapshot of the models and the index "
+                                             "in STARTUP_SNAPSHOT_PATH.")
+args = parser.parse_args()
+if STARTUP_SNAPSHOT_PATH is None:
+    sys.exit("STARTUP_SNAPSHOT_PATH is None, the startup snapshot is disabled in settings.py")
+
+# Must be set before tiktoken loads an encoding
+os.environ["TIKTOKEN_CACHE_DIR"] = os.path.join(STARTUP_SNAPSHOT_PATH, "tiktoken")
+
+from src.snapshot import save_snapshot
+from src.embedder import Embedder
+from src.embedder_backends import onnx_path
+from src.database_backends import create_document_database
+
+start = time.time()
+# The ONNX model of the "onnx" embedder backend is exported again from the loaded model
+if EMBEDDER_BACKEND == "onnx" and os.path.exists(onnx_path(EMBEDDER_MODEL)):
+    os.remove(onnx_path(EMBEDDER_MODEL))
+# Loaded by name (path=...), so a stale snapshot is replaced
+embedder = Embedder(EMBEDDER_MODEL, path=EMBEDDER_MODEL)
+models = {EMBEDDER_MODEL: (embedder.model, embedder.tokenizer)}
+if RERANK or (ANSWERABILITY_GATE and ANSWERABILITY_MIN_CROSS_SCORE is not None):
+    from src.cross_encoder import CrossEncoder
+    cross_encoder = CrossEncoder(CROSS_ENCODER_MODEL, path=CROSS_ENCODER_MODEL)
+    models[CROSS_ENCODER_MODEL] = (cross_encoder.model, cross_encoder.tokenizer)
+print(f"Loaded {len(models)} model(s) in {time.time() - start:.2f}s")
+
+tiktoken_cache = None
+try:
+    import tiktoken
+    tiktoken.encoding_for_model(OPENAI_MODEL_NAME)
+    tiktoken_cache = "tiktoken"
+except Exception as e:
+    print(f"Skipping the tiktoken encodings: {e}")
+
+start = time.time()
+save_snapshot(models, path=STARTUP_SNAPSHOT_PATH, tiktoken_cache=tiktoken_cache)
+print(f"Saved the snapshot to {STARTUP_SNAPSHOT_PATH} in {time.time() - start:.2f}s")
+
+# Opening the database builds or updates the persisted index and tables if the segments changed
+start = time.time()
+create_document_database()
+print(f"Prepared the document database in {time.time() - start:.2f}s")
+print(f"Script finished.")
@@ -5,10 +5,11 @@ from pathlib import Path
 project_root = Path(__file__).parent.parent
 sys.path.append(str(project_root))
 
-from settings import EMBEDDER_MODEL, NORMALIZE_EMBEDDINGS
+from settings import (EMBEDDER_MODEL, NORMALIZE_EMBEDDINGS, EMBED_TOKEN_BUDGET, PATH_EMBEDDING_STORE,
+                      EMBEDDING_STORE_DTYPE)
 from src.embedder import Embedder
+from src.embedding_store import EmbeddingStore
 import json
-import pickle as pkl
 
 # Load the embedding model
 embedder = Embedder(EMBEDDER_MODEL, normalize=NORMALIZE_EMBEDDINGS)
@@ -18,17 +19,14 @@ path_segments = str(project_root / "data" / "segments" / "segments.json")
 with open(path_segments, "r", encoding="utf-8") as f:
     segments = json.load(f)
 
-# Compute the embeddings in batches for speed
+# Compute the embeddings in batches of similar length for speed
 texts = [segment["text"] for segment in segments]
-embeddings = embedder.embed_documents(texts, batch_size=16)
+embeddings = embedder.embed_documents(texts, max_tokens_per_batch=EMBED_TOKEN_BUDGET)
 
-# Save the embeddings to the segments
-for i, embedding in enumerate(embeddings):
-    segments[i]["embedding"] = embedding
-
-# Save the segments with embeddings
-path_segments_with_embeddings = str(project_root / "data" / "segments" / "segments_with_embeddings.pkl")
-with open(path_segments_with_embeddings, "wb") as f:
-    pkl.dump(segments, f)
+# Save the segments and their embeddings to the embedding store
+# (use scripts/convert_segment_store.py to export the legacy pickle)
+store = EmbeddingStore(str(project_root / PATH_EMBEDDING_STORE))
+store.write(segments, embeddings, dtype=EMBEDDING_STORE_DTYPE)
+print(f"Saved {len(segments)} segments to {store.path}")
 
 print(f"Script finished.")
\ No newline at end of file
@@ -0,0 +1,29 @@
+import sys
+from pathlib import Path
+
+# Add the project root directory to Python path
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from settings import PATH_SEGMENTS, PATH_EMBEDDING_STORE, EMBEDDING_STORE_DTYPE
+from src.embedding_store import EmbeddingStore
+import argparse
+
+# Import the legacy pickle (list of segment dicts) into the embedding store or export it again
+parser = argparse.ArgumentParser(description="Convert between the segment pickle and the embedding store.")
+parser.add_argument("direction", choices=["import", "export"],
+                    help="import: pickle -> embedding store, export: embedding store -> pickle")
+parser.add_argument("--pickle", default=str(project_root / PATH_SEGMENTS))
+parser.add_argument("--store", default=str(project_root / PATH_EMBEDDING_STORE))
+parser.add_argument("--dtype", default=EMBEDDING_STORE_DTYPE, choices=["float32", "float16"])
+args = parser.parse_args()
+
+if args.direction == "import":
+    store = EmbeddingStore.from_pickle(args.pickle, args.store, dtype=args.dtype)
+    print(f"Imported {store.header['count']} segments from {args.pickle} into {args.store}")
+else:
+    store = EmbeddingStore(args.store).load()
+    store.to_pickle(args.pickle)
+    print(f"Exported {len(store.segments)} segments from {args.store} to {args.pickle}")
+
+print(f"Script finished.")
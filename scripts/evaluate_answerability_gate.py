@@ -0,0 +1,100 @@
+import sys
+from pathlib import Path
+
+# Add the project root directory to Python path
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from src.answerability_gate import AnswerabilityGate
+from src.database_backends import create_document_database
+from src.embedder import Embedder
+from settings import (EMBEDDER_MODEL, NORMALIZE_EMBEDDINGS, DOCUMENT_LIMIT, ANSWERABILITY_MIN_SIMILARITY,
+                      ANSWERABILITY_MIN_CROSS_SCORE)
+import argparse
+import json
+import numpy as np
+
+# Calibrates the answerability gate on labeled queries, without calling the LLM.
+# Every query is retrieved like in RAGPipeline.run_with_retry. Without the gate, a question the
+# corpus cannot answer costs 1 + max_retries LLM calls (every try returns "Hoppla"), an answerable
+# one at least 1 call. A rejected question costs none.
+parser = argparse.ArgumentParser(description="Report the LLM calls saved and the false rejects of the answerability gate.")
+parser.add_argument("--queries", type=str, default="data/eval/answerability_queries.json",
+                    help="JSON list of {\"query\": ..., \"answerable\": true/false}")
+parser.add_argument("--max-retries", type=int, default=2)
+parser.add_argument("--doc-limit-increment", type=int, default=2)
+parser.add_argument("--cross-encoder", action="store_true", help="Also score the best hits with the cross-encoder")
+parser.add_argument("--output", type=str, default=None, help="Write the features and the report as JSON to this file")
+args = parser.parse_args()
+
+with open(args.queries, encoding="utf-8") as f:
+    labeled = json.load(f)
+queries = [item["query"] for item in labeled]
+answerable = np.array([item["answerable"] for item in labeled], dtype=bool)
+
+embedder = Embedder(EMBEDDER_MODEL, normalize=NORMALIZE_EMBEDDINGS)
+database = create_document_database()
+gate = AnswerabilityGate(min_cross_score=ANSWERABILITY_MIN_CROSS_SCORE if args.cross_encoder else None)
+if args.cross_encoder and gate.cross_encoder is None:
+    from src.cross_encoder import CrossEncoder
+    gate.cross_encoder = CrossEncoder()
+
+limit = DOCUMENT_LIMIT + args.max_retries * args.doc_limit_increment
+features = []
+for query in queries:
+    query_embedding = embedder.embed(query.strip())[0]
+    hits = database.find(query_embedding, limit=limit, extra_context=False, query_text=query)
+    features.append(gate.features(query, query_embedding, hits))
+
+baseline_calls = np.where(answerable, 1, 1 + args.max_retries)
+
+
+def evaluate(rejected):
+    return {
+        "rejected": int(rejected.sum()),
+        "false_reject_rate": float(rejected[answerable].mean()) if answerable.any() else 0.0,
+        "unanswerable_rejected": float(rejected[~answerable].mean()) if (~answerable).any() else 0.0,
+        "llm_calls_saved": int(baseline_calls[rejected & ~answerable].sum()),
+        "llm_calls_baseline": int(baseline_calls.sum()),
+    }
+
+
+def sweep(name):
+    # Every observed value is a candidate threshold
+    values = np.array([f[name] for f in features], dtype=float)
+    rows = []
+    for threshold in np.unique(values):
+        rows.append({"threshold": float(threshold), **evaluate(values < threshold)})
+    return rows
+
+
+configured = evaluate(np.array([not gate.decide(f) for f in features]))
+report = {"queries": len(queries), "answerable": int(answerable.sum()), "configured": configured,
+          "sweeps": {"max_similarity": sweep("max_similarity")}}
+if args.cross_encoder:
+    report["sweeps"]["max_cross_score"] = sweep("max_cross_score")
+
+print(f"{len(queries)} queries, {answerable.sum()} answerable, {len(queries) - answerable.sum()} not answerable")
+print(f"{'answerable':>10} {'similarity':>10} {'margin':>7} {'cross':>7}  query")
+for item, f in sorted(zip(labeled, features), key=lambda x: -x[1]["max_similarity"]):
+    cross = f"{f['max_cross_score']:7.2f}" if f["max_cross_score"] is not None else f"{'-':>7}"
+    print(f"{str(item['answerable']):>10} {f['max_similarity']:10.3f} {f['margin']:7.3f} {cross}  {item['query'][:70]}")
+
+for name, rows in report["sweeps"].items():
+    print(f"\nReject if {name} < threshold")
+    print(f"{'threshold':>9} {'false rejects':>13} {'unanswerable rejected':>21} {'LLM calls saved':>15}")
+    for row in rows:
+        print(f"{row['threshold']:9.3f} {row['false_reject_rate']:13.1%} {row['unanswerable_rejected']:21.1%} "
+              f"{row['llm_calls_saved']:>7} of {row['llm_calls_baseline']:<4}")
+
+print(f"\nConfigured gate (ANSWERABILITY_MIN_SIMILARITY={ANSWERABILITY_MIN_SIMILARITY}"
+      + (f", ANSWERABILITY_MIN_CROSS_SCORE={ANSWERABILITY_MIN_CROSS_SCORE}" if args.cross_encoder else "") + "):")
+print(f"{configured['false_reject_rate']:.1%} false rejects, {configured['unanswerable_rejected']:.1%} of the "
+      f"unanswerable questions rejected, {configured['llm_calls_saved']} of {configured['llm_calls_baseline']} "
+      f"LLM calls saved")
+
+if args.output:
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({**report, "features": [{**item, **f} for item, f in zip(labeled, features)]}, f, indent=1)
+    print(f"Saved the report to {args.output}")
+print(f"Script finished.")
@@ -11,15 +11,28 @@ import uuid
 import datetime
 import re
 import os
-from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import itertools
+import argparse
 import json
 
+SEGMENT_KEYS = ("id", "full_path", "filename", "page", "text", "previous_id", "next_id", "document_date")
+
 # Update paths to use absolute paths from project root
 pdf_path = str(project_root / "data" / "pdfs")
 path_save = str(project_root / "data" / "segments" / "segments.json")
 
-def id_generator():
-    return str(uuid.uuid4())
+# Namespace of the content-derived segment ids
+SEGMENT_ID_NAMESPACE = uuid.UUID("5b0f3c64-3f1e-4c55-9a7e-2d1b8f0c6a41")
+
+def segment_id(filename, text, occurrence):
+    """
+    Stable, content-derived id of a segment: the same text in the same file always
+    gets the same id, so re-extracting an unchanged PDF does not change any ids.
+    occurrence counts earlier segments of the file with the same text.
+    """
+    return str(uuid.uuid5(SEGMENT_ID_NAMESPACE, f"{filename}\0{text}\0{occurrence}"))
 
 def process_page(page):
     page_text = page.get_text(sort=True)
@@ -117,21 +130,36 @@ def is_heading(text: str, max_chars=100) -> bool:
 
 
 
-segments = []
-for filename in os.listdir(pdf_path):
-    print(f"Processing {filename}")
-    document_date = date_from_filename(filename).strftime("%d.%m.%Y")
-    full_path = os.path.join(pdf_path, filename)
+def extract_page_texts(full_path, start, stop):
+    """
+    Extract the processed text of the pages [start, stop) of a PDF.
+    Runs in a worker process, every worker opens the PDF itself.
+    """
     pdf_document = pymupdf.open(full_path)
-    next_id = id_generator()
-    last_id = None
+    page_texts = [process_page(pdf_document[i_page]) for i_page in range(start, stop)]
+    pdf_document.close()
+    return page_texts
+
+def page_ranges(full_path, pages_per_job):
+    """Split the pages of a PDF into ranges [start, stop) of at most pages_per_job pages."""
+    with pymupdf.open(full_path) as pdf_document:
+        n_pages = len(pdf_document)
+    return [(start, min(start + pages_per_job, n_pages)) for start in range(0, n_pages, pages_per_job)]
+
+def segment_pages(full_path, page_texts):
+    """
+    Split the page texts of one PDF into segments.
+    Only looks at segments of the same PDF, so documents can be processed independently.
+    """
+    filename = os.path.basename(full_path)
+    document_date = date_from_filename(filename).strftime("%d.%m.%Y")
+    segments = []
     chunk_memory = ""
-    for i_page, page in enumerate(pdf_document):
-        text = process_page(page)
+    for i_page, text in enumerate(page_texts):
         chunks = [c.strip() for c in text.split("\n\n") if len(c.strip()) > MIN_CHARS_PER_CHUNK]
         for i_chunk, chunk in enumerate(chunks):
             # Check if this chunk belongs to the last chunk due to a line break.
-            if i_chunk == 0 and i_page > 0 and starts_with_number(segments[-1]["text"]) and not starts_with_number(chunk):
+            if i_chunk == 0 and i_page > 0 and segments and starts_with_number(segments[-1]["text"]) and not starts_with_number(chunk):
                 # this chunk belongs to the last chunk
                 segments[-1]["text"] += "\n\n" + chunk
                 segments[-1]["page"] += f" und {i_page+1}"
@@ -143,10 +171,6 @@ for filename in os.listdir(pdf_path):
                 chunk_memory += "\n\n" + chunk
                 chunk_memory = chunk_memory.strip()
                 continue
-                
-            # Assign correct IDs to each segment
-            current_id = deepcopy(next_id) if next_id is not None else id_generator()
-            next_id = None if (i_page == len(pdf_document) - 1 and i_chunk == len(chunks) - 1) else id_generator()
 
             # Assemble a chunk if there is a chunk_memory (e.g. from a previous heading)
             if chunk_memory:
@@ -154,22 +178,104 @@ for filename in os.listdir(pdf_path):
                 chunk_memory = ""
             
             segments.append({
-                "id": current_id,
                 "full_path": full_path,
                 "filename": filename,
                 "page": str(i_page+1),
                 "text": chunk,
-                "previous_id": last_id,
-                "next_id": next_id,
                 "document_date": document_date
             })
-            
-            last_id = deepcopy(current_id)
 
-print(f"Found {len(segments)} segments from {len(os.listdir(pdf_path))} PDFs")
-            
-with open(path_save, "w", encoding="utf-8") as f:
-    json.dump(segments, f, ensure_ascii=False)
+    # Assign ids once the texts are final and link the segments in document order
+    occurrences = {}
+    for segment in segments:
+        occurrence = occurrences.get(segment["text"], 0)
+        occurrences[segment["text"]] = occurrence + 1
+        segment["id"] = segment_id(filename, segment["text"], occurrence)
+    for i, segment in enumerate(segments):
+        segment["previous_id"] = segments[i-1]["id"] if i > 0 else None
+        segment["next_id"] = segments[i+1]["id"] if i < len(segments) - 1 else None
+
+    return [{key: segment[key] for key in SEGMENT_KEYS} for segment in segments]
+
+def extract_segments_from_pdf(full_path):
+    """Extract the segments of a single PDF in the current process."""
+    with pymupdf.open(full_path) as pdf_document:
+        n_pages = len(pdf_document)
+    return segment_pages(full_path, extract_page_texts(full_path, 0, n_pages))
+
+def list_pdfs(pdf_path):
+    """Full paths of all PDFs in a directory, sorted by filename."""
+    filenames = sorted(filename for filename in os.listdir(pdf_path) if filename.lower().endswith(".pdf"))
+    return [os.path.join(pdf_path, filename) for filename in filenames]
+
+def iter_extracted_pdfs(full_paths, processes=None, pages_per_job=50, max_pending_jobs=None):
+    """
+    Extract the given PDFs with a process pool and yield (full_path, segments) per PDF in order.
+
+    Page extraction runs in parallel across files and across page ranges of large
+    files, but at most max_pending_jobs page ranges are in flight or waiting to be
+    segmented. Memory use is therefore bounded by that window and not by the number
+    of PDFs, and the first PDFs can be processed further while later ones are extracted.
+    """
+    def jobs():
+        for i_file, full_path in enumerate(full_paths):
+            for start, stop in page_ranges(full_path, pages_per_job):
+                yield i_file, full_path, start, stop
+
+    if max_pending_jobs is None:
+        max_pending_jobs = 2 * (processes or os.cpu_count() or 1)
+
+    job_iter = jobs()
+    pending = deque()
+    i_current = 0
+    page_texts = []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        while True:
+            for i_file, full_path, start, stop in itertools.islice(job_iter, max_pending_jobs - len(pending)):
+                pending.append((i_file, executor.submit(extract_page_texts, full_path, start, stop)))
+            if not pending:
+                break
+            i_file, future = pending.popleft()
+            # PDFs before this job are complete (PDFs without pages have no jobs at all)
+            while i_current < i_file:
+                print(f"Processing {os.path.basename(full_paths[i_current])}")
+                yield full_paths[i_current], segment_pages(full_paths[i_current], page_texts)
+                i_current += 1
+                page_texts = []
+            page_texts.extend(future.result())
+
+    while i_current < len(full_paths):
+        print(f"Processing {os.path.basename(full_paths[i_current])}")
+        yield full_paths[i_current], segment_pages(full_paths[i_current], page_texts)
+        i_current += 1
+        page_texts = []
+
+def extract_segments(full_paths, processes=None, pages_per_job=50):
+    """
+    Extract the segments of the given PDFs with a process pool.
+
+    The page texts are segmented per PDF in the given order, so the result does
+    not depend on the number of processes.
+    """
+    segments = []
+    for _, pdf_segments in iter_extracted_pdfs(full_paths, processes=processes, pages_per_job=pages_per_job):
+        segments.extend(pdf_segments)
+    return segments
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract text segments from the BMF PDFs.")
+    parser.add_argument("--processes", type=int, default=None, help="Number of worker processes (default: all cores)")
+    parser.add_argument("--pages-per-job", type=int, default=50, help="Split large PDFs into page ranges of this size")
+    args = parser.parse_args()
+
+    segments = extract_segments(list_pdfs(pdf_path), processes=args.processes, pages_per_job=args.pages_per_job)
+    test_segment_connections(segments)
+
+    print(f"Found {len(segments)} segments from {len({segment['filename'] for segment in segments})} PDFs")
+                
+    with open(path_save, "w", encoding="utf-8") as f:
+        json.dump(segments, f, ensure_ascii=False)
 
-print(f"Saved segments to {path_save}")
-print(f"Script finished")
\ No newline at end of file
+    print(f"Saved segments to {path_save}")
+    print(f"Script finished")
\ No newline at end of file
@@ -0,0 +1,206 @@
+import sys
+from pathlib import Path
+
+# Add the project root directory to Python path
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from settings import (EMBEDDER_MODEL, EMBEDDER_BACKEND, NORMALIZE_EMBEDDINGS, EMBED_TOKEN_BUDGET,
+                      INGEST_CHUNK_SIZE, PATH_EMBEDDING_STORE, EMBEDDING_STORE_DTYPE)
+from src.embedding_cache import embedder_identity
+from src.embedding_store import EmbeddingStore, EmbeddingStoreWriter, file_fingerprint
+from extract_segments_from_pdfs import iter_extracted_pdfs, list_pdfs, test_segment_connections
+import argparse
+import json
+import os
+import numpy as np
+
+# Incremental ingestion: only PDFs that are new or whose content changed are extracted and embedded.
+# The manifest records the content hash and the segment ids of every ingested PDF. Segment ids are
+# derived from the content, so unchanged segments of a modified PDF keep their embeddings, too.
+# The manifest and the checkpoint also record the embedder identity (model, backend, normalization):
+# if it changed, e.g. to the int8 backend, all segments are embedded again instead of mixing vectors.
+#
+# The ingestion streams: PDFs are extracted, embedded and written (and optionally upserted into the
+# Chroma index) in chunks of INGEST_CHUNK_SIZE segments, so the texts and embeddings of the corpus are
+# never in memory at once. Small per-segment state still grows with the corpus: the row of every old
+# segment id (segments move between PDFs, so the lookup spans all of them) and the link fields used to
+# check the segment connections and build the neighbor table. A checkpoint is written after every PDF;
+# --resume continues an interrupted run.
+pdf_path = str(project_root / "data" / "pdfs")
+path_manifest = str(project_root / "data" / "segments" / "manifest.json")
+path_segments = str(project_root / "data" / "segments" / "segments.json")
+path_store = str(project_root / PATH_EMBEDDING_STORE)
+identity = embedder_identity(EMBEDDER_MODEL, EMBEDDER_BACKEND, NORMALIZE_EMBEDDINGS)
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {"embedder": identity, "files": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def manifest_identity(manifest):
+    # Manifests written before the embedder backends existed record the model only, it ran in torch
+    return manifest.get("embedder") or embedder_identity(manifest.get("model"), "torch", NORMALIZE_EMBEDDINGS)
+
+
+def save_manifest(manifest, path):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def plan_ingestion(full_paths, manifest):
+    """Compare the content hashes of the PDFs with the manifest."""
+    hashes = {os.path.basename(full_path): file_fingerprint(full_path) for full_path in full_paths}
+    known = manifest["files"]
+    new = [filename for filename in hashes if filename not in known]
+    modified = [filename for filename in hashes if filename in known and known[filename]["sha256"] != hashes[filename]]
+    deleted = [filename for filename in known if filename not in hashes]
+    return hashes, new, modified, deleted
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+
+def write_segments_json(store, path):
+    """Write the segments of the store as one JSON list, line by line."""
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write("[")
+        for i, segment in enumerate(store.iter_segments()):
+            f.write((", " if i else "") + json.dumps(segment, ensure_ascii=False))
+        f.write("]")
+    os.replace(path + ".tmp", path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest new, modified and deleted PDFs incrementally.")
+    parser.add_argument("--processes", type=int, default=None, help="Number of worker processes for extraction")
+    parser.add_argument("--sync-index", action="store_true", help="Upsert the changes into the Chroma index right away")
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and re-ingest all PDFs")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted ingestion from its last checkpoint")
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE, help="Segments embedded and written per step")
+    args = parser.parse_args()
+
+    manifest = load_manifest(path_manifest)
+    # Embeddings of another embedder identity are not reused
+    reuse_embeddings = manifest_identity(manifest) == identity
+    if args.full or not reuse_embeddings:
+        manifest = {"embedder": identity, "files": {}}
+
+    full_paths = list_pdfs(pdf_path)
+    hashes, new, modified, deleted = plan_ingestion(full_paths, manifest)
+
+    # Existing embeddings by segment id, only the ids are loaded
+    store = EmbeddingStore(path_store)
+    old_rows = store.index_rows() if store.exists and reuse_embeddings else {}
+    old_embeddings = store.open_embeddings() if store.exists and reuse_embeddings else None
+
+    # PDFs whose segments are missing from the store are ingested again
+    modified += [filename for filename in hashes if filename not in new and filename not in modified
+                 and any(segment_id not in old_rows for segment_id in manifest["files"][filename]["segment_ids"])]
+    print(f"{len(new)} new, {len(modified)} modified, {len(deleted)} deleted, "
+          f"{len(full_paths) - len(new) - len(modified)} unchanged PDFs")
+    if not (new or modified or deleted):
+        print(f"Script finished.")
+        sys.exit(0)
+
+    # A checkpoint is only valid if the PDFs it covers did not change since
+    writer = EmbeddingStoreWriter(path_store, dtype=EMBEDDING_STORE_DTYPE, resume=args.resume)
+    state = writer.state
+    if state is not None and (state.get("embedder") != identity or
+                              any(hashes.get(filename) != entry["sha256"] for filename, entry in state["files"].items())):
+        print(f"Discarding the checkpoint, the PDFs changed since")
+        writer.close()
+        writer = EmbeddingStoreWriter(path_store, dtype=EMBEDDING_STORE_DTYPE)
+        state = None
+    if state is None:
+        state = {"embedder": identity, "files": {}}
+    done = state["files"]
+    if done:
+        print(f"Resuming after {len(done)} PDFs ({writer.count} segments)")
+
+    database = None
+    if args.sync_index:
+        from src.database_backends import create_document_database
+        database = create_document_database("chroma", sync=False)
+        stored_hashes = database.stored_hashes()
+
+    embedder = None
+    n_embedded = 0
+
+    def write_chunk(segments, embeddings):
+        writer.append(segments, embeddings)
+        if database is not None:
+            database.upsert_segments([dict(segment, embedding=embedding) for segment, embedding in zip(segments, embeddings)],
+                                     stored_hashes)
+
+    changed = set(new) | set(modified)
+    extracted = iter_extracted_pdfs([p for p in full_paths if os.path.basename(p) in changed - set(done)],
+                                    processes=args.processes)
+    for full_path in full_paths:
+        filename = os.path.basename(full_path)
+        if filename in done:
+            continue
+
+        if filename not in changed:
+            # Unchanged PDF: copy its segments and embeddings from the old store
+            segment_ids = manifest["files"][filename]["segment_ids"]
+            for ids in chunks(segment_ids, args.chunk_size):
+                rows = [old_rows[segment_id] for segment_id in ids]
+                write_chunk(store.read_segments(rows), np.asarray(old_embeddings[rows]))
+        else:
+            extracted_path, segments = next(extracted)
+            assert extracted_path == full_path
+            segment_ids = [segment["id"] for segment in segments]
+            for chunk in chunks(segments, args.chunk_size):
+                # Embed only segments whose id (i.e. content) is not in the store yet
+                to_embed = [i for i, segment in enumerate(chunk) if segment["id"] not in old_rows]
+                reused = [i for i, segment in enumerate(chunk) if segment["id"] in old_rows]
+                embeddings = None
+                if to_embed:
+                    if embedder is None:
+                        from src.embedder import Embedder
+                        embedder = Embedder(EMBEDDER_MODEL, normalize=NORMALIZE_EMBEDDINGS)
+                    new_embeddings = embedder.embed_documents([chunk[i]["text"] for i in to_embed],
+                                                              max_tokens_per_batch=EMBED_TOKEN_BUDGET)
+                    embeddings = np.zeros((len(chunk), new_embeddings.shape[1]), dtype=np.float32)
+                    embeddings[to_embed] = new_embeddings
+                    n_embedded += len(to_embed)
+                if reused:
+                    if embeddings is None:
+                        embeddings = np.zeros((len(chunk), old_embeddings.shape[1]), dtype=np.float32)
+                    embeddings[reused] = old_embeddings[[old_rows[chunk[i]["id"]] for i in reused]]
+                write_chunk(chunk, embeddings)
+
+        done[filename] = {"sha256": hashes[filename], "segment_ids": segment_ids}
+        writer.checkpoint(state)
+    print(f"Embedded {n_embedded} of {writer.count} segments")
+
+    header = writer.commit()
+    store = EmbeddingStore(path_store)
+
+    # Check the links and build the neighbor table without loading the texts
+    links = [{key: segment[key] for key in ("id", "previous_id", "next_id", "page", "filename", "document_date")}
+             for segment in store.iter_segments()]
+    test_segment_connections(links)
+    write_segments_json(store, path_segments)
+
+    # Update the manifest only after the store has been written
+    manifest["files"] = {os.path.basename(full_path): done[os.path.basename(full_path)] for full_path in full_paths}
+    save_manifest(manifest, path_manifest)
+    print(f"Saved {header['count']} segments to {store.path}")
+
+    if database is not None:
+        from src.context_window import NeighborTable
+        from src.metadata_index import MetadataIndex
+        segment_ids = {link["id"] for link in links}
+        database.delete_segments([segment_id for segment_id in stored_hashes if segment_id not in segment_ids])
+        database.commit_index(NeighborTable.from_segments(links), MetadataIndex.from_segments(links), header["fingerprint"])
+        print(f"Synchronized the Chroma index")
+
+    print(f"Script finished.")
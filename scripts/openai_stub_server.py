@@ -0,0 +1,103 @@
+import argparse
+import json
+import re
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A minimal OpenAI-compatible chat completions server for local tests and load tests.
+# Start it and point the pipeline at it:
+#   python scripts/openai_stub_server.py --port 8000 --delay 1.0
+#   OPENAI_BASE_URL=http://localhost:8000/v1 OPENAI_API_KEY=stub python main.py
+parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub server.")
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=8000)
+parser.add_argument("--delay", type=float, default=0.5, help="Seconds to wait before answering")
+parser.add_argument("--response", default="Stub-Antwort auf die Frage.",
+                    help="Content of every completion")
+parser.add_argument("--token-delay", type=float, default=0.02,
+                    help="Seconds between the chunks of a streamed completion (stream=true)")
+
+
+def completion_body(model, content):
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def chunk_body(completion_id, model, delta, finish_reason=None):
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so clients can reuse connections
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        time.sleep(self.server.delay)
+        if request.get("stream"):
+            self.stream_completion(request.get("model", "stub"))
+            return
+
+        body = json.dumps(completion_body(request.get("model", "stub"), self.server.response)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream_completion(self, model):
+        # Server-sent events, one chunk per word, like the OpenAI API with stream=true
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        words = re.findall(r"\S+\s*", self.server.response)
+        events = [chunk_body(completion_id, model, {"role": "assistant", "content": ""})]
+        events += [chunk_body(completion_id, model, {"content": word}) for word in words]
+        events += [chunk_body(completion_id, model, {}, finish_reason="stop")]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, event in enumerate([f"data: {json.dumps(e)}\n\n" for e in events] + ["data: [DONE]\n\n"]):
+                if 1 < i <= len(words):
+                    time.sleep(self.server.token_delay)
+                data = event.encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the stream
+            print(f"Stream cancelled after {max(i - 1, 0)} of {len(words)} words")
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.delay = args.delay
+    server.response = args.response
+    server.token_delay = args.token_delay
+    print(f"Serving stub OpenAI API on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
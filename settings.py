@@ -3,12 +3,59 @@ import os
 MIN_CHARS_PER_CHUNK = 5
 EMBEDDER_MODEL = "danielheinz/e5-base-sts-en-de"
 NORMALIZE_EMBEDDINGS = True
+EMBED_TOKEN_BUDGET = 8192  # padded tokens per batch when embedding the corpus
+EMBEDDER_BACKEND = "torch"  # "torch" (float32), "torch-int8" (dynamic int8 quantization) or "onnx" (ONNX Runtime)
+EMBEDDER_THREADS = None  # intra-op threads of the embedder, None for the default of the backend
+PATH_ONNX_MODELS = "data/snapshot/onnx"  # models exported for the "onnx" backend
+INGEST_CHUNK_SIZE = 256  # segments embedded and written per step of the ingestion
+EMBEDDING_CACHE_SIZE = 1024  # query embeddings kept in memory (LRU), 0 disables the cache
+EMBEDDING_CACHE_PATH = "data/cache/query_embeddings.sqlite"  # shared on-disk cache, None to disable
+EMBEDDING_CACHE_DISK_SIZE = 100_000  # query embeddings kept on disk
+STARTUP_SNAPSHOT_PATH = "data/snapshot"  # models saved by scripts/build_startup_snapshot.py, None to disable
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")  # e.g. a local OpenAI-compatible server, None for the OpenAI API
 OPENAI_MODEL_NAME = "gpt-4o"
 TEMPERATURE = 0.0
 MAX_TOKENS = 4096
+PROMPT_TOKEN_BUDGET = 6000  # tokens of the system and user prompt, None disables packing
+REFUSAL_PREFIX = "Hoppla"  # start of the response if the documents do not answer the question
+ASYNC_MAX_CONCURRENCY = 32  # in-flight LLM calls of an AsyncRAGPipeline
+ASYNC_EXECUTOR_WORKERS = 4  # threads for embedding and retrieval of an AsyncRAGPipeline
+EMBED_BATCH_MAX_SIZE = 32  # concurrent queries embedded in one forward pass
+EMBED_BATCH_MAX_WAIT_MS = 5  # how long the first query of a batch waits for more queries
 
-PATH_SEGMENTS = "data/segments/segments_with_embeddings.pkl"
+PATH_SEGMENTS = "data/segments/segments_with_embeddings.pkl"  # legacy pickle, import/export only
+PATH_EMBEDDING_STORE = "data/segments/store"
+EMBEDDING_STORE_DTYPE = "float32"  # "float32" or "float16"
+DOCUMENT_DATABASE_BACKEND = "chroma"  # "chroma" (HNSW), "hnsw" (hnswlib, built offline), "numpy" (exact) or "docarray" (exact)
+HNSW_M = 16  # links per node of the HNSW graph, more for higher recall at a larger index
+HNSW_CONSTRUCTION_EF = 200  # candidate list while building, more for a better graph at a slower build
+HNSW_SEARCH_EF = 100  # candidate list while searching, default of the per-query ef, see scripts/build_hnsw_index.py
+HNSW_NUM_THREADS = None  # threads of the HNSW build, None for all cores
+HNSW_EXACT_SEARCH_ROWS = 20_000  # hnsw backend: filtered searches over fewer allowed rows are exact
+PATH_HNSW_INDEX = "data/segments/hnsw_index.bin"
+EMBEDDING_QUANTIZATION = None  # numpy backend: None (float32), "float16", "int8" or "binary"
+QUANTIZATION_RESCORE = 4  # rescore a shortlist of QUANTIZATION_RESCORE * limit hits exactly, 0 disables
+HYBRID_SEARCH = True  # fuse dense results with a BM25 index of the segments (reciprocal-rank fusion)
+HYBRID_CANDIDATES = 50  # candidates of each retriever that are fused
+RRF_K = 60
+PATH_LEXICAL_INDEX = "data/segments/lexical_index.npz"
 DOCUMENT_LIMIT = 5
-EXTRA_CONTEXT = True
\ No newline at end of file
+EXTRA_CONTEXT = True
+CONTEXT_RADIUS = 1  # number of neighboring segments added before and after every hit
+
+ANSWER_CACHE_SIZE = 512  # cached LLM responses, 0 disables the answer cache
+ANSWER_CACHE_THRESHOLD = 0.95  # minimum cosine similarity of a cached query
+ANSWERABILITY_GATE = False  # answer "Hoppla" without an LLM call if nothing relevant is retrieved
+ANSWERABILITY_MIN_SIMILARITY = 0.8  # cosine similarity of the best hit, see scripts/evaluate_answerability_gate.py
+ANSWERABILITY_MIN_CROSS_SCORE = None  # cross-encoder score of the best hit, None to not use the cross-encoder
+ANSWERABILITY_CROSS_ENCODER_DOCS = 5  # best hits scored by the cross-encoder
+CROSS_ENCODER_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"  # multilingual, about 120M parameters
+CROSS_ENCODER_BATCH_SIZE = 16
+CROSS_ENCODER_CACHE_SIZE = 10_000  # cached (query, segment) scores
+RERANK = False  # rerank a wider candidate set with the cross-encoder before building the prompt
+RERANK_CANDIDATES = 30  # candidates retrieved for reranking
+
+TRACING = False  # spans of every request and latency histograms per stage (RAGPipeline.tracer)
+TRACE_PATH = None  # with TRACING, the trace of every request is appended to this JSON lines file
@@ -1,6 +1,25 @@
-from .embedder import Embedder
-from .rag_pipeline import RAGPipeline
-from .chatgpt_client import ChatGPTClient
-from .prompt_constructor import PromptConstructor
+import importlib
 from .prompts import *
 
+# The classes are imported on first access, so importing a light module (e.g. src.prompts)
+# does not load torch, transformers, openai or chromadb
+_LAZY_IMPORTS = {
+    "Embedder": ".embedder",
+    "RAGPipeline": ".rag_pipeline",
+    "AsyncRAGPipeline": ".async_rag_pipeline",
+    "ChatGPTClient": ".chatgpt_client",
+    "AsyncChatGPTClient": ".chatgpt_client",
+    "PromptConstructor": ".prompt_constructor",
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_IMPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_IMPORTS))
@@ -0,0 +1,111 @@
+import threading
+import numpy as np
+from typing import List, Optional
+from settings import ANSWER_CACHE_SIZE, ANSWER_CACHE_THRESHOLD
+from .data_models import Document
+
+
+class AnswerCache:
+    '''
+    Semantic cache of LLM responses keyed on the similarity of query embeddings.
+
+    A cached response is returned if a previous query has a cosine similarity of at
+    least `threshold` to the new query and the prompt was built from the same
+    retrieved documents. All entries are dropped when the fingerprint of the segment
+    corpus changes. The least recently used entry is evicted when the cache is full.
+    '''
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, max_size: int = ANSWER_CACHE_SIZE):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.fingerprint = None
+        self.hits = 0
+        self.misses = 0
+        self.saved_latency = 0.0
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._embeddings = None
+        self._entries = []
+        self._last_used = np.zeros(self.max_size, dtype=np.int64)
+        self._clock = 0
+
+    @staticmethod
+    def documents_key(retrieved_docs: List[Document]) -> tuple:
+        # The texts differ with and without extra context, so they are part of the key
+        return tuple((doc.id, hash(doc.text)) for doc in retrieved_docs)
+
+    def _check_fingerprint(self, fingerprint: Optional[str]):
+        if fingerprint != self.fingerprint:
+            self.clear()
+            self.fingerprint = fingerprint
+
+    def lookup(self, query_embedding: np.ndarray, retrieved_docs: List[Document],
+               fingerprint: Optional[str] = None) -> Optional[str]:
+        '''
+        Return the cached response of a similar query with the same documents or None.
+
+        Parameters:
+        ----------
+        query_embedding: np.ndarray
+            The L2-normalized embedding of the query.
+        retrieved_docs: List[Document]
+            The documents the prompt is built from.
+        fingerprint: Optional[str]
+            The fingerprint of the segment corpus.
+
+        Returns:
+        -------
+        response: Optional[str]
+            The cached response.
+        '''
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            if self._entries:
+                key = self.documents_key(retrieved_docs)
+                similarities = self._embeddings[:len(self._entries)] @ np.asarray(query_embedding, dtype=np.float32)
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.threshold:
+                        break
+                    if self._entries[i]["key"] == key:
+                        self._clock += 1
+                        self._last_used[i] = self._clock
+                        self.hits += 1
+                        self.saved_latency += self._entries[i]["latency"]
+                        return self._entries[i]["response"]
+            self.misses += 1
+            return None
+
+    def store(self, query_embedding: np.ndarray, retrieved_docs: List[Document], response: str,
+              latency: float = 0.0, fingerprint: Optional[str] = None):
+        '''
+        Store the response and the latency of the LLM call that produced it.
+        '''
+        if self.max_size <= 0:
+            return
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            if self._embeddings is None:
+                self._embeddings = np.zeros((self.max_size, len(query_embedding)), dtype=np.float32)
+
+            if len(self._entries) < self.max_size:
+                i = len(self._entries)
+                self._entries.append(None)
+            else:
+                i = int(np.argmin(self._last_used))
+            self._embeddings[i] = query_embedding
+            self._entries[i] = {"key": self.documents_key(retrieved_docs), "response": response, "latency": latency}
+            self._clock += 1
+            self._last_used[i] = self._clock
+
+    @property
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "saved_latency": self.saved_latency,
+            "size": len(self._entries),
+        }
@@ -0,0 +1,86 @@
+import numpy as np
+from typing import List, Optional
+from settings import (ANSWERABILITY_MIN_SIMILARITY, ANSWERABILITY_MIN_CROSS_SCORE, ANSWERABILITY_CROSS_ENCODER_DOCS)
+from .data_models import Document
+
+
+class AnswerabilityGate:
+    '''
+    Decides before the LLM call whether the corpus can answer a question at all.
+
+    The retrieved documents carry their embeddings, so the cosine similarity of the
+    best hit is known without another search. Optionally a local cross-encoder scores
+    the best hits as well. A question is rejected only if every signal is below its
+    threshold, so a single confident signal lets it through.
+
+    The thresholds depend on the models and have to be calibrated on labeled queries,
+    see scripts/evaluate_answerability_gate.py.
+    '''
+    def __init__(self, min_similarity: Optional[float] = ANSWERABILITY_MIN_SIMILARITY,
+                 min_cross_score: Optional[float] = ANSWERABILITY_MIN_CROSS_SCORE,
+                 cross_encoder=None, cross_encoder_docs: int = ANSWERABILITY_CROSS_ENCODER_DOCS):
+        self.min_similarity = min_similarity
+        self.min_cross_score = min_cross_score
+        # A shared cross-encoder (e.g. of the rerank stage) is only used if there is a threshold for it
+        self.cross_encoder = None
+        if min_cross_score is not None:
+            if cross_encoder is None:
+                from .cross_encoder import CrossEncoder
+                cross_encoder = CrossEncoder()
+            self.cross_encoder = cross_encoder
+        self.cross_encoder_docs = cross_encoder_docs
+        self.checked = 0
+        self.rejected = 0
+
+    def features(self, query: str, query_embedding: np.ndarray, docs: List[Document]) -> dict:
+        '''
+        Return the retrieval statistics of a question.
+
+        Returns:
+        -------
+        features: dict
+            max_similarity (cosine similarity of the best hit), mean_similarity, margin
+            (max minus mean similarity) and max_cross_score (None without a cross-encoder).
+        '''
+        if not docs:
+            return {"max_similarity": -1.0, "mean_similarity": -1.0, "margin": 0.0,
+                    "max_cross_score": None if self.cross_encoder is None else -np.inf}
+        embeddings = np.stack([np.asarray(doc.embedding, dtype=np.float32) for doc in docs])
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        similarities = embeddings @ query_embedding / (
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query_embedding) + 1e-12)
+
+        max_cross_score = None
+        if self.cross_encoder is not None:
+            # Scoring the best hits suffices, a relevant segment ranks high in the hybrid search
+            max_cross_score = float(self.cross_encoder.score_documents(query, docs[:self.cross_encoder_docs]).max())
+
+        return {
+            "max_similarity": float(similarities.max()),
+            "mean_similarity": float(similarities.mean()),
+            "margin": float(similarities.max() - similarities.mean()),
+            "max_cross_score": max_cross_score,
+        }
+
+    def is_answerable(self, query: str, query_embedding: np.ndarray, docs: List[Document]) -> bool:
+        features = self.features(query, query_embedding, docs)
+        answerable = self.decide(features)
+        self.checked += 1
+        self.rejected += not answerable
+        return answerable
+
+    def decide(self, features: dict) -> bool:
+        '''
+        Return whether a question with the given features is answered by the LLM.
+        '''
+        signals = []
+        if self.min_similarity is not None:
+            signals.append(features["max_similarity"] >= self.min_similarity)
+        if self.min_cross_score is not None and features["max_cross_score"] is not None:
+            signals.append(features["max_cross_score"] >= self.min_cross_score)
+        return not signals or any(signals)
+
+    @property
+    def stats(self) -> dict:
+        return {"checked": self.checked, "rejected": self.rejected,
+                "reject_rate": self.rejected / self.checked if self.checked else 0.0}
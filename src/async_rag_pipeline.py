@@ -0,0 +1,239 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Optional
+from settings import (DOCUMENT_LIMIT, EXTRA_CONTEXT, ASYNC_MAX_CONCURRENCY, ASYNC_EXECUTOR_WORKERS,
+                      REFUSAL_PREFIX)
+from .chatgpt_client import AsyncChatGPTClient
+from .data_models import DocumentFilter
+from .prompts import REFUSAL_RESPONSE
+from .embedding_batcher import EmbeddingBatcher
+from .rag_pipeline import RAGPipelineBase
+
+
+class AsyncRAGPipeline(RAGPipelineBase):
+    '''
+    asyncio variant of the RAG pipeline for concurrent request handling.
+
+    The LLM is called with openai.AsyncOpenAI over a pooled HTTP client, at most
+    `max_concurrency` calls are in flight at once. Concurrent queries are embedded
+    together by an EmbeddingBatcher. Retrieval is blocking and runs in a thread pool,
+    so a single worker overlaps many questions that are waiting for the LLM.
+
+    Usage:
+        pipeline = AsyncRAGPipeline()
+        response = await pipeline.arun_with_retry(query)
+        await pipeline.aclose()
+    '''
+    client_class = AsyncChatGPTClient
+
+    def __init__(self, verbose: bool = False, max_concurrency: int = ASYNC_MAX_CONCURRENCY,
+                 executor_workers: int = ASYNC_EXECUTOR_WORKERS, search_options: Optional[dict] = None):
+        super().__init__(verbose=verbose, search_options=search_options)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix="rag")
+        self.embedding_batcher = EmbeddingBatcher(self.embedder)
+
+    async def _in_executor(self, func, *args):
+        loop = asyncio.get_running_loop()
+        # Run in a copy of the context, so the spans of the thread are added to the trace of the request
+        return await loop.run_in_executor(self.executor, contextvars.copy_context().run, func, *args)
+
+    async def _aembed_query(self, query: str):
+        with self.tracer.span("embed"):
+            return (await self.embedding_batcher.aembed(query.strip()))[0]
+
+    async def arun(self, query: str, doc_limit: int = DOCUMENT_LIMIT, extra_context: bool = EXTRA_CONTEXT,
+                   filter: Optional[DocumentFilter] = None) -> str:
+        '''
+        Run the RAG pipeline.
+
+        Parameters:
+        ----------
+        query: str
+            The query to answer.
+        doc_limit: int
+            Number of documents to retrieve
+        extra_context: bool
+            Whether to include extra context
+        filter: Optional[DocumentFilter]
+            Only documents of these files and/or dates are retrieved
+
+        Returns:
+        -------
+        response: str
+            The response to the query.
+        '''
+        with self.tracer.span("request", method="arun"):
+            query_embedding = await self._aembed_query(query)
+            retrieved_docs = await self._in_executor(self._retrieve, query_embedding, doc_limit, extra_context, query,
+                                                     filter)
+            if not await self._in_executor(self._answerable, query, query_embedding, retrieved_docs):
+                return REFUSAL_RESPONSE
+            with self.tracer.span("attempt", attempt=1, documents=len(retrieved_docs)):
+                return await self._agenerate(query, query_embedding, retrieved_docs)
+
+    async def _agenerate(self, query: str, query_embedding, retrieved_docs) -> str:
+        import time
+
+        # The similarity lookup and the token counting of the prompt are CPU-bound, they run in the executor
+        response = await self._in_executor(self._cached_response, query_embedding, retrieved_docs)
+        if response is not None:
+            return response
+
+        prompt = await self._in_executor(self._construct_prompt, query, retrieved_docs)
+
+        async with self.semaphore:
+            with self.tracer.span("llm") as span:
+                start = time.time()
+                response = await self.chatgpt_client.generate_response(prompt)
+                latency = time.time() - start
+                self._trace_response(span, response)
+
+        self._cache_response(query_embedding, retrieved_docs, response, latency)
+        return response
+
+    async def _agenerate_stream(self, query: str, query_embedding, retrieved_docs,
+                                cancel_on_refusal: bool = False) -> AsyncIterator[str]:
+        import time
+
+        response = await self._in_executor(self._cached_response, query_embedding, retrieved_docs)
+        if response is not None:
+            yield response
+            return
+
+        prompt = await self._in_executor(self._construct_prompt, query, retrieved_docs)
+
+        parts = []
+        cancelled = False
+        async with self.semaphore:
+            with self.tracer.span("llm", stream=True) as span:
+                start = time.time()
+                stream = self.chatgpt_client.generate_response_stream(prompt, cancel_on_refusal)
+                try:
+                    async for text in stream:
+                        if not parts:
+                            span.set(first_token_s=round(time.time() - start, 3))
+                            cancelled = cancel_on_refusal and text.startswith(REFUSAL_PREFIX)
+                        parts.append(text)
+                        if cancelled:
+                            break
+                        yield text
+                finally:
+                    await stream.aclose()
+                latency = time.time() - start
+                response = "".join(parts)
+                self._trace_response(span, response, cancelled)
+
+        if cancelled:
+            # See RAGPipeline._generate_stream: yielded after the try is recorded, not cached
+            yield response
+            return
+        self._cache_response(query_embedding, retrieved_docs, response, latency)
+
+    async def arun_with_retry(self, query: str, max_retries: int = 2, doc_limit_increment: int = 2,
+                              filter: Optional[DocumentFilter] = None) -> str:
+        '''
+        Run the RAG pipeline with automatic retry on "Hoppla" responses.
+
+        Parameters:
+        ----------
+        query: str
+            The query to answer
+        max_retries: int
+            Maximum number of retry attempts
+        doc_limit_increment: int
+            How much to increase the document limit on each retry
+        filter: Optional[DocumentFilter]
+            Only documents of these files and/or dates are retrieved
+
+        Returns:
+        -------
+        response: str
+            The final response to the query
+        '''
+        with self.tracer.span("request", method="arun_with_retry"):
+            return await self._arun_with_retry(query, max_retries, doc_limit_increment, filter)
+
+    async def _arun_with_retry(self, query: str, max_retries: int, doc_limit_increment: int,
+                               filter: Optional[DocumentFilter]) -> str:
+        current_limit = DOCUMENT_LIMIT
+        current_try = 0
+        extra_context = EXTRA_CONTEXT
+
+        query_embedding = await self._aembed_query(query)
+        max_limit = DOCUMENT_LIMIT + max_retries * doc_limit_increment
+        hits = await self._in_executor(self._retrieve, query_embedding, max_limit, False, query, filter)
+        if not await self._in_executor(self._answerable, query, query_embedding, hits):
+            return REFUSAL_RESPONSE
+
+        while current_try <= max_retries:
+            retrieved_docs = hits[:current_limit]
+            if extra_context:
+                retrieved_docs = await self._in_executor(self.document_database.add_context, retrieved_docs)
+            with self.tracer.span("attempt", attempt=current_try + 1, documents=len(retrieved_docs)):
+                response = await self._agenerate(query, query_embedding, retrieved_docs)
+
+            if not response.startswith(REFUSAL_PREFIX):
+                return response
+
+            current_try += 1
+            current_limit += doc_limit_increment
+            extra_context = True  # includes the previous and subsequent document of every hit
+
+        return response  # Return last response if all retries failed
+
+    async def arun_stream(self, query: str, max_retries: int = 2, doc_limit_increment: int = 2,
+                          filter: Optional[DocumentFilter] = None) -> AsyncIterator[str]:
+        '''
+        Run the RAG pipeline with retries and yield the response as it is generated, see RAGPipeline.run_stream.
+        '''
+        with self.tracer.span("request", method="arun_stream"):
+            chunks = self._arun_stream(query, max_retries, doc_limit_increment, filter)
+            try:
+                async for text in chunks:
+                    yield text
+            finally:
+                await chunks.aclose()
+
+    async def _arun_stream(self, query: str, max_retries: int, doc_limit_increment: int,
+                           filter: Optional[DocumentFilter]) -> AsyncIterator[str]:
+        current_limit = DOCUMENT_LIMIT
+        current_try = 0
+        extra_context = EXTRA_CONTEXT
+
+        query_embedding = await self._aembed_query(query)
+        max_limit = DOCUMENT_LIMIT + max_retries * doc_limit_increment
+        hits = await self._in_executor(self._retrieve, query_embedding, max_limit, False, query, filter)
+        if not await self._in_executor(self._answerable, query, query_embedding, hits):
+            yield REFUSAL_RESPONSE
+            return
+
+        while True:
+            retrieved_docs = hits[:current_limit]
+            if extra_context:
+                retrieved_docs = await self._in_executor(self.document_database.add_context, retrieved_docs)
+            last_try = current_try >= max_retries
+            chunks = self._agenerate_stream(query, query_embedding, retrieved_docs, cancel_on_refusal=not last_try)
+            with self.tracer.span("attempt", attempt=current_try + 1, documents=len(retrieved_docs)):
+                try:
+                    first = await anext(chunks, "")
+                    if last_try or not first.startswith(REFUSAL_PREFIX):
+                        yield first
+                        async for text in chunks:
+                            yield text
+                        return
+                finally:
+                    await chunks.aclose()
+
+            current_try += 1
+            current_limit += doc_limit_increment
+            extra_context = True  # includes the previous and subsequent document of every hit
+
+    async def aclose(self):
+        '''
+        Close the HTTP connections and stop the executor and the embedding batcher.
+        '''
+        await self.chatgpt_client.aclose()
+        self.executor.shutdown(wait=False)
+        self.embedding_batcher.close()
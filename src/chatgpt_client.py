@@ -1,27 +1,142 @@
 import openai
-from settings import OPENAI_API_KEY, OPENAI_MODEL_NAME, TEMPERATURE, MAX_TOKENS
+import httpx
+from settings import (OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL_NAME, TEMPERATURE, MAX_TOKENS,
+                      ASYNC_MAX_CONCURRENCY, REFUSAL_PREFIX)
 from .prompts import SYSTEM_PROMPT
 
 # Check if the OPENAI_API_KEY is set in the constants.py file
 if OPENAI_API_KEY is None or len(OPENAI_API_KEY) == 0:
     raise ValueError("OPENAI_API_KEY is not set in the constants.py file")
 
+
+def _may_become_refusal(text: str) -> bool:
+    # True while the start of a response is too short to tell whether it is a refusal
+    return len(text) < len(REFUSAL_PREFIX) and REFUSAL_PREFIX.startswith(text)
+
+
+def _delta(chunk) -> str:
+    return (chunk.choices[0].delta.content or "") if chunk.choices else ""
+
+
 class ChatGPTClient:
     def __init__(self):
-        self.client = openai.OpenAI(api_key=OPENAI_API_KEY)
+        self.client = openai.OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
         self.system_prompt = SYSTEM_PROMPT
         self.temperature = TEMPERATURE
         self.max_tokens = MAX_TOKENS
 
+    def _messages(self, prompt):
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+
     def generate_response(self, prompt):
         response = self.client.chat.completions.create(
             model=OPENAI_MODEL_NAME,
-            messages=[
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": prompt}
-            ],
+            messages=self._messages(prompt),
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+        )
+        return response.choices[0].message.content
+
+    def generate_response_stream(self, prompt, cancel_on_refusal: bool = False):
+        '''
+        Generate the response and yield its text as it arrives.
+
+        The start of the response is held back until it is clear whether it begins with
+        REFUSAL_PREFIX, so the first chunk is either the whole refusal prefix or does not
+        start with it. Responses that do not start like a refusal are not delayed.
+
+        Parameters:
+        ----------
+        prompt: str
+            The user prompt.
+        cancel_on_refusal: bool
+            Close the stream after the first chunk if the response is a refusal, so
+            the rest of it is neither generated nor paid for.
+        '''
+        stream = self.client.chat.completions.create(
+            model=OPENAI_MODEL_NAME,
+            messages=self._messages(prompt),
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            stream=True,
+        )
+        try:
+            head = ""
+            for chunk in stream:
+                text = _delta(chunk)
+                if head is None:
+                    if text:
+                        yield text
+                    continue
+                head += text
+                if _may_become_refusal(head):
+                    continue
+                yield head
+                if cancel_on_refusal and head.startswith(REFUSAL_PREFIX):
+                    return
+                head = None
+            if head:
+                yield head
+        finally:
+            # Closes the HTTP response, the server stops generating
+            stream.close()
+
+
+class AsyncChatGPTClient(ChatGPTClient):
+    def __init__(self, max_concurrency: int = ASYNC_MAX_CONCURRENCY):
+        # One pooled HTTP client, so connections are reused across requests
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            timeout=httpx.Timeout(600.0, connect=5.0),
+        )
+        self.client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL,
+                                         http_client=self.http_client)
+        self.system_prompt = SYSTEM_PROMPT
+        self.temperature = TEMPERATURE
+        self.max_tokens = MAX_TOKENS
+
+    async def generate_response(self, prompt):
+        response = await self.client.chat.completions.create(
+            model=OPENAI_MODEL_NAME,
+            messages=self._messages(prompt),
             temperature=self.temperature,
             max_tokens=self.max_tokens,
         )
         return response.choices[0].message.content
 
+    async def generate_response_stream(self, prompt, cancel_on_refusal: bool = False):
+        '''
+        Generate the response and yield its text as it arrives, see ChatGPTClient.generate_response_stream.
+        '''
+        stream = await self.client.chat.completions.create(
+            model=OPENAI_MODEL_NAME,
+            messages=self._messages(prompt),
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            stream=True,
+        )
+        try:
+            head = ""
+            async for chunk in stream:
+                text = _delta(chunk)
+                if head is None:
+                    if text:
+                        yield text
+                    continue
+                head += text
+                if _may_become_refusal(head):
+                    continue
+                yield head
+                if cancel_on_refusal and head.startswith(REFUSAL_PREFIX):
+                    return
+                head = None
+            if head:
+                yield head
+        finally:
+            await stream.close()
+
+    async def aclose(self):
+        await self.client.close()
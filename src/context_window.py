@@ -0,0 +1,111 @@
+import numpy as np
+from typing import List, Optional, Sequence, Tuple
+
+
+class NeighborTable:
+    '''
+    Array-indexed previous/next chain of the segments.
+
+    The previous_id/next_id links of the segments (see scripts/extract_segments_from_pdfs.py)
+    are resolved once at index time. Every chain (one per PDF) is laid out contiguously
+    in `order`, so the window of ±k segments around a hit is a slice of `order` and
+    the context of all hits of a query is expanded with a few array operations.
+    '''
+    def __init__(self, ids: Sequence[str], previous_ids: Sequence[Optional[str]], next_ids: Sequence[Optional[str]]):
+        self.ids = list(ids)
+        self.row_by_id = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        n = len(self.ids)
+
+        previous_rows = np.array([self.row_by_id.get(doc_id, -1) if doc_id else -1 for doc_id in previous_ids], dtype=np.int64)
+        next_rows = np.array([self.row_by_id.get(doc_id, -1) if doc_id else -1 for doc_id in next_ids], dtype=np.int64)
+
+        # Walk every chain from its head and lay it out contiguously
+        order = []
+        chain_start = []
+        visited = np.zeros(n, dtype=bool)
+        heads = [row for row in range(n) if previous_rows[row] == -1]
+        # Rows that are not reachable from a head (broken links or cycles) start their own chain
+        for head in heads + list(range(n)):
+            if visited[head]:
+                continue
+            chain_start.append(len(order))
+            row = head
+            while row != -1 and not visited[row]:
+                visited[row] = True
+                order.append(row)
+                row = next_rows[row]
+
+        self.order = np.array(order, dtype=np.int64)
+        self.position = np.empty(n, dtype=np.int64)
+        self.position[self.order] = np.arange(n)
+        starts = np.array(chain_start, dtype=np.int64)
+        # First and last position of the chain of every row
+        chain_of_position = np.searchsorted(starts, np.arange(n), side="right") - 1
+        stops = np.append(starts[1:], n) - 1
+        self.chain_first = np.empty(n, dtype=np.int64)
+        self.chain_last = np.empty(n, dtype=np.int64)
+        self.chain_first[self.order] = starts[chain_of_position]
+        self.chain_last[self.order] = stops[chain_of_position]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def expand(self, rows: Sequence[int], radius: int = 1) -> List[Tuple[int, np.ndarray]]:
+        '''
+        Expand hits to windows of ±radius segments and merge overlapping windows.
+
+        Parameters:
+        ----------
+        rows: Sequence[int]
+            The rows of the hits, in rank order.
+        radius: int
+            The number of segments to add before and after every hit.
+
+        Returns:
+        -------
+        windows: List[Tuple[int, np.ndarray]]
+            One (rank, rows) pair per merged window, ordered by the best-ranked hit
+            it contains. rank is the index of that hit in `rows`, the rows of the
+            window are in document order.
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return []
+        positions = self.position[rows]
+        starts = np.maximum(positions - radius, self.chain_first[rows])
+        stops = np.minimum(positions + radius, self.chain_last[rows])
+
+        # Merge windows that overlap or touch within the same chain
+        windows = []
+        for i in np.argsort(starts, kind="stable"):
+            start, stop, rank = starts[i], stops[i], i
+            if windows and start <= windows[-1][1] + 1 and self.chain_first[rows[i]] == windows[-1][3]:
+                windows[-1][1] = max(windows[-1][1], stop)
+                windows[-1][2] = min(windows[-1][2], rank)
+            else:
+                windows.append([start, stop, rank, self.chain_first[rows[i]]])
+
+        windows.sort(key=lambda window: window[2])
+        return [(int(rank), self.order[start:stop + 1]) for start, stop, rank, _ in windows]
+
+    def save(self, path: str):
+        np.savez(path, ids=np.array(self.ids), order=self.order, position=self.position,
+                 chain_first=self.chain_first, chain_last=self.chain_last)
+
+    @classmethod
+    def load(cls, path: str) -> "NeighborTable":
+        data = np.load(path)
+        table = cls.__new__(cls)
+        table.ids = data["ids"].tolist()
+        table.row_by_id = {doc_id: row for row, doc_id in enumerate(table.ids)}
+        table.order = data["order"]
+        table.position = data["position"]
+        table.chain_first = data["chain_first"]
+        table.chain_last = data["chain_last"]
+        return table
+
+    @classmethod
+    def from_segments(cls, segments: Sequence[dict]) -> "NeighborTable":
+        return cls([segment["id"] for segment in segments],
+                   [segment.get("previous_id") for segment in segments],
+                   [segment.get("next_id") for segment in segments])
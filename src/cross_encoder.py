@@ -0,0 +1,100 @@
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+import torch
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import List, Optional
+from settings import CROSS_ENCODER_MODEL, CROSS_ENCODER_BATCH_SIZE, CROSS_ENCODER_CACHE_SIZE
+from .data_models import Document
+from .snapshot import model_path
+
+
+class CrossEncoder:
+    '''
+    Scores the relevance of (query, segment) pairs with a small local cross-encoder.
+
+    Unlike the bi-encoder of the Embedder, the model reads the query and the segment
+    together, which ranks much more precisely but needs one forward pass per pair.
+    Pairs are scored in batches on the CPU. Scores of documents are kept in a bounded
+    LRU cache keyed on the query and the segment id, so retries, the answerability
+    gate and repeated questions do not score a pair twice.
+    '''
+    def __init__(self, model_name: str = CROSS_ENCODER_MODEL, batch_size: int = CROSS_ENCODER_BATCH_SIZE,
+                 max_length: int = 512, cache_size: int = CROSS_ENCODER_CACHE_SIZE, path: Optional[str] = None):
+        self.model_name = model_name
+        path = path or model_path(model_name)
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+        self.model = AutoModelForSequenceClassification.from_pretrained(path)
+        self.model.eval()
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+
+    def score(self, query: str, texts: List[str]) -> np.ndarray:
+        '''
+        Return the relevance score (logit) of every text for the query, higher is more relevant.
+        '''
+        scores = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i+self.batch_size]
+            inputs = self.tokenizer([query] * len(batch), batch, return_tensors="pt", truncation="only_second",
+                                    padding=True, max_length=self.max_length)
+            with torch.no_grad():
+                logits = self.model(**inputs).logits
+            # Models with a single output give the relevance logit, binary classifiers the "relevant" class
+            scores.append(logits[:, 0] if logits.shape[1] == 1 else logits[:, 1] - logits[:, 0])
+        if not scores:
+            return np.zeros(0, dtype=np.float32)
+        return torch.cat(scores).numpy().astype(np.float32)
+
+    def score_documents(self, query: str, docs: List[Document]) -> np.ndarray:
+        '''
+        Return the relevance score of every document for the query, using the cache.
+
+        The documents that are not cached are scored together in one batched pass.
+        '''
+        query_key = hashlib.sha256(" ".join(query.split()).encode("utf-8")).hexdigest()
+        # The text hash is part of the key, since neighbor context extends the text of a hit
+        keys = [(query_key, doc.id, hash(doc.text)) for doc in docs]
+        scores = np.empty(len(docs), dtype=np.float32)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                score = self._scores.get(key)
+                if score is None:
+                    missing.append(i)
+                else:
+                    self._scores.move_to_end(key)
+                    scores[i] = score
+            self.hits += len(docs) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            scores[missing] = self.score(query, [docs[i].text for i in missing])
+            with self._lock:
+                for i in missing:
+                    self._scores[keys[i]] = float(scores[i])
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+        return scores
+
+    def rerank(self, query: str, docs: List[Document], limit: int) -> List[Document]:
+        '''
+        Return the `limit` most relevant documents for the query, best first.
+        '''
+        if not docs:
+            return []
+        scores = self.score_documents(query, docs)
+        order = np.argsort(-scores, kind="stable")[:limit]
+        return [docs[i] for i in order]
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._scores)}
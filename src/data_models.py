@@ -1,6 +1,7 @@
 from pydantic import BaseModel
+import datetime
 import numpy as np
-from typing import Optional
+from typing import List, Optional, Tuple
 
 class Document(BaseModel):
     text: str
@@ -14,4 +15,36 @@ class Document(BaseModel):
     document_date: str
 
     class Config:
-        arbitrary_types_allowed = True  # Required for numpy array support
\ No newline at end of file
+        arbitrary_types_allowed = True  # Required for numpy array support
+
+class DocumentFilter(BaseModel):
+    '''
+    Restricts a search to documents of the given files and/or a range of document dates.
+
+    Dates are given as "dd.mm.yyyy" (like Document.document_date) or "yyyy-mm-dd",
+    both bounds are inclusive.
+    '''
+    filenames: Optional[List[str]] = None
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+
+    def date_range(self) -> Tuple[Optional[int], Optional[int]]:
+        return (date_to_int(self.date_from) if self.date_from else None,
+                date_to_int(self.date_to) if self.date_to else None)
+
+    @property
+    def is_empty(self) -> bool:
+        return self.filenames is None and self.date_from is None and self.date_to is None
+
+
+def date_to_int(date: str) -> int:
+    '''
+    Convert a "dd.mm.yyyy" or "yyyy-mm-dd" date to a sortable integer yyyymmdd.
+    '''
+    for date_format in ("%d.%m.%Y", "%Y-%m-%d"):
+        try:
+            parsed = datetime.datetime.strptime(date, date_format)
+        except ValueError:
+            continue
+        return parsed.year * 10000 + parsed.month * 100 + parsed.day
+    raise ValueError(f"Invalid date {date}, expected dd.mm.yyyy or yyyy-mm-dd")
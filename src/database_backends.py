@@ -0,0 +1,36 @@
+from settings import DOCUMENT_DATABASE_BACKEND
+
+BACKENDS = ("chroma", "hnsw", "numpy", "docarray")
+
+
+def create_document_database(backend: str = DOCUMENT_DATABASE_BACKEND, **kwargs):
+    '''
+    Create the DocumentDatabase of the given backend.
+
+    Parameters:
+    ----------
+    backend: str
+        "chroma" (HNSW, src/document_database_2.py), "hnsw" (hnswlib graph built
+        offline, src/document_database_4.py), "numpy" (exact search over a NumPy
+        matrix, src/document_database_3.py) or "docarray" (exact search,
+        src/document_database.py).
+    kwargs:
+        Passed to the DocumentDatabase constructor.
+
+    Returns:
+    -------
+    document_database: DocumentDatabase
+        The document database.
+    '''
+    # Backends are imported lazily so only the selected backend's dependencies are loaded
+    if backend == "chroma":
+        from .document_database_2 import DocumentDatabase
+    elif backend == "hnsw":
+        from .document_database_4 import DocumentDatabase
+    elif backend == "numpy":
+        from .document_database_3 import DocumentDatabase
+    elif backend == "docarray":
+        from .document_database import DocumentDatabase
+    else:
+        raise ValueError(f"Unknown document database backend {backend}, expected one of {BACKENDS}")
+    return DocumentDatabase(**kwargs)
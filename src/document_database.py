@@ -1,29 +1,39 @@
 
 import numpy as np
-import pickle as pkl
 from docarray import DocList
 from docarray.index import InMemoryExactNNIndex
-from typing import List
-from settings import PATH_SEGMENTS
-from .data_models import Document
+from typing import List, Optional
+from settings import CONTEXT_RADIUS, HYBRID_SEARCH, HYBRID_CANDIDATES
+from .context_window import NeighborTable
+from .data_models import Document, DocumentFilter
+from .embedding_store import load_segments, segments_fingerprint
+from .lexical_index import load_lexical_index, reciprocal_rank_fusion
+from .metadata_index import MetadataIndex
 
 
 class DocumentDatabase:
-    def __init__(self):
+    def __init__(self, hybrid: bool = HYBRID_SEARCH):
+        self.hybrid = hybrid
+        self.lexical_index = None
+        self.fingerprint = segments_fingerprint()
         self.load_segments()
         self.doc_index = InMemoryExactNNIndex[Document]()
         self.index_documents()
 
     def load_segments(self):
-        with open(PATH_SEGMENTS, "rb") as f:
-            segments = pkl.load(f)
-        self.segments = segments
+        self.segments = load_segments()
 
     def index_documents(self):
         doc_list = DocList[Document]([Document(**segment) for segment in self.segments])
         self.doc_index.index(doc_list)
+        self.neighbors = NeighborTable.from_segments(self.segments)
+        self.metadata_index = MetadataIndex.from_segments(self.segments)
+        if self.hybrid:
+            self.lexical_index = load_lexical_index(self.fingerprint, self.segments)
 
-    def find(self, query_embedding: np.ndarray, limit: int = 5, extra_context: bool = True) -> List[Document]:
+    def find(self, query_embedding: np.ndarray, limit: int = 5, extra_context: bool = True,
+             context_radius: int = CONTEXT_RADIUS, query_text: Optional[str] = None,
+             filter: Optional[DocumentFilter] = None, **search_options) -> List[Document]:
         '''
         Find the most relevant documents for a given query embedding.
 
@@ -35,31 +45,55 @@ class DocumentDatabase:
             The number of documents to return.
         extra_context: bool
             Whether to return the most relevant documents with extra context.
+        context_radius: int
+            The number of neighboring segments added before and after every hit.
+        query_text: Optional[str]
+            The text of the query, enables the hybrid (dense + BM25) search.
+        filter: Optional[DocumentFilter]
+            Only documents of these files and/or dates are searched.
+        search_options:
+            Options of approximate backends (e.g. search_ef), ignored: the search is exact.
 
         Returns:
         -------
         retrieved_docs: List[Document]
             The most relevant documents.
         '''
-        from copy import deepcopy
-        retrieved_docs, _ = self.doc_index.find(query_embedding, search_field='embedding', limit=limit)
+        hybrid = query_text is not None and self.lexical_index is not None
+        n_results = max(limit, HYBRID_CANDIDATES) if hybrid else limit
+        mask = self.metadata_index.mask(filter)
+        if mask is None:
+            retrieved_docs, _ = self.doc_index.find(query_embedding, search_field='embedding', limit=n_results)
+        else:
+            # The filter runs before the search; the files and dates of the allowed rows
+            # select exactly these rows, since the mask is a conjunction of both
+            filenames = sorted({self.segments[row]["filename"] for row in np.flatnonzero(mask)})
+            dates = sorted({self.segments[row]["document_date"] for row in np.flatnonzero(mask)})
+            query = (self.doc_index.build_query()
+                     .filter(filter_query={"$and": [{"filename": {"$in": filenames}},
+                                                    {"document_date": {"$in": dates}}]})
+                     .find(query_embedding, search_field='embedding', limit=n_results)
+                     .build())
+            retrieved_docs, _ = self.doc_index.execute_query(query)
+        retrieved_docs = list(retrieved_docs)
+        if hybrid:
+            # The lexical index is built from self.segments, so its rows match the mask
+            lexical_ids, _ = self.lexical_index.search(query_text, HYBRID_CANDIDATES, mask=mask)
+            docs = {doc.id: doc for doc in retrieved_docs}
+            retrieved_docs = [docs[doc_id] if doc_id in docs else Document(**self.segments[self.neighbors.row_by_id[doc_id]])
+                              for doc_id in reciprocal_rank_fusion([list(docs), lexical_ids])[:limit]]
         if extra_context:
-            retrieved_docs_extended = []
-            for doc in retrieved_docs:
-                doc_extended = deepcopy(doc)
-                next_id = doc.next_id
-                previous_id = doc.previous_id
-                
-                if previous_id:
-                    doc_previous = self.doc_index[previous_id]
-                    doc_extended.text = doc_previous.text + "\n\n" + doc_extended.text
-                
-                if next_id:
-                    doc_next = self.doc_index[next_id]
-                    doc_extended.text = doc_extended.text + "\n\n" + doc_next.text
-                
-                retrieved_docs_extended.append(doc_extended)
-
-            return retrieved_docs_extended
+            return self.add_context(retrieved_docs, radius=context_radius)
         else:
-            return list(retrieved_docs)
+            return retrieved_docs
+
+    def add_context(self, docs: List[Document], radius: int = CONTEXT_RADIUS) -> List[Document]:
+        '''
+        Add the ±radius neighboring segments to every document.
+
+        Windows of hits that overlap are merged into the document of the best-ranked hit,
+        so the same text is never returned twice.
+        '''
+        windows = self.neighbors.expand([self.neighbors.row_by_id[doc.id] for doc in docs], radius)
+        return [docs[rank].copy(update={"text": "\n\n".join(self.segments[row]["text"] for row in rows)})
+                for rank, rows in windows]
@@ -1,149 +1,361 @@
 import chromadb
 from chromadb.config import Settings
 import numpy as np
+import hashlib
+import json
+import os
+import warnings
 from typing import List, Optional
-from settings import PATH_SEGMENTS
-from .data_models import Document
-import pickle as pkl
+from settings import (CONTEXT_RADIUS, HYBRID_SEARCH, HYBRID_CANDIDATES, HNSW_M, HNSW_CONSTRUCTION_EF,
+                      HNSW_SEARCH_EF, HNSW_NUM_THREADS)
+from .context_window import NeighborTable
+from .data_models import Document, DocumentFilter, date_to_int
+from .embedding_store import load_segments, segments_fingerprint
+from .lexical_index import load_lexical_index, reciprocal_rank_fusion
+from .metadata_index import MetadataIndex
+
+# Version of the stored metadata, a new version upserts all segments once
+INDEX_VERSION = 2
+
+
+def hnsw_metadata() -> dict:
+    """The collection metadata with the HNSW parameters of the settings."""
+    metadata = {"hnsw:space": "cosine", "hnsw:M": HNSW_M, "hnsw:construction_ef": HNSW_CONSTRUCTION_EF,
+                "hnsw:search_ef": HNSW_SEARCH_EF}
+    if HNSW_NUM_THREADS:
+        metadata["hnsw:num_threads"] = HNSW_NUM_THREADS
+    return metadata
+
+
+def segment_hash(doc: Document) -> str:
+    """Compute a content hash of a single segment (text, metadata and embedding)."""
+    sha = hashlib.sha256()
+    for value in (doc.text, doc.full_path, doc.filename, doc.page,
+                  doc.previous_id or "", doc.next_id or "", doc.document_date):
+        sha.update(value.encode("utf-8"))
+        sha.update(b"\0")
+    sha.update(str(INDEX_VERSION).encode("utf-8"))
+    sha.update(np.ascontiguousarray(doc.embedding, dtype=np.float32).tobytes())
+    return sha.hexdigest()
 
 class DocumentDatabase:
-    def __init__(self, persist: bool = True):
+    def __init__(self, persist: bool = True, sync: bool = True, hybrid: bool = HYBRID_SEARCH):
         """Initialize the database with ChromaDB backend.
         
+        The persisted collection is reopened on start. Only segments whose
+        content hash changed since the last start are upserted, segments that
+        no longer exist are deleted. If the fingerprint of the segments
+        matches the one stored with the index, the segments are not loaded at all.
+
+        The HNSW parameters (HNSW_M, HNSW_CONSTRUCTION_EF, HNSW_SEARCH_EF) are fixed
+        when Chroma creates a collection: Chroma 0.5 reads them from the vector segment
+        created with it, collection.modify() does not change them. A collection with
+        other parameters is therefore deleted and built again. The search ef cannot be
+        set per query, only the "hnsw" backend (src/document_database_4.py) supports it.
+
         Args:
             persist (bool): If True, stores data on disk. If False, runs in-memory.
+            sync (bool): If False, the collection is opened as is, e.g. to be updated
+                chunk by chunk with upsert_segments() and finished with commit_index().
+            hybrid (bool): If True, queries with text are also matched by a BM25 index
+                and both rankings are fused by reciprocal rank.
         """
         # Configure ChromaDB
+        self.persist_directory = "./chroma_db" if persist else None
         settings = Settings(
             is_persistent=persist,
-            persist_directory="./chroma_db" if persist else None,
+            persist_directory=self.persist_directory,
             anonymized_telemetry=False
         )
         
         self.client = chromadb.Client(settings)
-        # Reset collection if it exists (helps during development)
-        try:
+        metadata = hnsw_metadata()
+        self.collection = self.client.get_or_create_collection(name="documents", metadata=metadata)
+        # A collection whose metadata was changed with modify() lacks hnsw:space and is built again, too
+        if sync and any(self.collection.metadata.get(key) != value for key, value in metadata.items()
+                        if key != "hnsw:num_threads"):
+            print(f"Rebuilding the collection with the HNSW parameters {metadata}")
             self.client.delete_collection("documents")
-        except:
-            pass
+            self.collection = self.client.create_collection(name="documents", metadata=metadata)
         
-        self.collection = self.client.create_collection(
-            name="documents",
-            metadata={"hnsw:space": "cosine"}
-        )
-        
-        # Initialize the embedding cache
-        self._embedding_cache = {}
-        
-        self.load_segments()
-        self.index_documents()
-        
-        # Keep a mapping of document IDs to their embeddings for quick lookup
-        # self._embedding_cache = {}  # <-- Removed from here
+        self.fingerprint = segments_fingerprint() if sync else self._load_stored_fingerprint()
+        if not sync:
+            self._load_tables()
+        elif self.fingerprint != self._load_stored_fingerprint() or self.collection.count() == 0:
+            self.load_segments()
+            self.index_documents()
+            self._save_stored_fingerprint()
+        else:
+            self._load_tables()
+
+        self.lexical_index = None
+        self._lexical_rows = None
+        if hybrid and sync:
+            # Built from the segments only if the saved index does not match them
+            self.lexical_index = load_lexical_index(
+                self.fingerprint, lambda: self.segments if hasattr(self, "segments") else load_segments())
 
     def load_segments(self):
-        """Load document segments from pickle file."""
-        with open(PATH_SEGMENTS, "rb") as f:
-            self.segments = pkl.load(f)
+        """Load document segments from the embedding store (or the legacy pickle file)."""
+        self.segments = load_segments()
 
     def index_documents(self):
-        """Index all documents into ChromaDB."""
+        """Synchronize the collection with the loaded segments.
+
+        Segments that are new or whose content hash changed are upserted,
+        segments that are stored in the collection but no longer exist are deleted.
+        """
+        stored_hashes = self.stored_hashes()
+        self.upsert_segments(self.segments, stored_hashes)
+
+        segment_ids = {segment["id"] for segment in self.segments}
+        self.delete_segments([doc_id for doc_id in stored_hashes if doc_id not in segment_ids])
+
+        # Precompute the previous/next chain for context expansion and the metadata for filtering
+        self.neighbors = NeighborTable.from_segments(self.segments)
+        self.metadata_index = MetadataIndex.from_segments(self.segments)
+        if self.persist_directory is not None:
+            self.neighbors.save(self._table_path("neighbor_table"))
+            self.metadata_index.save(self._table_path("metadata_index"))
+
+    def stored_hashes(self) -> dict:
+        """Return the content hash of every segment in the collection by id."""
+        stored = self.collection.get(include=["metadatas"])
+        return {
+            doc_id: (metadata or {}).get("content_hash")
+            for doc_id, metadata in zip(stored["ids"], stored["metadatas"])
+        }
+
+    def upsert_segments(self, segments: List[dict], stored_hashes: Optional[dict] = None) -> int:
+        """Upsert the segments (with "embedding" key) whose content hash changed.
+
+        Args:
+            segments: The segments to write, e.g. one chunk of a streaming ingestion
+            stored_hashes: The content hashes in the collection, see stored_hashes()
+
+        Returns:
+            The number of upserted segments
+        """
+        if not segments:
+            return 0
+        if stored_hashes is None:
+            stored = self.collection.get(ids=[segment["id"] for segment in segments], include=["metadatas"])
+            stored_hashes = {doc_id: (metadata or {}).get("content_hash")
+                             for doc_id, metadata in zip(stored["ids"], stored["metadatas"])}
+
         embeddings = []
         texts = []
         ids = []
         metadatas = []
         
-        # Prepare data in batches
-        for segment in self.segments:
+        # Prepare data of changed segments only
+        for segment in segments:
             doc = Document(**segment)
+            content_hash = segment_hash(doc)
+            if stored_hashes.get(doc.id) == content_hash:
+                continue
+
             embeddings.append(doc.embedding.tolist())
             texts.append(doc.text)
             ids.append(doc.id)
-            
-            # Cache embedding for later use
-            self._embedding_cache[doc.id] = doc.embedding
-            
             metadatas.append({
                 "full_path": doc.full_path,
                 "filename": doc.filename,
                 "page": doc.page,
                 "previous_id": doc.previous_id if doc.previous_id else "",
                 "next_id": doc.next_id if doc.next_id else "",
-                "document_date": doc.document_date
+                "document_date": doc.document_date,
+                "document_date_int": date_to_int(doc.document_date),
+                "content_hash": content_hash
             })
-        
-        # Add documents to collection
-        self.collection.add(
-            embeddings=embeddings,
-            documents=texts,
-            ids=ids,
-            metadatas=metadatas
-        )
 
-    def find(self, query_embedding: np.ndarray, limit: int = 5, extra_context: bool = True) -> List[Document]:
+        # Chroma rejects requests that exceed its maximum batch size
+        batch_size = self.client.get_max_batch_size()
+        for i in range(0, len(ids), batch_size):
+            self.collection.upsert(
+                embeddings=embeddings[i:i+batch_size],
+                documents=texts[i:i+batch_size],
+                ids=ids[i:i+batch_size],
+                metadatas=metadatas[i:i+batch_size]
+            )
+        return len(ids)
+
+    def delete_segments(self, ids: List[str]):
+        """Delete the segments with the given ids from the collection."""
+        batch_size = self.client.get_max_batch_size()
+        for i in range(0, len(ids), batch_size):
+            self.collection.delete(ids=ids[i:i+batch_size])
+
+    def commit_index(self, neighbors: NeighborTable, metadata_index: MetadataIndex, fingerprint: str):
+        """Store the tables and the fingerprint of the segments the collection now holds.
+
+        Used after the collection was updated with upsert_segments() and delete_segments(),
+        so the next start does not synchronize it again.
+        """
+        self.neighbors = neighbors
+        self.metadata_index = metadata_index
+        self.fingerprint = fingerprint
+        if self.persist_directory is not None:
+            self.neighbors.save(self._table_path("neighbor_table"))
+            self.metadata_index.save(self._table_path("metadata_index"))
+        self._save_stored_fingerprint()
+
+    def _table_path(self, name: str) -> str:
+        return os.path.join(self.persist_directory, f"{name}.npz")
+
+    def _load_tables(self):
+        """Load the neighbor table and the metadata index stored with the index, or rebuild them from the collection."""
+        if self.persist_directory is not None and all(
+                os.path.exists(self._table_path(name)) for name in ("neighbor_table", "metadata_index")):
+            self.neighbors = NeighborTable.load(self._table_path("neighbor_table"))
+            self.metadata_index = MetadataIndex.load(self._table_path("metadata_index"))
+            return
+        stored = self.collection.get(include=["metadatas"])
+        self.neighbors = NeighborTable(stored["ids"],
+                                       [metadata["previous_id"] or None for metadata in stored["metadatas"]],
+                                       [metadata["next_id"] or None for metadata in stored["metadatas"]])
+        self.metadata_index = MetadataIndex(stored["ids"],
+                                            [metadata["filename"] for metadata in stored["metadatas"]],
+                                            [metadata["document_date"] for metadata in stored["metadatas"]])
+
+    def _fingerprint_path(self) -> Optional[str]:
+        if self.persist_directory is None:
+            return None
+        return os.path.join(self.persist_directory, "segments_fingerprint.json")
+
+    def _load_stored_fingerprint(self) -> Optional[str]:
+        path = self._fingerprint_path()
+        if path is None or not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        # An index with metadata of an older version is synchronized again
+        return stored.get("fingerprint") if stored.get("version") == INDEX_VERSION else None
+
+    def _save_stored_fingerprint(self):
+        path = self._fingerprint_path()
+        if path is None:
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.fingerprint, "version": INDEX_VERSION}, f)
+
+    def find(self, query_embedding: np.ndarray, limit: int = 5, extra_context: bool = True,
+             context_radius: int = CONTEXT_RADIUS, query_text: Optional[str] = None,
+             filter: Optional[DocumentFilter] = None, **search_options) -> List[Document]:
         """Find similar documents using vector similarity search.
         
         Args:
             query_embedding: Query vector
             limit: Number of results to return
-            extra_context: Whether to include previous and next segments
+            extra_context: Whether to include neighboring segments
+            context_radius: Number of neighboring segments added before and after every hit
+            query_text: Text of the query, enables the hybrid (dense + BM25) search
+            filter: Only documents of these files and/or dates are searched
+            search_options: Options of other backends. A search_ef is ignored with a
+                warning, Chroma searches with the HNSW_SEARCH_EF of the collection
         
         Returns:
             List of Document objects
         """
+        if search_options.get("search_ef") is not None:
+            warnings.warn("The Chroma backend ignores search_ef, its collection is built with HNSW_SEARCH_EF; "
+                          "use the \"hnsw\" backend for a per-query ef", stacklevel=2)
+        hybrid = query_text is not None and self.lexical_index is not None
         results = self.collection.query(
             query_embeddings=[query_embedding.tolist()],
-            n_results=limit,
-            include=["documents", "metadatas", "distances"]
+            n_results=max(limit, HYBRID_CANDIDATES) if hybrid else limit,
+            where=self._where(filter),
+            include=["documents", "metadatas", "distances", "embeddings"]
         )
         
-        retrieved_docs = []
-        
         # Convert results to Document objects
-        for i in range(len(results['ids'][0])):
-            doc_id = results['ids'][0][i]
-            metadata = results['metadatas'][0][i]
-            
-            doc = Document(
-                text=results['documents'][0][i],
-                embedding=self._embedding_cache[doc_id],  # Use cached embedding
-                id=doc_id,
-                full_path=metadata['full_path'],
-                filename=metadata['filename'],
-                page=metadata['page'],
-                previous_id=metadata['previous_id'] or None,
-                next_id=metadata['next_id'] or None,
-                document_date=metadata['document_date']
-            )
-            
-            if extra_context:
-                doc = self._add_context(doc)
-            
-            retrieved_docs.append(doc)
-        
-        return retrieved_docs
+        retrieved_docs = [
+            self._document(doc_id, text, metadata, embedding)
+            for doc_id, text, metadata, embedding in zip(results['ids'][0], results['documents'][0],
+                                                         results['metadatas'][0], results['embeddings'][0])
+        ]
 
-    def _add_context(self, doc: Document) -> Document:
-        """Add previous and next segment context to a document."""
-        from copy import deepcopy
-        doc_extended = deepcopy(doc)
+        if hybrid:
+            retrieved_docs = self._fuse(retrieved_docs, query_text, limit, filter)
         
-        # Add previous context if exists
-        if doc.previous_id:
-            prev_result = self.collection.get(
-                ids=[doc.previous_id],
-                include=["documents"]
-            )
-            if prev_result and prev_result['documents']:
-                doc_extended.text = prev_result['documents'][0] + "\n\n" + doc_extended.text
-        
-        # Add next context if exists
-        if doc.next_id:
-            next_result = self.collection.get(
-                ids=[doc.next_id],
-                include=["documents"]
-            )
-            if next_result and next_result['documents']:
-                doc_extended.text = doc_extended.text + "\n\n" + next_result['documents'][0]
+        if extra_context:
+            retrieved_docs = self.add_context(retrieved_docs, radius=context_radius)
         
-        return doc_extended
\ No newline at end of file
+        return retrieved_docs
+
+    @staticmethod
+    def _where(filter: Optional[DocumentFilter]) -> Optional[dict]:
+        """Translate a filter into a Chroma where clause, which restricts the HNSW search itself."""
+        if filter is None or filter.is_empty:
+            return None
+        clauses = []
+        if filter.filenames is not None:
+            clauses.append({"filename": {"$in": list(filter.filenames)}})
+        date_from, date_to = filter.date_range()
+        if date_from is not None:
+            clauses.append({"document_date_int": {"$gte": date_from}})
+        if date_to is not None:
+            clauses.append({"document_date_int": {"$lte": date_to}})
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def _fuse(self, dense_docs: List[Document], query_text: str, limit: int,
+              filter: Optional[DocumentFilter] = None) -> List[Document]:
+        """Fuse the dense hits with the BM25 hits of the query text by reciprocal rank."""
+        mask = self.metadata_index.mask(filter)
+        if mask is not None:
+            # The rows of the lexical index are mapped to the rows of the metadata index once
+            if self._lexical_rows is None:
+                self._lexical_rows = self.metadata_index.rows_of(self.lexical_index.ids)
+            mask = mask[self._lexical_rows]
+        lexical_ids, _ = self.lexical_index.search(query_text, HYBRID_CANDIDATES, mask=mask)
+        fused_ids = reciprocal_rank_fusion([[doc.id for doc in dense_docs], lexical_ids])[:limit]
+
+        docs = {doc.id: doc for doc in dense_docs}
+        missing_ids = [doc_id for doc_id in fused_ids if doc_id not in docs]
+        if missing_ids:
+            result = self.collection.get(ids=missing_ids, include=["documents", "metadatas", "embeddings"])
+            for doc_id, text, metadata, embedding in zip(result['ids'], result['documents'],
+                                                         result['metadatas'], result['embeddings']):
+                docs[doc_id] = self._document(doc_id, text, metadata, embedding)
+        return [docs[doc_id] for doc_id in fused_ids if doc_id in docs]
+
+    @staticmethod
+    def _document(doc_id: str, text: str, metadata: dict, embedding) -> Document:
+        return Document(
+            text=text,
+            embedding=np.asarray(embedding),
+            id=doc_id,
+            full_path=metadata['full_path'],
+            filename=metadata['filename'],
+            page=metadata['page'],
+            previous_id=metadata['previous_id'] or None,
+            next_id=metadata['next_id'] or None,
+            document_date=metadata['document_date']
+        )
+
+    def add_context(self, docs: List[Document], radius: int = CONTEXT_RADIUS) -> List[Document]:
+        """Add the neighboring segments to every document.
+
+        The windows of all hits are resolved with the precomputed neighbor table and
+        their texts are fetched with a single request. Overlapping windows are merged
+        into the document of the best-ranked hit, so no text is fetched or returned twice.
+
+        Args:
+            docs: The retrieved documents, in rank order
+            radius: Number of neighboring segments added before and after every hit
+
+        Returns:
+            List of Document objects with extended text
+        """
+        windows = self.neighbors.expand([self.neighbors.row_by_id[doc.id] for doc in docs], radius)
+
+        texts = {doc.id: doc.text for doc in docs}
+        missing_ids = [self.neighbors.ids[row] for _, rows in windows for row in rows
+                       if self.neighbors.ids[row] not in texts]
+        if missing_ids:
+            result = self.collection.get(ids=missing_ids, include=["documents"])
+            texts.update(zip(result['ids'], result['documents']))
+
+        return [docs[rank].copy(update={"text": "\n\n".join(texts[self.neighbors.ids[row]] for row in rows
+                                                             if self.neighbors.ids[row] in texts)})
+                for rank, rows in windows]
@@ -0,0 +1,249 @@
+import numpy as np
+from typing import List, Optional
+from settings import CONTEXT_RADIUS, EMBEDDING_QUANTIZATION, QUANTIZATION_RESCORE, HYBRID_SEARCH, HYBRID_CANDIDATES
+from .context_window import NeighborTable
+from .data_models import Document, DocumentFilter
+from .embedding_store import EmbeddingStore, load_segments, segments_fingerprint
+from .lexical_index import load_lexical_index, reciprocal_rank_fusion
+from .metadata_index import MetadataIndex
+from .quantization import create_quantized_index, normalize_rows
+
+
+def top_k(scores: np.ndarray, limit: int):
+    '''
+    Return the columns and values of the `limit` highest scores per row, best first.
+    '''
+    if limit < scores.shape[1]:
+        rows = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+    else:
+        rows = np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+    top_scores = np.take_along_axis(scores, rows, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(rows, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+class DocumentDatabase:
+    '''
+    Exact nearest neighbor search over a NumPy matrix of L2-normalized embeddings.
+
+    A single matrix product scores all segments, np.argpartition selects the top-k.
+    For corpora of tens of thousands of segments this is faster than an HNSW round
+    trip and returns exact results.
+
+    With `quantization` set, only a compressed copy of the embeddings (float16, int8
+    or binary, see src/quantization.py) is scanned and the float32 embeddings stay in
+    the memory-mapped store. The best `rescore * limit` candidates are then rescored
+    exactly from the store, which restores the ranking of exact search almost entirely.
+
+    With `hybrid` set, queries that come with their text are also matched by a BM25
+    index (src/lexical_index.py) and both rankings are fused by reciprocal rank.
+
+    A DocumentFilter is evaluated into a mask over the rows (src/metadata_index.py)
+    before the search, and only the allowed rows are scored.
+    '''
+    def __init__(self, quantization: Optional[str] = EMBEDDING_QUANTIZATION, rescore: int = QUANTIZATION_RESCORE,
+                 hybrid: bool = HYBRID_SEARCH):
+        self.quantization = quantization
+        self.rescore = rescore
+        self.hybrid = hybrid
+        self.index = None
+        self.lexical_index = None
+        self.fingerprint = segments_fingerprint()
+        self.load_segments()
+        self.index_documents()
+
+    @classmethod
+    def from_embeddings(cls, embeddings: np.ndarray, quantization: Optional[str] = EMBEDDING_QUANTIZATION,
+                        rescore: int = QUANTIZATION_RESCORE) -> "DocumentDatabase":
+        '''
+        Create a database that only supports search() over the given embeddings, without
+        segments, e.g. to benchmark the vector search on synthetic embeddings.
+        '''
+        database = cls.__new__(cls)
+        database.quantization = quantization
+        database.rescore = rescore
+        database.hybrid = False
+        database.index = None
+        database.lexical_index = None
+        database.fingerprint = None
+        database.segments = None
+        database.embeddings = embeddings
+        database._index_embeddings()
+        return database
+
+    def load_segments(self):
+        store = EmbeddingStore()
+        if store.exists:
+            store.load()
+            self.segments = store.segments
+            self.embeddings = store.embeddings
+        else:
+            self.segments = load_segments()
+            self.embeddings = np.stack([segment.pop("embedding") for segment in self.segments])
+
+    def index_documents(self):
+        self.neighbors = NeighborTable.from_segments(self.segments)
+        self.metadata_index = MetadataIndex.from_segments(self.segments)
+        if self.hybrid:
+            self.lexical_index = load_lexical_index(self.fingerprint, self.segments)
+        self._index_embeddings()
+
+    def _index_embeddings(self):
+        if self.quantization is not None:
+            # Encoded in chunks, the float32 matrix is not loaded into memory
+            self.index = create_quantized_index(self.quantization, self.embeddings)
+            return
+
+        embeddings = self.embeddings
+        if embeddings.dtype != np.float32:
+            # BLAS has no float16 kernels
+            embeddings = embeddings.astype(np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        if not np.allclose(norms, 1.0, atol=1e-3):
+            # Keep the memory map (and the shared page cache) if the store is already normalized
+            embeddings = embeddings / np.maximum(norms, 1e-12)
+        self.embeddings = embeddings
+
+    def find(self, query_embedding: np.ndarray, limit: int = 5, extra_context: bool = True,
+             context_radius: int = CONTEXT_RADIUS, query_text: Optional[str] = None,
+             filter: Optional[DocumentFilter] = None, **search_options) -> List[Document]:
+        '''
+        Find the most relevant documents for a given query embedding.
+
+        Parameters:
+        ----------
+        query_embedding: np.ndarray
+            The embedding of the query.
+        limit: int
+            The number of documents to return.
+        extra_context: bool
+            Whether to return the most relevant documents with extra context.
+        context_radius: int
+            The number of neighboring segments added before and after every hit.
+        query_text: Optional[str]
+            The text of the query, enables the hybrid (dense + BM25) search.
+        filter: Optional[DocumentFilter]
+            Only documents of these files and/or dates are searched.
+        search_options:
+            Passed to search(), e.g. search_ef of the hnsw backend (src/document_database_4.py).
+
+        Returns:
+        -------
+        retrieved_docs: List[Document]
+            The most relevant documents.
+        '''
+        return self.find_batch(np.asarray(query_embedding)[None, :], limit=limit, extra_context=extra_context,
+                               context_radius=context_radius,
+                               query_texts=[query_text] if query_text is not None else None, filter=filter,
+                               **search_options)[0]
+
+    def find_batch(self, query_matrix: np.ndarray, limit: int = 5, extra_context: bool = True,
+                   context_radius: int = CONTEXT_RADIUS, query_texts: Optional[List[str]] = None,
+                   filter: Optional[DocumentFilter] = None, **search_options) -> List[List[Document]]:
+        '''
+        Find the most relevant documents for many queries with one matrix product.
+
+        Parameters:
+        ----------
+        query_matrix: np.ndarray
+            The query embeddings, one row per query.
+        limit: int
+            The number of documents to return per query.
+        extra_context: bool
+            Whether to return the most relevant documents with extra context.
+        context_radius: int
+            The number of neighboring segments added before and after every hit.
+        query_texts: Optional[List[str]]
+            The texts of the queries, enables the hybrid (dense + BM25) search.
+        filter: Optional[DocumentFilter]
+            Only documents of these files and/or dates are searched, applies to all queries.
+        search_options:
+            Passed to search().
+
+        Returns:
+        -------
+        retrieved_docs: List[List[Document]]
+            The most relevant documents of every query.
+        '''
+        mask = self.metadata_index.mask(filter)
+        hybrid = query_texts is not None and self.lexical_index is not None
+        rows, _ = self.search(query_matrix, max(limit, HYBRID_CANDIDATES) if hybrid else limit, mask=mask,
+                              **search_options)
+        results = []
+        for i, query_rows in enumerate(rows):
+            if hybrid:
+                query_rows = self.fuse(query_rows, query_texts[i], limit, mask=mask)
+            docs = [self._document(row) for row in query_rows]
+            if extra_context:
+                docs = self.add_context(docs, radius=context_radius)
+            results.append(docs)
+        return results
+
+    def search(self, query_matrix: np.ndarray, limit: int = 5, mask: Optional[np.ndarray] = None,
+               **search_options):
+        '''
+        Return the rows and cosine similarities of the top-k segments per query, best first.
+
+        Only rows allowed by the boolean `mask` are scored. Without rescoring, a
+        quantized index returns its approximate scores instead. Options of approximate
+        backends (e.g. search_ef) are ignored.
+        '''
+        query_matrix = np.atleast_2d(np.asarray(query_matrix, dtype=np.float32))
+        query_matrix = query_matrix / np.maximum(np.linalg.norm(query_matrix, axis=1, keepdims=True), 1e-12)
+        allowed = None if mask is None else np.flatnonzero(mask)
+        limit = min(limit, len(self.embeddings) if allowed is None else len(allowed))
+        if limit <= 0:
+            return np.zeros((len(query_matrix), 0), dtype=np.int64), np.zeros((len(query_matrix), 0), dtype=np.float32)
+
+        if self.index is None:
+            embeddings = self.embeddings if allowed is None else self.embeddings[allowed]
+            rows, scores = top_k(query_matrix @ embeddings.T, limit)
+            return (rows if allowed is None else allowed[rows]), scores
+
+        scores = self.index.scores(query_matrix, allowed)
+        if not self.rescore:
+            rows, scores = top_k(scores, limit)
+            return (rows if allowed is None else allowed[rows]), scores
+
+        # Exact cosine similarities of the shortlist, read from the float32 embeddings
+        candidates, _ = top_k(scores, min(limit * self.rescore, scores.shape[1]))
+        if allowed is not None:
+            candidates = allowed[candidates]
+        rows = np.empty((len(query_matrix), limit), dtype=np.int64)
+        top_scores = np.empty((len(query_matrix), limit), dtype=np.float32)
+        for i, query_candidates in enumerate(candidates):
+            query_candidates = np.sort(query_candidates)  # ascending rows read the memory map in order
+            exact = normalize_rows(self.embeddings[query_candidates]) @ query_matrix[i]
+            best, best_scores = top_k(exact[None, :], limit)
+            rows[i], top_scores[i] = query_candidates[best[0]], best_scores[0]
+        return rows, top_scores
+
+    def fuse(self, dense_rows: np.ndarray, query_text: str, limit: int, mask: Optional[np.ndarray] = None) -> List[int]:
+        '''
+        Fuse the dense ranking with the BM25 ranking of the query text and return the top rows.
+        '''
+        # The lexical index is built from self.segments, so its rows match the mask
+        lexical_ids, _ = self.lexical_index.search(query_text, HYBRID_CANDIDATES, mask=mask)
+        dense_ids = [self.segments[row]["id"] for row in dense_rows]
+        return [self.neighbors.row_by_id[doc_id] for doc_id in reciprocal_rank_fusion([dense_ids, lexical_ids])[:limit]]
+
+    @property
+    def nbytes(self) -> int:
+        '''
+        Memory of the searched representation of the embeddings in bytes.
+        '''
+        return self.index.nbytes if self.index is not None else self.embeddings.nbytes
+
+    def _document(self, row: int) -> Document:
+        return Document(**self.segments[row], embedding=self.embeddings[row])
+
+    def add_context(self, docs: List[Document], radius: int = CONTEXT_RADIUS) -> List[Document]:
+        '''
+        Add the ±radius neighboring segments to every document.
+
+        Windows of hits that overlap are merged into the document of the best-ranked hit,
+        so the same text is never returned twice.
+        '''
+        windows = self.neighbors.expand([self.neighbors.row_by_id[doc.id] for doc in docs], radius)
+        return [docs[rank].copy(update={"text": "\n\n".join(self.segments[row]["text"] for row in rows)})
+                for rank, rows in windows]
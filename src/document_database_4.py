@@ -0,0 +1,48 @@
+import numpy as np
+from typing import Optional
+from settings import HYBRID_SEARCH, HNSW_SEARCH_EF, HNSW_EXACT_SEARCH_ROWS, PATH_HNSW_INDEX
+from .document_database_3 import DocumentDatabase as ExactDocumentDatabase
+from .hnsw_index import load_hnsw_index
+
+
+class DocumentDatabase(ExactDocumentDatabase):
+    '''
+    Approximate nearest neighbor search with an HNSW graph (hnswlib) over the embedding store.
+
+    The graph is built offline with all cores (scripts/build_hnsw_index.py) and loaded
+    on start; it is only built on start if the segments or HNSW_M / HNSW_CONSTRUCTION_EF
+    changed. Segments, metadata filters, context and the hybrid search are the ones of
+    the numpy backend (src/document_database_3.py).
+
+    `search_ef` trades recall for latency per query, the recall measured for every ef
+    when the graph was built is in `hnsw.recall`. Filtered searches that allow few
+    rows are exact, larger ones skip the other rows while walking the graph.
+    '''
+    search_ef = HNSW_SEARCH_EF
+    path = None  # from_embeddings() builds the graph in memory
+
+    def __init__(self, hybrid: bool = HYBRID_SEARCH, search_ef: int = HNSW_SEARCH_EF, path: str = PATH_HNSW_INDEX):
+        self.search_ef = search_ef
+        self.path = path
+        super().__init__(quantization=None, hybrid=hybrid)
+
+    def _index_embeddings(self):
+        super()._index_embeddings()
+        self.hnsw = load_hnsw_index(self.fingerprint, self.embeddings, path=self.path, search_ef=self.search_ef)
+
+    def search(self, query_matrix: np.ndarray, limit: int = 5, mask: Optional[np.ndarray] = None,
+               search_ef: Optional[int] = None):
+        '''
+        Return the rows and cosine similarities of the approximate top-k segments per query, best first.
+
+        `search_ef` is the length of the HNSW candidate list of these queries, default
+        HNSW_SEARCH_EF; find() and find_batch() pass it on.
+        '''
+        query_matrix = np.atleast_2d(np.asarray(query_matrix, dtype=np.float32))
+        query_matrix = query_matrix / np.maximum(np.linalg.norm(query_matrix, axis=1, keepdims=True), 1e-12)
+        allowed = len(self.embeddings) if mask is None else int(np.count_nonzero(mask))
+        limit = min(limit, allowed)
+        if limit <= 0 or (mask is not None and allowed <= HNSW_EXACT_SEARCH_ROWS):
+            return super().search(query_matrix, limit, mask=mask)
+        return self.hnsw.search(query_matrix, limit, ef=search_ef,
+                                filter=None if mask is None else lambda row: bool(mask[row]))
@@ -1,24 +1,63 @@
 from transformers import AutoTokenizer, AutoModel
 import torch
 import numpy as np
+from typing import Optional
+from settings import EMBEDDER_BACKEND, EMBEDDER_THREADS
+from .embedding_cache import EmbeddingCache, embedder_identity
+from .embedder_backends import create_embedder_backend
+from .snapshot import model_path
 
 
 class Embedder:
-    def __init__(self, model_name, normalize=True):
+    def __init__(self, model_name, normalize=True, cache: Optional[EmbeddingCache] = None, path: Optional[str] = None,
+                 backend: str = EMBEDDER_BACKEND, num_threads: Optional[int] = EMBEDDER_THREADS):
         self.model_name = model_name
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModel.from_pretrained(model_name)
+        # Loaded from the startup snapshot (see src/snapshot.py) if the model is part of it
+        path = path or model_path(model_name)
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+        self.model = AutoModel.from_pretrained(path)
+        self.model.eval()
+        # Runs the forward pass: torch (float32), torch with int8 linear layers or ONNX Runtime
+        self.backend = create_embedder_backend(backend, self.model, self.tokenizer, model_name, num_threads)
         self.normalize = normalize
+        # Everything the vectors depend on, cached embeddings of another identity are not reused
+        self.identity = embedder_identity(model_name, backend, normalize)
         self.embed_dim = self.model.config.hidden_size
+        self.cache = cache
 
     def embed(self, text):
+        if self.cache is None:
+            return self._embed(text)
+
+        texts = [text] if isinstance(text, str) else list(text)
+        embeddings = [self.cache.get(t) for t in texts]
+
+        # Run the model only on texts that are not cached
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            embeddings_new = self._embed([texts[i] for i in missing])
+            for i, embedding in zip(missing, embeddings_new):
+                self.cache.put(texts[i], embedding)
+                embeddings[i] = embedding
+
+        return np.stack(embeddings).astype(np.float32, copy=False)
+
+    @staticmethod
+    def mean_pool(last_hidden_state, attention_mask):
+        mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+        return (last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+
+    def _embed(self, text):
         # Tokenize the text
         inputs = self.tokenizer(text, return_tensors="pt", truncation=True, padding=True)
+        return self._forward(inputs)
 
+    def _forward(self, inputs):
         # Get the embeddings
         with torch.no_grad():
-            outputs = self.model(**inputs)
-            embeddings = outputs.last_hidden_state.mean(dim=1)
+            last_hidden_state = self.backend.last_hidden_state(inputs)
+            # Ignore padding, so a text gets the same vector alone or in a batch
+            embeddings = self.mean_pool(last_hidden_state, inputs["attention_mask"])
 
         # To numpy array
         embeddings = embeddings.numpy()
@@ -29,26 +68,55 @@ class Embedder:
 
         return embeddings
     
-    def embed_documents(self, documents, batch_size=16):
-        embeddings = np.zeros((len(documents), self.embed_dim))
-        for i in range(0, len(documents), batch_size):
-            print(f"Embedding batch {i//batch_size+1} of {len(documents)//batch_size}")
-            batch = documents[i:i+batch_size]
-            # Batch tokenize
-            inputs = self.tokenizer(batch, return_tensors="pt", truncation=True, padding=True)
-
-            # Get the embeddings
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-                embeddings_new = outputs.last_hidden_state.mean(dim=1)
-            # To numpy array
-            embeddings_new = embeddings_new.numpy()
-
-            # Normalize the embeddings
-            if self.normalize:
-                embeddings_new = embeddings_new / np.linalg.norm(embeddings_new, axis=1, keepdims=True)
-
-            
-            embeddings[i:i+batch_size] = embeddings_new
-
-        return embeddings
\ No newline at end of file
+    def embed_documents(self, documents, batch_size=16, max_tokens_per_batch=None):
+        '''
+        Embed many documents in batches.
+
+        Parameters:
+        ----------
+        documents: List[str]
+            The documents to embed.
+        batch_size: int
+            The number of documents per batch, used if max_tokens_per_batch is None.
+        max_tokens_per_batch: Optional[int]
+            If set, documents are sorted by token length and batched by a budget of
+            (padded) tokens instead of a fixed count, so short segments are not padded
+            to the length of a long one. The original order is restored at the end.
+
+        Returns:
+        -------
+        embeddings: np.ndarray
+            The float32 embeddings, one row per document.
+        '''
+        embeddings = np.zeros((len(documents), self.embed_dim), dtype=np.float32)
+        if max_tokens_per_batch is None:
+            for i in range(0, len(documents), batch_size):
+                print(f"Embedding batch {i//batch_size+1} of {len(documents)//batch_size}")
+                embeddings[i:i+batch_size] = self._embed(documents[i:i+batch_size])
+            return embeddings
+
+        lengths = [len(input_ids) for input_ids in self.tokenizer(list(documents), truncation=True)["input_ids"]]
+        batches = self.token_budget_batches(lengths, max_tokens_per_batch)
+        for i_batch, indices in enumerate(batches):
+            print(f"Embedding batch {i_batch+1} of {len(batches)} ({len(indices)} documents)")
+            embeddings[indices] = self._embed([documents[i] for i in indices])
+
+        return embeddings
+
+    @staticmethod
+    def token_budget_batches(lengths, max_tokens_per_batch):
+        '''
+        Group documents of similar token length into batches whose padded size
+        (number of documents times the longest one) stays within the budget.
+        '''
+        batches = []
+        batch = []
+        for i in sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True):
+            # Sorted by length, so the first document of a batch is its longest
+            if batch and (len(batch) + 1) * lengths[batch[0]] > max_tokens_per_batch:
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
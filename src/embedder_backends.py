@@ -0,0 +1,114 @@
+import os
+import torch
+from typing import Optional
+from settings import PATH_ONNX_MODELS
+
+EMBEDDER_BACKENDS = ("torch", "torch-int8", "onnx")
+
+
+class TorchBackend:
+    '''
+    Runs the transformer in eager PyTorch with float32 weights.
+
+    torch.set_num_threads applies to the whole process, so all torch backends of a
+    process share the number of intra-op threads set last.
+    '''
+    def __init__(self, model, num_threads: Optional[int] = None):
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model = model
+
+    def last_hidden_state(self, inputs) -> torch.Tensor:
+        with torch.no_grad():
+            return self.model(**inputs).last_hidden_state
+
+
+class TorchInt8Backend(TorchBackend):
+    '''
+    Runs the transformer with the weights of its linear layers quantized to int8.
+
+    Activations are quantized dynamically per batch. Most of the compute of a BERT
+    model is in its linear layers, which run about twice as fast in int8 on CPUs with
+    VNNI/AVX2 instructions. The float32 model is not modified.
+    '''
+    def __init__(self, model, num_threads: Optional[int] = None):
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        super().__init__(model, num_threads)
+
+
+class OnnxBackend:
+    '''
+    Runs the transformer exported to ONNX with ONNX Runtime on the CPU.
+
+    The model is exported once to `path` and loaded from there afterwards. ONNX Runtime
+    fuses the attention and layer norm operators of the graph and uses its own
+    intra-op thread pool, which is set per session.
+    '''
+    def __init__(self, model, tokenizer, path: str, num_threads: Optional[int] = None):
+        import onnxruntime
+
+        if not os.path.exists(path):
+            export_onnx(model, tokenizer, path)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads or 0  # 0 = one thread per physical core
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def last_hidden_state(self, inputs) -> torch.Tensor:
+        feeds = {name: inputs[name].numpy() for name in self.input_names}
+        return torch.from_numpy(self.session.run(None, feeds)[0])
+
+
+def export_onnx(model, tokenizer, path: str, opset_version: int = 17):
+    '''
+    Export the last hidden state of a transformer to ONNX, with dynamic batch size and sequence length.
+    '''
+    sample = tokenizer(["Beispiel", "Ein etwas längerer Beispielsatz"], return_tensors="pt", padding=True)
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *args):
+            return self.model(**dict(zip(input_names, args))).last_hidden_state
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    torch.onnx.export(LastHiddenState(model), tuple(sample[name] for name in input_names), path + ".tmp",
+                      input_names=input_names, output_names=["last_hidden_state"], dynamic_axes=dynamic_axes,
+                      opset_version=opset_version, dynamo=False)
+    # The exporter leaves the model in training mode, which would enable dropout
+    model.eval()
+    os.replace(path + ".tmp", path)
+
+
+def onnx_path(model_name: str, path: str = PATH_ONNX_MODELS) -> str:
+    return os.path.join(path, model_name.strip("/").replace("/", "--") + ".onnx")
+
+
+def create_embedder_backend(backend: str, model, tokenizer, model_name: str, num_threads: Optional[int] = None):
+    '''
+    Create the inference backend of an Embedder.
+
+    Parameters:
+    ----------
+    backend: str
+        "torch" (float32), "torch-int8" (dynamic int8 quantization) or "onnx" (ONNX Runtime).
+    model, tokenizer:
+        The loaded transformer and its tokenizer.
+    model_name: str
+        The name of the model, names the exported ONNX file.
+    num_threads: Optional[int]
+        Intra-op threads, None for the default of the backend.
+    '''
+    if backend == "torch":
+        return TorchBackend(model, num_threads)
+    if backend == "torch-int8":
+        return TorchInt8Backend(model, num_threads)
+    if backend == "onnx":
+        return OnnxBackend(model, tokenizer, onnx_path(model_name), num_threads)
+    raise ValueError(f"Unknown embedder backend {backend}, expected one of {EMBEDDER_BACKENDS}")
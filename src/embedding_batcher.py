@@ -0,0 +1,101 @@
+import asyncio
+import queue
+import threading
+import time
+import numpy as np
+from collections import deque
+from concurrent.futures import Future
+from settings import EMBED_BATCH_MAX_SIZE, EMBED_BATCH_MAX_WAIT_MS
+
+
+class EmbeddingBatcher:
+    '''
+    Dynamic micro-batching of concurrent queries in front of an Embedder.
+
+    Queries submitted from any thread (or coroutine) are collected by a background
+    thread until `max_batch_size` queries are waiting or the oldest query has waited
+    `max_wait_ms`. The batch is embedded in one padded forward pass and every caller
+    receives its own vector.
+    '''
+    def __init__(self, embedder, max_batch_size: int = EMBED_BATCH_MAX_SIZE,
+                 max_wait_ms: float = EMBED_BATCH_MAX_WAIT_MS, metrics_window: int = 1000):
+        self.embedder = embedder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._batch_sizes = deque(maxlen=metrics_window)
+        self._queue_times = deque(maxlen=metrics_window)
+        self._thread = threading.Thread(target=self._worker, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        '''
+        Queue a text for embedding and return a future of its embedding vector.
+        '''
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def embed(self, text: str) -> np.ndarray:
+        '''
+        Embed a single text, with the same (1, embed_dim) output shape as Embedder.embed.
+        '''
+        return self.submit(text).result()[None, :]
+
+    async def aembed(self, text: str) -> np.ndarray:
+        return (await asyncio.wrap_future(self.submit(text)))[None, :]
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = item[2] + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    # Past the deadline, only take queries that are already waiting
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)  # stop after this batch
+                    break
+                batch.append(item)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        start = time.perf_counter()
+        self._batch_sizes.append(len(batch))
+        self._queue_times.extend(start - enqueued for _, _, enqueued in batch)
+        try:
+            embeddings = self.embedder.embed([text for text, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), embedding in zip(batch, embeddings):
+            future.set_result(embedding)
+
+    @property
+    def stats(self) -> dict:
+        '''
+        Batch size and queue time (in ms) statistics over the most recent batches.
+        '''
+        batch_sizes = np.array(self._batch_sizes, dtype=float)
+        queue_times = np.array(self._queue_times, dtype=float) * 1000
+        if len(batch_sizes) == 0:
+            return {"batches": 0}
+        return {
+            "batches": len(batch_sizes),
+            "batch_size_mean": float(batch_sizes.mean()),
+            "batch_size_max": int(batch_sizes.max()),
+            "queue_time_ms_p50": float(np.percentile(queue_times, 50)),
+            "queue_time_ms_p95": float(np.percentile(queue_times, 95)),
+            "queue_time_ms_max": float(queue_times.max()),
+        }
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
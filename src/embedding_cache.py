@@ -0,0 +1,104 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Optional
+from settings import EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_DISK_SIZE
+
+
+def embedder_identity(model_name: str, backend: str, normalize: bool) -> str:
+    """Everything the vectors of an Embedder depend on, see Embedder.identity."""
+    return f"{model_name}|{backend}|normalize={normalize}"
+
+
+class EmbeddingCache:
+    '''
+    Bounded LRU cache of query embeddings with an optional SQLite backend.
+
+    Entries are keyed on the identity of the embedder (model, backend and
+    normalization, see Embedder.identity) and the whitespace-normalized text. The
+    in-memory LRU holds at most `max_size` embeddings. If `path` is set, embeddings
+    are also written to a SQLite database that survives restarts and is shared by
+    all worker processes on the host.
+    '''
+    def __init__(self, identity: str, max_size: int = EMBEDDING_CACHE_SIZE,
+                 path: Optional[str] = EMBEDDING_CACHE_PATH, max_disk_size: int = EMBEDDING_CACHE_DISK_SIZE):
+        self.identity = identity
+        self.max_size = max_size
+        self.max_disk_size = max_disk_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._connection = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._connection.commit()
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        return " ".join(text.split())
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.identity}\0{self.normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        '''
+        Return the cached embedding of the text or None.
+        '''
+        key = self.key(text)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None and self._connection is not None:
+                row = self._connection.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    embedding = np.frombuffer(row[0], dtype=np.float32)
+                    self._put_memory(key, embedding)
+
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, text: str, embedding: np.ndarray):
+        key = self.key(text)
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._put_memory(key, embedding)
+            if self._connection is not None:
+                self._connection.execute("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                                         (key, embedding.tobytes()))
+                # Drop the oldest entries once the database exceeds its size limit
+                self._connection.execute(
+                    "DELETE FROM embeddings WHERE rowid <= (SELECT MAX(rowid) FROM embeddings) - ?",
+                    (self.max_disk_size,)
+                )
+                self._connection.commit()
+
+    def _put_memory(self, key: str, embedding: np.ndarray):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    @property
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+        }
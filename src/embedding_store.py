@@ -0,0 +1,373 @@
+import hashlib
+import json
+import os
+import pickle as pkl
+import numpy as np
+from typing import List, Optional
+from settings import PATH_SEGMENTS, PATH_EMBEDDING_STORE, EMBEDDING_STORE_DTYPE
+
+SUPPORTED_DTYPES = ("float32", "float16")
+
+
+def file_fingerprint(path: str, chunk_size: int = 1 << 20) -> str:
+    """Compute a content fingerprint of a file without deserializing it."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class EmbeddingStore:
+    '''
+    Columnar on-disk store for segment embeddings.
+
+    The store is a directory with three files:
+    - embeddings-<version>.bin: one contiguous row-major matrix (float32 or float16)
+    - segments-<version>.jsonl: one line of metadata (id, text, filename, ...) per row
+    - store.json: dtype, dimension, number of rows, a content fingerprint and the
+      names of the two data files
+
+    The matrix is opened with np.memmap, so loading is nearly free and several
+    processes on the same host share the vectors through the page cache.
+    Stores are written with an EmbeddingStoreWriter. The data files of a write get
+    new names, so replacing store.json is the only step that switches the store:
+    a reader sees either the old or the new version, never a mix of both. The data
+    files are opened by the names of the header the reader loaded, so a commit keeps
+    the previous version; it is deleted by the commit after it.
+    '''
+    EMBEDDINGS_FILE = "embeddings.bin"
+    SEGMENTS_FILE = "segments.jsonl"
+    HEADER_FILE = "store.json"
+
+    def __init__(self, path: str = PATH_EMBEDDING_STORE):
+        self.path = path
+        self.embeddings = None
+        self.segments = None
+        self.header = None
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(self._file(self.HEADER_FILE))
+
+    @property
+    def fingerprint(self) -> Optional[str]:
+        header = self.header if self.header is not None else self._read_header()
+        return header["fingerprint"] if header else None
+
+    def _read_header(self) -> Optional[dict]:
+        if not self.exists:
+            return None
+        with open(self._file(self.HEADER_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _data_file(self, key: str) -> str:
+        if self.header is None:
+            self.header = self._read_header()
+        return self._file(self.data_file_names(self.header)[key])
+
+    @classmethod
+    def data_file_names(cls, header: Optional[dict]) -> dict:
+        # Stores written before the data files were versioned have no file names in the header
+        header = header or {}
+        return {"embeddings_file": header.get("embeddings_file", cls.EMBEDDINGS_FILE),
+                "segments_file": header.get("segments_file", cls.SEGMENTS_FILE)}
+
+    def load(self) -> "EmbeddingStore":
+        '''
+        Open the embedding matrix as a read-only memory map and load the metadata table.
+        '''
+        self.open_embeddings()
+        with open(self._data_file("segments_file"), "r", encoding="utf-8") as f:
+            self.segments = [json.loads(line) for line in f if line.strip()]
+        if len(self.segments) != len(self.embeddings):
+            raise ValueError(f"Embedding store at {self.path} is inconsistent: "
+                             f"{len(self.segments)} segments but {len(self.embeddings)} embeddings")
+        return self
+
+    def open_embeddings(self) -> np.ndarray:
+        '''
+        Open only the embedding matrix as a read-only memory map.
+        '''
+        self.header = self._read_header()
+        if self.header is None:
+            raise FileNotFoundError(f"No embedding store found at {self.path}")
+
+        shape = (self.header["count"], self.header["dim"])
+        if shape[0] == 0:
+            self.embeddings = np.zeros(shape, dtype=self.header["dtype"])
+        else:
+            self.embeddings = np.memmap(self._data_file("embeddings_file"), dtype=self.header["dtype"],
+                                        mode="r", shape=shape)
+        return self.embeddings
+
+    def index_rows(self) -> dict:
+        '''
+        Scan the metadata table once and return the row of every segment id.
+
+        Only the ids and the byte offsets of the rows are kept, so the texts of a large
+        store are not loaded; read_segments() fetches the metadata of single rows.
+        '''
+        row_by_id = {}
+        offsets = []
+        offset = 0
+        with open(self._data_file("segments_file"), "rb") as f:
+            for row, line in enumerate(f):
+                offsets.append(offset)
+                offset += len(line)
+                row_by_id[json.loads(line)["id"]] = row
+        self._offsets = np.array(offsets, dtype=np.int64)
+        return row_by_id
+
+    def read_segments(self, rows) -> List[dict]:
+        '''
+        Read the metadata of the given rows (requires index_rows()).
+        '''
+        segments = []
+        with open(self._data_file("segments_file"), "rb") as f:
+            for row in rows:
+                f.seek(self._offsets[row])
+                segments.append(json.loads(f.readline()))
+        return segments
+
+    def iter_segments(self):
+        '''
+        Iterate over the metadata table without loading it.
+        '''
+        with open(self._data_file("segments_file"), "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def write(self, segments: List[dict], embeddings: np.ndarray, dtype: str = EMBEDDING_STORE_DTYPE):
+        '''
+        Write segments and their embeddings to the store, replacing its content.
+
+        Parameters:
+        ----------
+        segments: List[dict]
+            The segment metadata. An "embedding" key is ignored.
+        embeddings: np.ndarray
+            The embedding matrix with one row per segment.
+        dtype: str
+            The on-disk dtype of the matrix, "float32" or "float16".
+        '''
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype}, expected one of {SUPPORTED_DTYPES}")
+        embeddings = np.asarray(embeddings)
+        if len(segments) != len(embeddings):
+            raise ValueError(f"Got {len(segments)} segments but {len(embeddings)} embeddings")
+
+        writer = EmbeddingStoreWriter(self.path, dtype=dtype)
+        writer.append(segments, embeddings)
+        self.header = writer.commit()
+
+    def _file(self, name: str, tmp: bool = False) -> str:
+        return os.path.join(self.path, name + (".tmp" if tmp else ""))
+
+    def segments_with_embeddings(self) -> List[dict]:
+        '''
+        Return the segments in the legacy list-of-dicts format.
+
+        The embeddings are row views into the memory map, no vectors are copied.
+        '''
+        if self.segments is None:
+            self.load()
+        return [dict(segment, embedding=self.embeddings[i]) for i, segment in enumerate(self.segments)]
+
+    @classmethod
+    def from_pickle(cls, path_pickle: str = PATH_SEGMENTS, path: str = PATH_EMBEDDING_STORE,
+                    dtype: str = EMBEDDING_STORE_DTYPE) -> "EmbeddingStore":
+        '''
+        Import a pickled list of segment dicts (with "embedding" key) into a new store.
+        '''
+        with open(path_pickle, "rb") as f:
+            segments = pkl.load(f)
+        store = cls(path)
+        store.write(segments, np.stack([segment["embedding"] for segment in segments]), dtype=dtype)
+        return store
+
+    def to_pickle(self, path_pickle: str = PATH_SEGMENTS):
+        '''
+        Export the store as a pickled list of segment dicts with float32 embeddings.
+        '''
+        if self.segments is None:
+            self.load()
+        segments = [dict(segment, embedding=np.array(self.embeddings[i], dtype=np.float32))
+                    for i, segment in enumerate(self.segments)]
+        with open(path_pickle, "wb") as f:
+            pkl.dump(segments, f)
+
+
+
+class EmbeddingStoreWriter:
+    '''
+    Append-only writer of an EmbeddingStore with checkpoint/resume.
+
+    Rows are appended to temporary files next to the store, so memory use does not
+    depend on the size of the corpus and the old store stays readable while writing.
+    checkpoint() makes the rows written so far durable together with a caller-defined
+    state (e.g. the PDFs that are done). A writer created with resume=True truncates
+    the temporary files to the last checkpoint and continues from there. commit()
+    moves the files to names of the new version and then replaces store.json, which
+    is the only step that switches the store: a crash before it leaves the old store
+    intact. The data files of the previous version are kept for readers that loaded
+    its header, older versions and files left by an interrupted commit are deleted.
+    A writer that does not resume discards the checkpoint of an interrupted write.
+    '''
+    CHECKPOINT_FILE = "checkpoint.json"
+
+    def __init__(self, path: str = PATH_EMBEDDING_STORE, dtype: str = EMBEDDING_STORE_DTYPE, resume: bool = False):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype}, expected one of {SUPPORTED_DTYPES}")
+        self.store = EmbeddingStore(path)
+        self.dtype = dtype
+        self.count = 0
+        self.dim = None
+        self.state = None
+        os.makedirs(path, exist_ok=True)
+
+        checkpoint = self._read_checkpoint() if resume else None
+        if checkpoint is not None and checkpoint["dtype"] == dtype:
+            self.count, self.dim, self.state = checkpoint["count"], checkpoint["dim"], checkpoint["state"]
+            self._embeddings_file = open(self._tmp(EmbeddingStore.EMBEDDINGS_FILE), "r+b")
+            self._segments_file = open(self._tmp(EmbeddingStore.SEGMENTS_FILE), "r+b")
+            self._embeddings_file.truncate(checkpoint["embeddings_bytes"])
+            self._segments_file.truncate(checkpoint["segments_bytes"])
+            self._embeddings_file.seek(0, os.SEEK_END)
+            self._segments_file.seek(0, os.SEEK_END)
+        else:
+            # The temporary files of an interrupted write are overwritten, its checkpoint no longer applies
+            if os.path.exists(self._tmp(self.CHECKPOINT_FILE)):
+                os.remove(self._tmp(self.CHECKPOINT_FILE))
+            self._embeddings_file = open(self._tmp(EmbeddingStore.EMBEDDINGS_FILE), "wb")
+            self._segments_file = open(self._tmp(EmbeddingStore.SEGMENTS_FILE), "wb")
+
+    def _tmp(self, name: str) -> str:
+        return self.store._file(name, tmp=True)
+
+    def _read_checkpoint(self) -> Optional[dict]:
+        path = self._tmp(self.CHECKPOINT_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def append(self, segments: List[dict], embeddings: np.ndarray):
+        '''
+        Append segments (an "embedding" key is ignored) and their embedding rows.
+        '''
+        embeddings = np.asarray(embeddings)
+        if len(segments) != len(embeddings):
+            raise ValueError(f"Got {len(segments)} segments but {len(embeddings)} embeddings")
+        if len(segments) == 0:
+            return
+        if self.dim is None:
+            self.dim = int(embeddings.shape[1])
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(f"Got embeddings of dimension {embeddings.shape[1]}, expected {self.dim}")
+
+        self._embeddings_file.write(np.ascontiguousarray(embeddings, dtype=self.dtype).tobytes())
+        for segment in segments:
+            line = json.dumps({k: v for k, v in segment.items() if k != "embedding"}, ensure_ascii=False)
+            self._segments_file.write((line + "\n").encode("utf-8"))
+        self.count += len(segments)
+
+    def checkpoint(self, state=None):
+        '''
+        Make all rows appended so far durable and record the state to resume from.
+        '''
+        self.state = state
+        for f in (self._embeddings_file, self._segments_file):
+            f.flush()
+            os.fsync(f.fileno())
+        checkpoint = {
+            "dtype": self.dtype,
+            "dim": self.dim,
+            "count": self.count,
+            "embeddings_bytes": self._embeddings_file.tell(),
+            "segments_bytes": self._segments_file.tell(),
+            "state": state,
+        }
+        with open(self._tmp(self.CHECKPOINT_FILE) + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+        os.replace(self._tmp(self.CHECKPOINT_FILE) + ".tmp", self._tmp(self.CHECKPOINT_FILE))
+
+    def close(self):
+        '''
+        Close the temporary files without committing, the last checkpoint can be resumed.
+        '''
+        self._embeddings_file.close()
+        self._segments_file.close()
+
+    def commit(self) -> dict:
+        '''
+        Replace the store with the appended rows and return the new header.
+        '''
+        self.close()
+
+        # Fingerprint of the content, computed in chunks from the written files
+        sha = hashlib.sha256()
+        for name in (EmbeddingStore.EMBEDDINGS_FILE, EmbeddingStore.SEGMENTS_FILE):
+            with open(self._tmp(name), "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(chunk)
+
+        fingerprint = sha.hexdigest()
+        previous = self.store._read_header()
+        header = {
+            "dtype": self.dtype,
+            "dim": self.dim or 0,
+            "count": self.count,
+            "fingerprint": fingerprint,
+            "embeddings_file": f"embeddings-{fingerprint[:16]}.bin",
+            "segments_file": f"segments-{fingerprint[:16]}.jsonl",
+        }
+        # The data files of the new version sit next to the current ones until the header points to them
+        os.replace(self._tmp(EmbeddingStore.EMBEDDINGS_FILE), self.store._file(header["embeddings_file"]))
+        os.replace(self._tmp(EmbeddingStore.SEGMENTS_FILE), self.store._file(header["segments_file"]))
+        with open(self._tmp(EmbeddingStore.HEADER_FILE), "w", encoding="utf-8") as f:
+            json.dump(header, f)
+            f.flush()
+            os.fsync(f.fileno())
+        # Replacing the header commits the write
+        os.replace(self._tmp(EmbeddingStore.HEADER_FILE), self.store._file(EmbeddingStore.HEADER_FILE))
+
+        if os.path.exists(self._tmp(self.CHECKPOINT_FILE)):
+            os.remove(self._tmp(self.CHECKPOINT_FILE))
+        self._remove_old_versions(header, previous)
+        return header
+
+    def _remove_old_versions(self, header: dict, previous: Optional[dict]):
+        # Readers open the data files by the names in the header they loaded, so the previous version
+        # stays until the next commit. Mapped embeddings of older versions stay readable after deletion.
+        keep = set(EmbeddingStore.data_file_names(header).values())
+        if previous is not None:
+            keep |= set(EmbeddingStore.data_file_names(previous).values())
+        for name in os.listdir(self.store.path):
+            if name in keep:
+                continue
+            if name in (EmbeddingStore.EMBEDDINGS_FILE, EmbeddingStore.SEGMENTS_FILE) or \
+                    (name.startswith(("embeddings-", "segments-")) and name.endswith((".bin", ".jsonl"))):
+                os.remove(self.store._file(name))
+
+
+def load_segments(path: str = PATH_EMBEDDING_STORE, path_pickle: str = PATH_SEGMENTS) -> List[dict]:
+    '''
+    Load the segments with embeddings, preferring the embedding store over the pickle.
+    '''
+    store = EmbeddingStore(path)
+    if store.exists:
+        return store.load().segments_with_embeddings()
+    with open(path_pickle, "rb") as f:
+        return pkl.load(f)
+
+
+def segments_fingerprint(path: str = PATH_EMBEDDING_STORE, path_pickle: str = PATH_SEGMENTS) -> str:
+    '''
+    Fingerprint of the segments that load_segments() would return.
+    '''
+    store = EmbeddingStore(path)
+    if store.exists:
+        return store.fingerprint
+    return file_fingerprint(path_pickle)
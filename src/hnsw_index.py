@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import numpy as np
+from typing import Callable, Optional
+from settings import HNSW_M, HNSW_CONSTRUCTION_EF, HNSW_SEARCH_EF, HNSW_NUM_THREADS, PATH_HNSW_INDEX
+from .quantization import normalize_rows
+
+
+class HnswIndex:
+    '''
+    HNSW graph (hnswlib) over L2-normalized embeddings, the labels are the rows.
+
+    `m` and `construction_ef` are fixed when the graph is built, `ef` can be set per
+    search: a longer candidate list gives a higher recall at a higher latency. The
+    graph is saved next to a manifest (`<path>.json`) with its parameters, the
+    fingerprint of the segments and the recall measured by scripts/build_hnsw_index.py.
+    '''
+    def __init__(self, index, m: int, construction_ef: int, search_ef: int = HNSW_SEARCH_EF,
+                 fingerprint: Optional[str] = None, recall: Optional[dict] = None):
+        self.index = index
+        self.m = m
+        self.construction_ef = construction_ef
+        self.search_ef = search_ef
+        self.fingerprint = fingerprint
+        self.recall = recall or {}
+        # ef is a setting of the index, not of a query, so it is set and used under a lock
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.index.get_current_count()
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, m: int = HNSW_M, construction_ef: int = HNSW_CONSTRUCTION_EF,
+              num_threads: Optional[int] = HNSW_NUM_THREADS, fingerprint: Optional[str] = None,
+              chunk_size: int = 65536, verbose: bool = False) -> "HnswIndex":
+        '''
+        Build the graph from the embeddings with all threads.
+
+        Parameters:
+        ----------
+        embeddings: np.ndarray
+            The embeddings, e.g. the memory map of the embedding store. They are read,
+            normalized and inserted in chunks.
+        m: int
+            Links per node.
+        construction_ef: int
+            Length of the candidate list while inserting.
+        num_threads: Optional[int]
+            Threads inserting in parallel, None for all cores.
+        fingerprint: Optional[str]
+            The fingerprint of the segment corpus, stored with the index.
+        '''
+        import hnswlib
+
+        index = hnswlib.Index(space="ip", dim=embeddings.shape[1])  # inner product of normalized vectors = cosine
+        index.init_index(max_elements=len(embeddings), M=m, ef_construction=construction_ef)
+        for i in range(0, len(embeddings), chunk_size):
+            chunk = normalize_rows(np.asarray(embeddings[i:i+chunk_size], dtype=np.float32))
+            index.add_items(chunk, np.arange(i, i + len(chunk)), num_threads=num_threads or -1)
+            if verbose:
+                print(f"Inserted {i + len(chunk)} of {len(embeddings)} embeddings")
+        return cls(index, m, construction_ef, fingerprint=fingerprint)
+
+    def search(self, query_matrix: np.ndarray, limit: int, ef: Optional[int] = None,
+               filter: Optional[Callable[[int], bool]] = None):
+        '''
+        Return the rows and cosine similarities of the approximate top-k per query, best first.
+
+        Parameters:
+        ----------
+        query_matrix: np.ndarray
+            The L2-normalized query embeddings, one row per query.
+        limit: int
+            The number of rows per query.
+        ef: Optional[int]
+            Length of the candidate list, default `search_ef`. At least `limit` is used.
+        filter: Optional[Callable[[int], bool]]
+            Only rows for which it returns True are returned.
+        '''
+        query_matrix = np.atleast_2d(np.asarray(query_matrix, dtype=np.float32))
+        with self._lock:
+            self.index.set_ef(max(ef or self.search_ef, limit))
+            # The filter is a Python function, calling it from several threads would only contend for the GIL
+            rows, distances = self.index.knn_query(query_matrix, k=limit, num_threads=1 if filter else -1,
+                                                   filter=filter)
+        return rows.astype(np.int64), 1.0 - distances
+
+    def save(self, path: str = PATH_HNSW_INDEX):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.index.save_index(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        with open(path + ".json", "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.fingerprint, "m": self.m, "construction_ef": self.construction_ef,
+                       "dim": self.index.dim, "count": len(self), "recall": self.recall}, f, indent=1)
+
+    @classmethod
+    def load(cls, path: str = PATH_HNSW_INDEX) -> Optional["HnswIndex"]:
+        '''
+        Load a saved index, None if there is none.
+        '''
+        import hnswlib
+
+        if not os.path.exists(path) or not os.path.exists(path + ".json"):
+            return None
+        with open(path + ".json", encoding="utf-8") as f:
+            manifest = json.load(f)
+        index = hnswlib.Index(space="ip", dim=manifest["dim"])
+        index.load_index(path, max_elements=manifest["count"])
+        return cls(index, manifest["m"], manifest["construction_ef"], fingerprint=manifest["fingerprint"],
+                   recall=manifest.get("recall"))
+
+
+def load_hnsw_index(fingerprint: str, embeddings: np.ndarray, path: str = PATH_HNSW_INDEX, m: int = HNSW_M,
+                    construction_ef: int = HNSW_CONSTRUCTION_EF, search_ef: int = HNSW_SEARCH_EF) -> HnswIndex:
+    '''
+    Load the saved HNSW index of the segments with the given fingerprint and parameters, or build and save it.
+
+    Parameters:
+    ----------
+    fingerprint: str
+        The fingerprint of the segment corpus the index has to match.
+    embeddings: np.ndarray
+        The embeddings of the segments, only read if the index has to be built.
+    path: str
+        The path of the saved index, None to not save it.
+    m, construction_ef: int
+        The parameters the saved graph has to be built with.
+    search_ef: int
+        The default ef of the searches.
+    '''
+    index = HnswIndex.load(path) if path is not None else None
+    if index is None or (index.fingerprint, index.m, index.construction_ef, len(index)) != \
+            (fingerprint, m, construction_ef, len(embeddings)):
+        index = HnswIndex.build(embeddings, m=m, construction_ef=construction_ef, fingerprint=fingerprint)
+        if path is not None:
+            index.save(path)
+    index.search_ef = search_ef
+    return index
@@ -0,0 +1,231 @@
+import os
+import re
+import numpy as np
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence
+from settings import PATH_LEXICAL_INDEX, RRF_K
+
+# Frequent German function words, they carry no information for retrieval
+STOPWORDS = frozenset("""
+aber alle allem allen aller alles als also am an ander andere anderen auch auf aus bei beim bis bzw da damit dann
+das dass dem den denen der deren des dessen die dies diese diesem diesen dieser dieses doch dort durch ein eine
+einem einen einer eines es fur gem gemass hat haben hier ihr ihre im in ist ja jede jedem jeden jeder jedes kann
+kein keine konnen mit muss nach nicht noch nur ob oder ohne sein seine sich sie sind so soll sowie uber um und
+unter vom von vor war wie wird werden wenn wer was welche welchem welchen welcher wo zu zum zur zwischen
+""".split())
+
+PARAGRAPH_PATTERN = re.compile(r"§+\s*(\d+\s?[a-z]?)\b")
+TOKEN_PATTERN = re.compile(r"§\d+[a-z]?|\d+[a-z]?|[a-z]+")
+SUFFIXES = ("ern", "em", "en", "er", "es", "e", "n", "s")
+UMLAUTS = str.maketrans({"ä": "a", "ö": "o", "ü": "u", "ß": "ss"})
+
+
+def stem(token: str, min_length: int = 4) -> str:
+    '''
+    Strip one German inflection suffix, so "Zulagen" and "Zulage" share a term.
+    '''
+    if token[0].isdigit() or token[0] == "§":
+        return token
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= min_length:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    '''
+    Split a German text into normalized terms.
+
+    Text is lower-cased, umlauts are folded ("Zuschüsse" -> "zuschusse"), stopwords
+    are dropped and a simple suffix stemmer is applied.
+    Paragraph references become a term of their own ("§ 10a EStG" -> "§10a", "10a",
+    "estg"), since legal questions often hinge on them.
+    '''
+    text = text.lower().translate(UMLAUTS)
+    text = PARAGRAPH_PATTERN.sub(lambda m: f" §{m.group(1).replace(' ', '')} {m.group(1)} ", text)
+    return [stem(token) for token in TOKEN_PATTERN.findall(text) if token not in STOPWORDS and len(token) > 1]
+
+
+def split_compound(term: str, vocabulary, min_part: int = 4) -> List[str]:
+    '''
+    Split a compound into two terms of the vocabulary, e.g. "grundzulag" -> ["grund", "zulag"].
+
+    The head may end with a linking "s" or "n" (Fugenelement). The split with the
+    longest known tail is used, since the tail carries the meaning of a German compound.
+    '''
+    if len(term) < 2 * min_part or not term[0].isalpha():
+        return []
+    for i in range(min_part, len(term) - min_part + 1):
+        head, tail = term[:i], term[i:]
+        if tail not in vocabulary:
+            continue
+        if head in vocabulary:
+            return [head, tail]
+        if head[-1] in "sn" and head[:-1] in vocabulary:
+            return [head[:-1], tail]
+    return []
+
+
+class BM25Index:
+    '''
+    Compact in-process inverted index with BM25 scoring.
+
+    The postings are stored as CSR arrays (term -> segment rows) together with their
+    precomputed BM25 impact, so a query sums a few slices of an array. Compounds are
+    also indexed by their parts if both parts occur in the corpus on their own, so
+    "Zulage" finds "Grundzulage". The index is saved as a single .npz file without
+    pickled objects and loads in milliseconds.
+    '''
+    def __init__(self, ids: List[str], terms: List[str], indptr: np.ndarray, rows: np.ndarray,
+                 weights: np.ndarray, fingerprint: Optional[str] = None):
+        self.ids = ids
+        self.terms = terms
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.indptr = indptr
+        self.rows = rows
+        self.weights = weights
+        self.fingerprint = fingerprint
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_segments(cls, segments: Iterable[dict], fingerprint: Optional[str] = None,
+                      k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        '''
+        Build the index from segments with "id" and "text" keys.
+        '''
+        ids = []
+        documents = []
+        for segment in segments:
+            ids.append(segment["id"])
+            documents.append(Counter(tokenize(segment["text"])))
+
+        vocabulary = set().union(*documents) if documents else set()
+        splits = {term: split_compound(term, vocabulary) for term in vocabulary}
+        for counts in documents:
+            for term, count in list(counts.items()):
+                for part in splits[term]:
+                    counts[part] += count
+
+        terms = sorted(set().union(*documents)) if documents else []
+        term_ids = {term: i for i, term in enumerate(terms)}
+        lengths = np.array([sum(counts.values()) for counts in documents], dtype=np.float32)
+        average_length = max(float(lengths.mean()), 1.0) if len(lengths) else 1.0
+
+        postings = [[] for _ in terms]
+        for row, counts in enumerate(documents):
+            for term, count in counts.items():
+                postings[term_ids[term]].append((row, count))
+
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(p) for p in postings])
+        rows = np.empty(indptr[-1], dtype=np.int32)
+        weights = np.empty(indptr[-1], dtype=np.float32)
+        for i, term_postings in enumerate(postings):
+            term_rows, counts = zip(*term_postings)
+            term_rows = np.array(term_rows, dtype=np.int32)
+            counts = np.array(counts, dtype=np.float32)
+            idf = np.log(1 + (len(documents) - len(term_rows) + 0.5) / (len(term_rows) + 0.5))
+            norm = k1 * (1 - b + b * lengths[term_rows] / average_length)
+            rows[indptr[i]:indptr[i+1]] = term_rows
+            weights[indptr[i]:indptr[i+1]] = idf * counts * (k1 + 1) / (counts + norm)
+
+        return cls(ids, terms, indptr, rows, weights, fingerprint=fingerprint)
+
+    def query_terms(self, query: str) -> List[int]:
+        '''
+        Return the ids of the known terms of a query, including the parts of compounds.
+        '''
+        term_ids = []
+        for term in tokenize(query):
+            for t in [term] + split_compound(term, self.term_ids):
+                if t in self.term_ids and self.term_ids[t] not in term_ids:
+                    term_ids.append(self.term_ids[t])
+        return term_ids
+
+    def scores(self, query: str, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        '''
+        Return the BM25 score of every segment for the query, 0 for segments outside the mask.
+        '''
+        slices = [slice(self.indptr[t], self.indptr[t+1]) for t in self.query_terms(query)]
+        if not slices:
+            return np.zeros(len(self.ids), dtype=np.float32)
+        rows = np.concatenate([self.rows[s] for s in slices])
+        weights = np.concatenate([self.weights[s] for s in slices])
+        if mask is not None:
+            # Postings of filtered-out segments are dropped before they are summed
+            allowed = mask[rows]
+            rows, weights = rows[allowed], weights[allowed]
+        return np.bincount(rows, weights=weights, minlength=len(self.ids)).astype(np.float32)
+
+    def search(self, query: str, limit: int = 5, mask: Optional[np.ndarray] = None):
+        '''
+        Return the ids and BM25 scores of the best matching segments, best first.
+
+        Segments that share no term with the query or are outside the mask (a boolean
+        array over the rows of the index) are not returned.
+        '''
+        scores = self.scores(query, mask)
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [self.ids[row] for row in candidates], scores[candidates]
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, ids=_encode_strings(self.ids), terms=_encode_strings(self.terms),
+                     indptr=self.indptr, rows=self.rows, weights=self.weights,
+                     fingerprint=_encode_strings([self.fingerprint or ""]))
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path) as data:
+            return cls(_decode_strings(data["ids"]), _decode_strings(data["terms"]), data["indptr"], data["rows"],
+                       data["weights"], fingerprint=_decode_strings(data["fingerprint"])[0] or None)
+
+
+def _encode_strings(strings: Sequence[str]) -> np.ndarray:
+    return np.frombuffer("\n".join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def _decode_strings(data: np.ndarray) -> List[str]:
+    return data.tobytes().decode("utf-8").split("\n")
+
+
+def load_lexical_index(fingerprint: str, segments, path: str = PATH_LEXICAL_INDEX) -> BM25Index:
+    '''
+    Load the lexical index of the segments with the given fingerprint, or build and save it.
+
+    Parameters:
+    ----------
+    fingerprint: str
+        The fingerprint of the segment corpus the index has to match.
+    segments: Iterable[dict] or callable
+        The segments (with "id" and "text"), or a function returning them, which is
+        only called if the index has to be built.
+    path: str
+        The path of the saved index, None to not save it.
+    '''
+    if path is not None and os.path.exists(path):
+        index = BM25Index.load(path)
+        if index.fingerprint == fingerprint:
+            return index
+    index = BM25Index.from_segments(segments() if callable(segments) else segments, fingerprint=fingerprint)
+    if path is not None:
+        index.save(path)
+    return index
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = RRF_K) -> List[str]:
+    '''
+    Fuse several rankings of ids, every id scores sum(1 / (k + rank)) over the rankings.
+    '''
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda doc_id: -scores[doc_id])
@@ -0,0 +1,65 @@
+import numpy as np
+from typing import Optional, Sequence
+from .data_models import DocumentFilter, date_to_int
+
+
+class MetadataIndex:
+    '''
+    Columnar filename and document date of every segment, for pre-filtering searches.
+
+    Filenames are dictionary-encoded and dates are stored as sortable integers
+    (yyyymmdd), so a DocumentFilter is evaluated into a boolean mask over the rows
+    with a few vectorized comparisons. Searches then only score the allowed rows,
+    instead of filtering (and shrinking) the top-k afterwards.
+    '''
+    def __init__(self, ids: Sequence[str], filenames: Sequence[str], document_dates: Sequence[str]):
+        self.ids = list(ids)
+        self.row_by_id = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self.filenames, codes = np.unique(np.array(filenames, dtype=str), return_inverse=True)
+        self.filename_codes = codes.astype(np.int32)
+        self.dates = np.array([date_to_int(date) for date in document_dates], dtype=np.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def mask(self, filter: Optional[DocumentFilter]) -> Optional[np.ndarray]:
+        '''
+        Return the boolean mask of the rows that match the filter, None if it matches all rows.
+        '''
+        if filter is None or filter.is_empty:
+            return None
+        mask = np.ones(len(self.ids), dtype=bool)
+        if filter.filenames is not None:
+            codes = np.flatnonzero(np.isin(self.filenames, filter.filenames))
+            mask &= np.isin(self.filename_codes, codes)
+        date_from, date_to = filter.date_range()
+        if date_from is not None:
+            mask &= self.dates >= date_from
+        if date_to is not None:
+            mask &= self.dates <= date_to
+        return mask
+
+    def rows_of(self, ids: Sequence[str]) -> np.ndarray:
+        return np.array([self.row_by_id[doc_id] for doc_id in ids], dtype=np.int64)
+
+    def save(self, path: str):
+        np.savez(path, ids=np.array(self.ids), filenames=self.filenames, filename_codes=self.filename_codes,
+                 dates=self.dates)
+
+    @classmethod
+    def load(cls, path: str) -> "MetadataIndex":
+        data = np.load(path)
+        index = cls.__new__(cls)
+        index.ids = data["ids"].tolist()
+        index.row_by_id = {doc_id: row for row, doc_id in enumerate(index.ids)}
+        index.filenames = data["filenames"]
+        index.filename_codes = data["filename_codes"]
+        index.dates = data["dates"]
+        return index
+
+    @classmethod
+    def from_segments(cls, segments: Sequence[dict]) -> "MetadataIndex":
+        return cls([segment["id"] for segment in segments],
+                   [segment["filename"] for segment in segments],
+                   [segment["document_date"] for segment in segments])
+
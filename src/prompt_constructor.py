@@ -1,20 +1,157 @@
-from .prompts import USER_PROMPT
-from typing import List
+from .prompts import SYSTEM_PROMPT, USER_PROMPT
+import re
+import numpy as np
+from collections import deque
+from typing import List, Optional, Tuple
+from settings import PROMPT_TOKEN_BUDGET
 from .data_models import Document
+from .token_counter import TokenCounter
+
+# Sentence ends, except after common abbreviations of legal texts ("Abs.", "Nr.", "z. B.", ...)
+# and enumerations ("1.", "12.")
+SENTENCE_END = re.compile(r"(?<=[.!?;])(?<!\bAbs\.)(?<!\bNr\.)(?<!\bvgl\.)(?<!\bggf\.)(?<!\bbzw\.)(?<!\bRz\.)"
+                          r"(?<!\bS\.)(?<!\bz\.)(?<!\bz\. B\.)(?<!\bd\.)(?<!\b\d\.)(?<!\b\d\d\.)\s+")
+TRUNCATION_MARK = " [...]"
+
 
 class PromptConstructor:
-    def __init__(self):
-        pass
+    '''
+    Packs the retrieved documents into the prompt within a token budget.
+
+    Documents are added in relevance order. Paragraphs that already occur in a
+    better-ranked document (e.g. overlapping neighbor context) are left out. The
+    first document that does not fit is truncated at a sentence boundary and the
+    remaining documents are dropped. Tokens are counted locally (see TokenCounter).
+    '''
+    def __init__(self, token_budget: Optional[int] = PROMPT_TOKEN_BUDGET, metrics_window: int = 1000):
+        self.token_budget = token_budget
+        self.token_counter = TokenCounter() if token_budget is not None else None
+        self._prompt_tokens = deque(maxlen=metrics_window)
 
     def construct_prompt(self, query, retrieved_docs: List[Document]):
-        documents = ""
+        prompt, _ = self.pack_prompt(query, retrieved_docs)
+        return prompt
+
+    def pack_prompt(self, query, retrieved_docs: List[Document]) -> Tuple[str, dict]:
+        '''
+        Construct the prompt and report how it was packed.
+
+        Parameters:
+        ----------
+        query: str
+            The query to answer.
+        retrieved_docs: List[Document]
+            The retrieved documents, in relevance order.
+
+        Returns:
+        -------
+        prompt: str
+            The prompt.
+        info: dict
+            prompt_tokens (system and user prompt, None without budget), documents
+            (number of documents in the prompt), truncated, dropped and
+            duplicate_paragraphs (number of paragraphs left out as duplicates).
+        '''
+        if self.token_budget is None:
+            documents = "".join(f"{self._header(i_doc, len(retrieved_docs), doc)}\n{doc.text}\n\n"
+                                for i_doc, doc in enumerate(retrieved_docs))
+            return USER_PROMPT.format(question=query, documents=documents), {
+                "prompt_tokens": None, "documents": len(retrieved_docs), "truncated": False, "dropped": 0,
+                "duplicate_paragraphs": 0}
+
+        # Tokens left for the documents after the system prompt, the template and the question
+        budget = self.token_budget - self.token_counter.count(SYSTEM_PROMPT) \
+            - self.token_counter.count(USER_PROMPT.format(question=query, documents=""))
 
-        for i_doc, doc in enumerate(retrieved_docs):
-            header = f"Treffer {i_doc+1} von {len(retrieved_docs)}:\nDatei {doc.filename} Seite {doc.page} vom {doc.document_date}"
-            documents += f"{header}\n{doc.text}\n\n"
-        
+        # The headers name the number of documents in the prompt ("Treffer 1 von 3"), which is only known
+        # after packing: pack for n documents and pack again for fewer if not all of them fit
+        n_docs = len(retrieved_docs)
+        while True:
+            texts, truncated, duplicates = self._pack_documents(retrieved_docs, budget, n_docs)
+            if len(texts) == n_docs:
+                break
+            n_docs = len(texts)
+
+        documents = "".join(f"{self._header(i_doc, len(texts), doc)}\n{text}\n\n" for i_doc, (doc, text) in enumerate(texts))
         prompt = USER_PROMPT.format(question=query, documents=documents)
-        return prompt
+        prompt_tokens = self.token_counter.count(SYSTEM_PROMPT) + self.token_counter.count(prompt)
+        self._prompt_tokens.append(prompt_tokens)
+
+        return prompt, {
+            "prompt_tokens": prompt_tokens,
+            "documents": len(texts),
+            "truncated": truncated,
+            "dropped": len(retrieved_docs) - len(texts),
+            "duplicate_paragraphs": duplicates,
+        }
+
+    def _pack_documents(self, retrieved_docs: List[Document], budget: int, n_docs: int):
+        '''
+        Pack at most n_docs documents into the budget, their headers counted as "von n_docs".
+        '''
+        seen = set()
+        texts = []
+        truncated = False
+        duplicates = 0
+        for doc in retrieved_docs:
+            if len(texts) == n_docs:
+                break
+            paragraphs = []
+            for paragraph in doc.text.split("\n\n"):
+                key = " ".join(paragraph.split())
+                if key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+                paragraphs.append(paragraph)
+            if not paragraphs:
+                continue
+
+            header = self._header(len(texts), n_docs, doc)
+            text = "\n\n".join(paragraphs)
+            tokens = self.token_counter.count(f"{header}\n{text}\n\n")
+            if tokens <= budget:
+                texts.append((doc, text))
+                budget -= tokens
+                continue
+
+            text = self._truncate(text, budget - self.token_counter.count(f"{header}\n{TRUNCATION_MARK}\n\n"))
+            if text:
+                texts.append((doc, text + TRUNCATION_MARK))
+            truncated = True
+            break
+        return texts, truncated, duplicates
+
+    @staticmethod
+    def _header(i_doc: int, n_docs: int, doc: Document) -> str:
+        return f"Treffer {i_doc+1} von {n_docs}:\nDatei {doc.filename} Seite {doc.page} vom {doc.document_date}"
 
-        
+    def _truncate(self, text: str, budget: int) -> str:
+        '''
+        Return the longest prefix of whole sentences of the text within the token budget.
+        '''
+        ends = [match.start() for match in SENTENCE_END.finditer(text)] + [len(text)]
+        # Binary search over the sentence ends, the token count grows with the prefix
+        low, high = 0, len(ends)
+        while low < high:
+            middle = (low + high) // 2
+            if self.token_counter.count(text[:ends[middle]]) <= budget:
+                low = middle + 1
+            else:
+                high = middle
+        return text[:ends[low - 1]] if low > 0 else ""
 
+    @property
+    def stats(self) -> dict:
+        '''
+        Prompt token statistics over the most recent prompts.
+        '''
+        tokens = np.array(self._prompt_tokens, dtype=float)
+        if len(tokens) == 0:
+            return {"prompts": 0}
+        return {
+            "prompts": len(tokens),
+            "prompt_tokens_mean": float(tokens.mean()),
+            "prompt_tokens_p95": float(np.percentile(tokens, 95)),
+            "prompt_tokens_max": int(tokens.max()),
+        }
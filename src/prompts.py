@@ -1,5 +1,7 @@
 SYSTEM_PROMPT = "Du bist ein hilfreicher Assistent und Experte für Steuerrecht. Du antwortest direkt dem Kunden, der Fragen zu den Dokumenten hat."
 
+REFUSAL_RESPONSE = "Hoppla! Zu der Frage konnten keine Informationen gefunden werden."
+
 USER_PROMPT = """
 Du bist beauftragt, Fragen anhand der bereitgestellten Dokumente zu beantworten. Ich stelle dir eine Frage und eine Liste von Dokumenten vor, die relevant für die Frage sind.
 
@@ -0,0 +1,145 @@
+import numpy as np
+from typing import Optional
+
+QUANTIZATIONS = ("float16", "int8", "binary")
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+class QuantizedIndex:
+    '''
+    Compressed copy of an embedding matrix that scores queries approximately.
+
+    Subclasses encode the (L2-normalized) embeddings in chunks, so the float32 matrix
+    never has to be resident in memory, and score queries chunk by chunk as well.
+    The scores only have to rank the segments; the exact cosine similarities of a
+    shortlist are computed from the float32 embeddings by the caller (rescoring).
+    '''
+    name = None
+    code_dtype = None
+
+    def __init__(self, embeddings: np.ndarray, chunk_size: int = 65536):
+        self.chunk_size = chunk_size
+        self.count, self.dim = embeddings.shape
+        self.fit(embeddings)
+        self.codes = np.empty((self.count, self.code_size), dtype=self.code_dtype)
+        for start in range(0, self.count, chunk_size):
+            self.codes[start:start+chunk_size] = self.encode(normalize_rows(embeddings[start:start+chunk_size]))
+
+    @property
+    def code_size(self) -> int:
+        return self.dim
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+    def fit(self, embeddings: np.ndarray):
+        pass
+
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def score_chunk(self, query_matrix: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def scores(self, query_matrix: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        '''
+        Return the approximate scores of all segments (or only of `rows`), shape (n_queries, n_rows).
+        '''
+        query_matrix = normalize_rows(np.atleast_2d(query_matrix))
+        count = self.count if rows is None else len(rows)
+        scores = np.empty((len(query_matrix), count), dtype=np.float32)
+        for start in range(0, count, self.chunk_size):
+            codes = self.codes[start:start+self.chunk_size] if rows is None else self.codes[rows[start:start+self.chunk_size]]
+            scores[:, start:start+self.chunk_size] = self.score_chunk(query_matrix, codes)
+        return scores
+
+
+class Float16Index(QuantizedIndex):
+    '''
+    Half precision embeddings, 2 bytes per dimension.
+    '''
+    name = "float16"
+    code_dtype = np.float16
+
+    def encode(self, embeddings):
+        return embeddings.astype(np.float16)
+
+    def score_chunk(self, query_matrix, codes):
+        # BLAS has no float16 kernels, the chunk is cast to float32
+        return query_matrix @ codes.astype(np.float32).T
+
+
+class Int8Index(QuantizedIndex):
+    '''
+    Per-dimension scalar quantization to 256 levels, 1 byte per dimension.
+
+    Every dimension is mapped linearly from [min, max] over the corpus to 0..255, so
+    x ≈ offset + scale * code and q·x ≈ q·offset + (q * scale)·code.
+    '''
+    name = "int8"
+    code_dtype = np.uint8
+
+    def fit(self, embeddings):
+        low = np.full(self.dim, np.inf, dtype=np.float32)
+        high = np.full(self.dim, -np.inf, dtype=np.float32)
+        for start in range(0, self.count, self.chunk_size):
+            chunk = normalize_rows(embeddings[start:start+self.chunk_size])
+            low = np.minimum(low, chunk.min(axis=0))
+            high = np.maximum(high, chunk.max(axis=0))
+        self.offset = low
+        self.scale = np.maximum(high - low, 1e-12) / 255
+
+    def encode(self, embeddings):
+        return np.clip(np.rint((embeddings - self.offset) / self.scale), 0, 255).astype(np.uint8)
+
+    def score_chunk(self, query_matrix, codes):
+        return (query_matrix * self.scale) @ codes.astype(np.float32).T + (query_matrix @ self.offset)[:, None]
+
+
+class BinaryIndex(QuantizedIndex):
+    '''
+    1-bit sign codes, dim / 8 bytes per embedding, compared by Hamming distance.
+
+    The agreement of the sign bits (dim - 2 * Hamming distance, computed with popcount)
+    is a coarse estimate of the cosine similarity; use it with rescoring. The signs are
+    taken relative to the corpus mean: the embeddings of a model share a common
+    direction, so the raw signs would be nearly the same for all segments.
+    '''
+    name = "binary"
+    code_dtype = np.uint8
+
+    @property
+    def code_size(self):
+        return (self.dim + 7) // 8
+
+    def fit(self, embeddings):
+        total = np.zeros(self.dim, dtype=np.float64)
+        for start in range(0, self.count, self.chunk_size):
+            total += normalize_rows(embeddings[start:start+self.chunk_size]).sum(axis=0)
+        self.mean = (total / max(self.count, 1)).astype(np.float32)
+
+    def encode(self, embeddings):
+        return np.packbits(embeddings > self.mean, axis=1)
+
+    def score_chunk(self, query_matrix, codes):
+        query_codes = self.encode(query_matrix)
+        scores = np.empty((len(query_matrix), len(codes)), dtype=np.float32)
+        for i, query_code in enumerate(query_codes):
+            hamming = np.bitwise_count(codes ^ query_code).sum(axis=1, dtype=np.int32)
+            scores[i] = self.dim - 2 * hamming
+        return scores
+
+
+def create_quantized_index(quantization: str, embeddings: np.ndarray) -> QuantizedIndex:
+    '''
+    Create the compressed index of the given kind ("float16", "int8" or "binary").
+    '''
+    for index_class in (Float16Index, Int8Index, BinaryIndex):
+        if index_class.name == quantization:
+            return index_class(embeddings)
+    raise ValueError(f"Unknown quantization {quantization}, expected one of {QUANTIZATIONS}")
@@ -1,39 +1,133 @@
+from contextlib import closing
+from typing import Iterator, Optional
 from .embedder import Embedder
+from .embedding_cache import EmbeddingCache
+from .answer_cache import AnswerCache
 from .prompt_constructor import PromptConstructor
 from .chatgpt_client import ChatGPTClient
-from settings import (EMBEDDER_MODEL, NORMALIZE_EMBEDDINGS, 
-                        DOCUMENT_LIMIT, EXTRA_CONTEXT)
-from .document_database_2 import DocumentDatabase
+from .answerability_gate import AnswerabilityGate
+from .prompts import REFUSAL_RESPONSE
+from .data_models import DocumentFilter
+from .tracing import Tracer, JsonLinesExporter
+from settings import (EMBEDDER_MODEL, NORMALIZE_EMBEDDINGS, EMBEDDING_CACHE_SIZE,
+                        EMBEDDING_CACHE_PATH, DOCUMENT_LIMIT, EXTRA_CONTEXT, ANSWER_CACHE_SIZE, REFUSAL_PREFIX,
+                        ANSWERABILITY_GATE, RERANK, RERANK_CANDIDATES, TRACING, TRACE_PATH)
+from .database_backends import create_document_database
 
-class RAGPipeline:
-    def __init__(self, verbose: bool = False):
+class RAGPipelineBase:
+    '''
+    Components and stages shared by RAGPipeline and AsyncRAGPipeline.
+
+    Subclasses set the `client_class` of the LLM client and implement the generation
+    and the run methods on top of the stages.
+    '''
+    client_class = None
+
+    def __init__(self, verbose: bool = False, search_options: Optional[dict] = None):
         import time
         self.verbose = verbose
+        # Passed to every search of the document database, e.g. {"search_ef": 200} for the hnsw backend
+        self.search_options = search_options or {}
+        # Seconds spent on every component, see scripts/benchmark_startup.py
+        self.startup_times = {}
+        # Spans of every request and latency histograms per stage, verbose prints every span
+        self.tracer = Tracer(enabled=TRACING, exporters=[JsonLinesExporter(TRACE_PATH)] if TRACE_PATH else None,
+                             verbose=verbose)
 
         if self.verbose:
             print("\nInitializing RAG Pipeline components...")
-        
-        start = time.time()
-        self.embedder = Embedder(EMBEDDER_MODEL, normalize=NORMALIZE_EMBEDDINGS)
-        if self.verbose:
-            print(f"Embedder initialization took {time.time() - start:.2f}s")
-        
-        start = time.time()
-        self.document_database = DocumentDatabase()
-        if self.verbose:
-            print(f"Document Database initialization took {time.time() - start:.2f}s")
-        
+
         start = time.time()
-        self.prompt_constructor = PromptConstructor()
-        if self.verbose:
-            print(f"Prompt Constructor initialization took {time.time() - start:.2f}s")
-        
+        self.embedder = self._timed("Embedder", lambda: Embedder(EMBEDDER_MODEL, normalize=NORMALIZE_EMBEDDINGS))
+        if EMBEDDING_CACHE_SIZE > 0 or EMBEDDING_CACHE_PATH:
+            self.embedder.cache = EmbeddingCache(self.embedder.identity)
+        self.document_database = self._timed("Document Database", create_document_database)
+        self.prompt_constructor = self._timed("Prompt Constructor", PromptConstructor)
+        self.chatgpt_client = self._timed("ChatGPT Client", self.client_class)
+
+        self.answer_cache = AnswerCache() if ANSWER_CACHE_SIZE > 0 else None
+        self.cross_encoder = None
+        if RERANK:
+            # Imported here, transformers is only loaded for the cross-encoder if reranking is enabled
+            from .cross_encoder import CrossEncoder
+            self.cross_encoder = self._timed("Cross-Encoder", CrossEncoder)
+        self.answerability_gate = AnswerabilityGate(cross_encoder=self.cross_encoder) if ANSWERABILITY_GATE else None
+        self.startup_times["Total"] = time.time() - start
+
+    def _timed(self, component: str, factory):
+        import time
+
         start = time.time()
-        self.chatgpt_client = ChatGPTClient()
+        instance = factory()
+        self.startup_times[component] = time.time() - start
         if self.verbose:
-            print(f"ChatGPT Client initialization took {time.time() - start:.2f}s")
+            print(f"{component} initialization took {self.startup_times[component]:.2f}s")
+        return instance
+
+    def _embed_query(self, query: str):
+        with self.tracer.span("embed"):
+            return self.embedder.embed(query.strip())[0]
+
+    def _retrieve(self, query_embedding, doc_limit: int, extra_context: bool, query: str = None,
+                  filter: Optional[DocumentFilter] = None):
+        rerank = self.cross_encoder is not None and query is not None
+        limit = max(doc_limit, RERANK_CANDIDATES) if rerank else doc_limit
+        with self.tracer.span("retrieve", limit=limit, filtered=filter is not None) as span:
+            # The query text enables the hybrid (dense + BM25) search of the database
+            retrieved_docs = self.document_database.find(query_embedding, limit=limit,
+                                                         extra_context=extra_context and not rerank,
+                                                         query_text=query, filter=filter, **self.search_options)
+            span.set(hits=len(retrieved_docs))
+
+        if rerank:
+            # The wider candidate set is scored in one batched pass, the context is added to the best hits only
+            with self.tracer.span("rerank", candidates=len(retrieved_docs)) as span:
+                retrieved_docs = self.cross_encoder.rerank(query, retrieved_docs, doc_limit)
+                if extra_context:
+                    retrieved_docs = self.document_database.add_context(retrieved_docs)
+                span.set(hits=len(retrieved_docs))
+        return retrieved_docs
+
+    def _answerable(self, query: str, query_embedding, retrieved_docs) -> bool:
+        if self.answerability_gate is None:
+            return True
+        with self.tracer.span("answerability") as span:
+            answerable = self.answerability_gate.is_answerable(query, query_embedding, retrieved_docs)
+            span.set(answerable=answerable)
+        return answerable
 
-    def run(self, query: str, doc_limit: int = DOCUMENT_LIMIT, extra_context: bool = EXTRA_CONTEXT) -> str:
+    def _construct_prompt(self, query: str, retrieved_docs) -> str:
+        with self.tracer.span("prompt") as span:
+            prompt, info = self.prompt_constructor.pack_prompt(query, retrieved_docs)
+            span.set(**{key: value for key, value in info.items() if value is not None})
+        return prompt
+
+    def _trace_response(self, span, response: str, cancelled: bool = False):
+        # Counted only for the trace, the API response of a stream has no token usage
+        if self.tracer.enabled and self.prompt_constructor.token_counter is not None:
+            span.set(completion_tokens=self.prompt_constructor.token_counter.count(response))
+        span.set(refusal=response.startswith(REFUSAL_PREFIX), **({"cancelled": True} if cancelled else {}))
+
+    def _cached_response(self, query_embedding, retrieved_docs):
+        if self.answer_cache is None:
+            return None
+        response = self.answer_cache.lookup(query_embedding, retrieved_docs, self.document_database.fingerprint)
+        if response is not None:
+            # Set on the span of the try
+            self.tracer.current_span().set(answer_cache_hit=True)
+        return response
+
+    def _cache_response(self, query_embedding, retrieved_docs, response: str, latency: float):
+        if self.answer_cache is not None:
+            self.answer_cache.store(query_embedding, retrieved_docs, response, latency=latency,
+                                    fingerprint=self.document_database.fingerprint)
+
+
+class RAGPipeline(RAGPipelineBase):
+    client_class = ChatGPTClient
+
+    def run(self, query: str, doc_limit: int = DOCUMENT_LIMIT, extra_context: bool = EXTRA_CONTEXT,
+            filter: Optional[DocumentFilter] = None) -> str:
         '''
         Run the RAG pipeline.
 
@@ -45,39 +139,83 @@ class RAGPipeline:
             Number of documents to retrieve
         extra_context: bool
             Whether to include extra context
+        filter: Optional[DocumentFilter]
+            Only documents of these files and/or dates are retrieved
 
         Returns:
         -------
         response: str
             The response to the query.
         '''
+        with self.tracer.span("request", method="run"):
+            query_embedding = self._embed_query(query)
+            retrieved_docs = self._retrieve(query_embedding, doc_limit, extra_context, query, filter)
+            if not self._answerable(query, query_embedding, retrieved_docs):
+                return REFUSAL_RESPONSE
+            with self.tracer.span("attempt", attempt=1, documents=len(retrieved_docs)):
+                return self._generate(query, query_embedding, retrieved_docs)
+
+    def _generate(self, query: str, query_embedding, retrieved_docs) -> str:
         import time
+
+        response = self._cached_response(query_embedding, retrieved_docs)
+        if response is not None:
+            return response
+
+        prompt = self._construct_prompt(query, retrieved_docs)
         
-        start = time.time()
-        query_embedding = self.embedder.embed(query.strip())[0]
-        if self.verbose:
-            print(f"Query embedding took {time.time() - start:.2f}s")
-        
-        start = time.time()
-        retrieved_docs = self.document_database.find(query_embedding, limit=doc_limit, extra_context=extra_context)
-        if self.verbose:
-            print(f"Document retrieval took {time.time() - start:.2f}s")
-        
-        start = time.time()
-        prompt = self.prompt_constructor.construct_prompt(query, retrieved_docs)
-        if self.verbose:
-            print(f"Prompt construction took {time.time() - start:.2f}s")
-        
-        start = time.time()
-        response = self.chatgpt_client.generate_response(prompt)
-        if self.verbose:
-            print(f"OpenAI call took {time.time() - start:.2f}s")
-        
+        with self.tracer.span("llm") as span:
+            start = time.time()
+            response = self.chatgpt_client.generate_response(prompt)
+            latency = time.time() - start
+            self._trace_response(span, response)
+
+        self._cache_response(query_embedding, retrieved_docs, response, latency)
         return response
 
-    def run_with_retry(self, query: str, max_retries: int = 2, doc_limit_increment: int = 2) -> str:
+    def _generate_stream(self, query: str, query_embedding, retrieved_docs,
+                         cancel_on_refusal: bool = False) -> Iterator[str]:
+        import time
+
+        response = self._cached_response(query_embedding, retrieved_docs)
+        if response is not None:
+            yield response
+            return
+
+        prompt = self._construct_prompt(query, retrieved_docs)
+
+        parts = []
+        cancelled = False
+        with self.tracer.span("llm", stream=True) as span:
+            start = time.time()
+            with closing(self.chatgpt_client.generate_response_stream(prompt, cancel_on_refusal)) as stream:
+                for text in stream:
+                    if not parts:
+                        span.set(first_token_s=round(time.time() - start, 3))
+                        # The client yields a refusal as the whole first chunk
+                        cancelled = cancel_on_refusal and text.startswith(REFUSAL_PREFIX)
+                    parts.append(text)
+                    if cancelled:
+                        break
+                    yield text
+            latency = time.time() - start
+            response = "".join(parts)
+            self._trace_response(span, response, cancelled)
+
+        if cancelled:
+            # Yielded after the try is recorded, the caller closes this generator at the refusal.
+            # The response is incomplete and not cached.
+            yield response
+            return
+        self._cache_response(query_embedding, retrieved_docs, response, latency)
+
+    def run_with_retry(self, query: str, max_retries: int = 2, doc_limit_increment: int = 2,
+                       filter: Optional[DocumentFilter] = None) -> str:
         '''
-        Wrapper for run() with automatic retry on "Hoppla" responses.
+        Run the RAG pipeline with automatic retry on "Hoppla" responses.
+
+        The query is embedded and the index is searched only once for the largest
+        number of documents; every retry builds its prompt from the already-fetched hits.
 
         Parameters:
         ----------
@@ -87,20 +225,39 @@ class RAGPipeline:
             Maximum number of retry attempts
         doc_limit_increment: int
             How much to increase the document limit on each retry
+        filter: Optional[DocumentFilter]
+            Only documents of these files and/or dates are retrieved
 
         Returns:
         -------
         response: str
             The final response to the query
         '''
+        with self.tracer.span("request", method="run_with_retry"):
+            return self._run_with_retry(query, max_retries, doc_limit_increment, filter)
+
+    def _run_with_retry(self, query: str, max_retries: int, doc_limit_increment: int,
+                        filter: Optional[DocumentFilter]) -> str:
         current_limit = DOCUMENT_LIMIT
         current_try = 0
         extra_context = EXTRA_CONTEXT
+
+        # Embed and search once: the hits of every retry are a prefix of the largest top-k
+        query_embedding = self._embed_query(query)
+        max_limit = DOCUMENT_LIMIT + max_retries * doc_limit_increment
+        hits = self._retrieve(query_embedding, max_limit, extra_context=False, query=query, filter=filter)
+        # Questions the corpus cannot answer are rejected without an LLM call
+        if not self._answerable(query, query_embedding, hits):
+            return REFUSAL_RESPONSE
         
         while current_try <= max_retries:
-            response = self.run(query, doc_limit=current_limit, extra_context=extra_context)
+            retrieved_docs = hits[:current_limit]
+            if extra_context:
+                retrieved_docs = self.document_database.add_context(retrieved_docs)
+            with self.tracer.span("attempt", attempt=current_try + 1, documents=len(retrieved_docs)):
+                response = self._generate(query, query_embedding, retrieved_docs)
             
-            if not response.startswith("Hoppla"):
+            if not response.startswith(REFUSAL_PREFIX):
                 if current_try > 0:
                     print(f"\tneeded {current_try+1} try/tries")
                 return response
@@ -112,3 +269,61 @@ class RAGPipeline:
             extra_context = True  # includes the previous and subsequent document of every hit
         
         return response  # Return last response if all retries failed
+
+    def run_stream(self, query: str, max_retries: int = 2, doc_limit_increment: int = 2,
+                   filter: Optional[DocumentFilter] = None) -> Iterator[str]:
+        '''
+        Run the RAG pipeline with retries like run_with_retry, and yield the response as it is generated.
+
+        A "Hoppla" response of a try that is followed by a retry is recognized from its
+        first tokens and the stream is cancelled, so only the final try is generated in full.
+
+        Parameters:
+        ----------
+        query: str
+            The query to answer
+        max_retries: int
+            Maximum number of retry attempts, 0 for a single try
+        doc_limit_increment: int
+            How much to increase the document limit on each retry
+        filter: Optional[DocumentFilter]
+            Only documents of these files and/or dates are retrieved
+
+        Returns:
+        -------
+        chunks: Iterator[str]
+            The text of the response, in the order it is generated.
+        '''
+        with self.tracer.span("request", method="run_stream"):
+            yield from self._run_stream(query, max_retries, doc_limit_increment, filter)
+
+    def _run_stream(self, query: str, max_retries: int, doc_limit_increment: int,
+                    filter: Optional[DocumentFilter]) -> Iterator[str]:
+        current_limit = DOCUMENT_LIMIT
+        current_try = 0
+        extra_context = EXTRA_CONTEXT
+
+        query_embedding = self._embed_query(query)
+        max_limit = DOCUMENT_LIMIT + max_retries * doc_limit_increment
+        hits = self._retrieve(query_embedding, max_limit, extra_context=False, query=query, filter=filter)
+        if not self._answerable(query, query_embedding, hits):
+            yield REFUSAL_RESPONSE
+            return
+
+        while True:
+            retrieved_docs = hits[:current_limit]
+            if extra_context:
+                retrieved_docs = self.document_database.add_context(retrieved_docs)
+            last_try = current_try >= max_retries
+            with self.tracer.span("attempt", attempt=current_try + 1, documents=len(retrieved_docs)), \
+                    closing(self._generate_stream(query, query_embedding, retrieved_docs,
+                                                  cancel_on_refusal=not last_try)) as chunks:
+                first = next(chunks, "")
+                if last_try or not first.startswith(REFUSAL_PREFIX):
+                    yield first
+                    yield from chunks
+                    return
+
+            current_try += 1
+            current_limit += doc_limit_increment
+            extra_context = True  # includes the previous and subsequent document of every hit
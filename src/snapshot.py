@@ -0,0 +1,66 @@
+import json
+import os
+from typing import Dict, Optional
+from settings import STARTUP_SNAPSHOT_PATH
+
+MANIFEST = "manifest.json"
+
+
+def load_manifest(path: str = STARTUP_SNAPSHOT_PATH) -> dict:
+    manifest_path = os.path.join(path, MANIFEST) if path else None
+    if manifest_path is None or not os.path.exists(manifest_path):
+        return {"models": {}}
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def model_path(model_name: str, path: str = STARTUP_SNAPSHOT_PATH) -> str:
+    '''
+    Return the directory of the saved snapshot of a model, or the model name if there is none.
+
+    The result is passed to from_pretrained, which loads a local directory of
+    safetensors files without resolving the model on the Hugging Face Hub.
+    '''
+    directory = load_manifest(path)["models"].get(model_name)
+    if directory is None:
+        return model_name
+    directory = os.path.join(path, directory)
+    return directory if os.path.isdir(directory) else model_name
+
+
+def tiktoken_cache_path(path: str = STARTUP_SNAPSHOT_PATH) -> Optional[str]:
+    '''
+    Return the directory of the saved tiktoken encodings, or None if there is none.
+    '''
+    directory = load_manifest(path).get("tiktoken_cache")
+    return os.path.join(path, directory) if directory else None
+
+
+def save_snapshot(models: Dict[str, tuple], path: str = STARTUP_SNAPSHOT_PATH,
+                  tiktoken_cache: Optional[str] = None):
+    '''
+    Save models for a fast start and record them in the manifest.
+
+    Parameters:
+    ----------
+    models: Dict[str, tuple]
+        Model name -> (model, tokenizer), saved with safetensors.
+    path: str
+        The directory of the snapshot.
+    tiktoken_cache: Optional[str]
+        Directory (relative to path) of the tiktoken encodings, so the token counter
+        does not download them on start.
+    '''
+    os.makedirs(path, exist_ok=True)
+    manifest = load_manifest(path)
+    for model_name, (model, tokenizer) in models.items():
+        directory = model_name.strip("/").replace("/", "--")
+        model.save_pretrained(os.path.join(path, directory), safe_serialization=True)
+        tokenizer.save_pretrained(os.path.join(path, directory))
+        manifest["models"][model_name] = directory
+    if tiktoken_cache is not None:
+        manifest["tiktoken_cache"] = tiktoken_cache
+
+    with open(os.path.join(path, MANIFEST + ".tmp"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(os.path.join(path, MANIFEST + ".tmp"), os.path.join(path, MANIFEST))
@@ -0,0 +1,35 @@
+import os
+from settings import OPENAI_MODEL_NAME, EMBEDDER_MODEL
+from .snapshot import model_path, tiktoken_cache_path
+
+
+class TokenCounter:
+    '''
+    Counts tokens locally, without a request to the LLM.
+
+    Uses the tiktoken encoding of the OpenAI model if tiktoken and its encoding files
+    are available. Otherwise the tokenizer of the embedding model, which is on disk
+    anyway, gives an estimate of the same order.
+    '''
+    def __init__(self, model_name: str = OPENAI_MODEL_NAME, fallback_model: str = EMBEDDER_MODEL):
+        self.encoding = None
+        self.tokenizer = None
+        # Encodings saved with the startup snapshot are not downloaded again
+        cache = tiktoken_cache_path()
+        if cache is not None and "TIKTOKEN_CACHE_DIR" not in os.environ:
+            os.environ["TIKTOKEN_CACHE_DIR"] = cache
+        try:
+            import tiktoken
+            try:
+                self.encoding = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            # tiktoken is not installed or cannot load its encoding files (offline)
+            from transformers import AutoTokenizer
+            self.tokenizer = AutoTokenizer.from_pretrained(model_path(fallback_model))
+
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return len(self.tokenizer(text, add_special_tokens=False, verbose=False)["input_ids"])
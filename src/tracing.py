@@ -0,0 +1,220 @@
+import bisect
+import contextvars
+import json
+import math
+import threading
+import time
+from typing import Callable, List, Optional
+
+# The span the stages of the current request are added to. asyncio tasks and the
+# executor threads of the AsyncRAGPipeline (see _in_executor) get a copy of it.
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# Upper bounds of the histogram buckets in seconds: 1 ms to about 3 min, sqrt(2) apart
+BUCKETS = tuple(0.001 * 2 ** (i / 2) for i in range(36))
+
+
+class Span:
+    '''
+    A timed stage of a request, with attributes (e.g. token or hit counts) and child spans.
+
+    The root span of a request contains a child for every stage and every try of a retry.
+    '''
+    __slots__ = ("name", "attributes", "children", "start", "end", "parent", "_tracer")
+
+    def __init__(self, tracer: "Tracer", name: str, parent: Optional["Span"], attributes: dict):
+        self._tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.children = []
+        self.start = None
+        self.end = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+    def __enter__(self):
+        if self.parent is not None:
+            self.parent.children.append(self)
+        self.start = time.perf_counter()
+        _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        if exc_type is GeneratorExit:
+            self.attributes["cancelled"] = True  # a stream that was closed early
+        elif exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        # Not reset by token: a generator may be closed in another context than it was started in
+        _current_span.set(self.parent)
+        self._tracer._finish(self)
+        return False
+
+    def to_dict(self, origin: Optional[float] = None) -> dict:
+        origin = self.start if origin is None else origin
+        return {"name": self.name, "start_ms": round((self.start - origin) * 1000, 3),
+                "duration_ms": None if self.end is None else round(self.duration * 1000, 3),
+                **({"attributes": self.attributes} if self.attributes else {}),
+                **({"children": [child.to_dict(origin) for child in self.children]} if self.children else {})}
+
+
+class _NoopSpan:
+    '''Returned by a disabled tracer, so instrumented code costs one call per stage.'''
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class LatencyHistogram:
+    '''
+    Bucketed latency distribution (Prometheus style), percentiles are interpolated within a bucket.
+    '''
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = q / 100 * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                value = lower + (upper - lower) * (rank - cumulative) / count
+                return min(value, self.max)
+            cumulative += count
+        return self.max
+
+
+class Tracer:
+    '''
+    Per-request spans of the pipeline stages and latency histograms per stage.
+
+    `span(name)` opens a child of the current span, or the root span of a request if there
+    is none. Finished root spans are passed to the `exporters` (e.g. a JsonLinesExporter),
+    the durations of all spans are added to the histogram of their name. A disabled tracer
+    returns a no-op span.
+
+    Usage:
+        with tracer.span("retrieve", limit=5) as span:
+            docs = database.find(...)
+            span.set(hits=len(docs))
+    '''
+    def __init__(self, enabled: bool = True, exporters: Optional[List[Callable[[Span], None]]] = None,
+                 verbose: bool = False):
+        self.enabled = enabled or verbose
+        self.exporters = list(exporters or [])
+        self.verbose = verbose
+        self.histograms = {}
+        self.attribute_sums = {}
+        self._lock = threading.Lock()
+
+    def span(self, name: str, **attributes):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, _current_span.get(), attributes)
+
+    @staticmethod
+    def current_span():
+        return _current_span.get() or NOOP_SPAN
+
+    def _finish(self, span: Span):
+        with self._lock:
+            if span.name not in self.histograms:
+                self.histograms[span.name] = LatencyHistogram()
+            self.histograms[span.name].observe(span.duration)
+            for key, value in span.attributes.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.attribute_sums[(span.name, key)] = self.attribute_sums.get((span.name, key), 0) + value
+        if self.verbose:
+            depth, parent = 0, span.parent
+            while parent is not None:
+                depth, parent = depth + 1, parent.parent
+            details = ", ".join(f"{key}={value}" for key, value in span.attributes.items())
+            print(f"{'  ' * depth}{span.name} took {span.duration:.2f}s" + (f" ({details})" if details else ""))
+        if span.parent is None:
+            for exporter in self.exporters:
+                exporter(span)
+
+    @property
+    def stats(self) -> dict:
+        '''Count, mean and p50/p95/p99 in seconds of every stage.'''
+        with self._lock:
+            return {name: {"count": histogram.count, "mean": histogram.sum / histogram.count,
+                           "p50": histogram.percentile(50), "p95": histogram.percentile(95),
+                           "p99": histogram.percentile(99), "max": histogram.max}
+                    for name, histogram in self.histograms.items()}
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.attribute_sums = {}
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if math.isinf(bound) else f"{bound:.6g}"
+
+
+def prometheus_text(tracer: Tracer, prefix: str = "rag") -> str:
+    '''
+    The histograms and attribute sums of a tracer in the Prometheus text exposition format.
+    '''
+    with tracer._lock:
+        histograms = {name: (list(h.counts), h.count, h.sum, h.buckets) for name, h in tracer.histograms.items()}
+        sums = dict(tracer.attribute_sums)
+    lines = [f"# HELP {prefix}_stage_duration_seconds Duration of the pipeline stages.",
+             f"# TYPE {prefix}_stage_duration_seconds histogram"]
+    for name, (counts, count, total, buckets) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(list(buckets) + [math.inf], counts):
+            cumulative += bucket_count
+            lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{name}",le="{_format_bound(bound)}"}} '
+                         f'{cumulative}')
+        lines.append(f'{prefix}_stage_duration_seconds_sum{{stage="{name}"}} {total:.6f}')
+        lines.append(f'{prefix}_stage_duration_seconds_count{{stage="{name}"}} {count}')
+    lines += [f"# HELP {prefix}_stage_attribute_total Sum of the numeric span attributes, e.g. tokens or hits.",
+              f"# TYPE {prefix}_stage_attribute_total counter"]
+    for (name, key), value in sorted(sums.items()):
+        lines.append(f'{prefix}_stage_attribute_total{{stage="{name}",attribute="{key}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+class JsonLinesExporter:
+    '''
+    Appends every finished request trace as one line of JSON to a file.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, span: Span):
+        line = json.dumps({"timestamp": time.time(), **span.to_dict()}, ensure_ascii=False, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
@@ -0,0 +1,4 @@
+import os
+
+# settings.py reads the key on import and the client module requires it, the tests never call the API
+os.environ.setdefault("OPENAI_API_KEY", "test")
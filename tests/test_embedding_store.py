@@ -0,0 +1,109 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Add the project root directory to Python path
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from src.embedding_store import EmbeddingStore, EmbeddingStoreWriter
+
+
+def make_segments(start, count, dim=4):
+    segments = [{"id": f"segment-{i}", "text": f"Text {i}", "filename": f"file-{i // 3}.pdf"}
+                for i in range(start, start + count)]
+    embeddings = np.arange(start * dim, (start + count) * dim, dtype=np.float32).reshape(count, dim)
+    return segments, embeddings
+
+
+def data_files(path):
+    return sorted(name for name in os.listdir(path) if name != EmbeddingStore.HEADER_FILE)
+
+
+def test_resume_produces_the_same_store(tmp_path):
+    path_full, path_resumed = str(tmp_path / "full"), str(tmp_path / "resumed")
+    writer = EmbeddingStoreWriter(path_full)
+    for start in (0, 5, 10):
+        writer.append(*make_segments(start, 5))
+    header_full = writer.commit()
+
+    # Interrupted after the second chunk, which was written but not checkpointed
+    writer = EmbeddingStoreWriter(path_resumed)
+    writer.append(*make_segments(0, 5))
+    writer.checkpoint({"done": ["file-0.pdf"]})
+    writer.append(*make_segments(5, 5))
+    writer.close()
+
+    writer = EmbeddingStoreWriter(path_resumed, resume=True)
+    assert writer.state == {"done": ["file-0.pdf"]} and writer.count == 5
+    for start in (5, 10):
+        writer.append(*make_segments(start, 5))
+    header_resumed = writer.commit()
+
+    assert header_resumed == header_full
+    full, resumed = EmbeddingStore(path_full).load(), EmbeddingStore(path_resumed).load()
+    assert resumed.segments == full.segments
+    assert np.array_equal(resumed.embeddings, full.embeddings)
+    assert not os.path.exists(os.path.join(path_resumed, "checkpoint.json.tmp"))
+
+
+def test_writer_without_resume_discards_an_interrupted_write(tmp_path):
+    path = str(tmp_path)
+    writer = EmbeddingStoreWriter(path)
+    writer.append(*make_segments(0, 5))
+    writer.checkpoint({"done": ["file-0.pdf"]})
+    writer.close()
+    # Data files of a commit that was interrupted before the header was replaced
+    for name in ("embeddings-0123456789abcdef.bin", "segments-0123456789abcdef.jsonl"):
+        with open(os.path.join(path, name), "wb") as f:
+            f.write(b"orphan")
+
+    writer = EmbeddingStoreWriter(path, resume=False)
+    assert writer.state is None and writer.count == 0
+    assert not os.path.exists(os.path.join(path, "checkpoint.json.tmp"))
+    writer.append(*make_segments(0, 2))
+    header = writer.commit()
+
+    assert data_files(path) == sorted([header["embeddings_file"], header["segments_file"]])
+    assert [segment["id"] for segment in EmbeddingStore(path).load().segments] == ["segment-0", "segment-1"]
+
+
+def test_loaded_store_survives_commits(tmp_path):
+    path = str(tmp_path)
+    EmbeddingStore(path).write(*make_segments(0, 4))
+    reader = EmbeddingStore(path).load()
+    rows = reader.index_rows()
+
+    EmbeddingStore(path).write(*make_segments(10, 6))
+    # The reader keeps the version it loaded: metadata is read again by the names in its header
+    assert [segment["id"] for segment in reader.iter_segments()] == [f"segment-{i}" for i in range(4)]
+    assert reader.read_segments([rows["segment-2"]])[0]["id"] == "segment-2"
+    assert np.array_equal(reader.embeddings, make_segments(0, 4)[1])
+    # A new reader sees the new version
+    assert len(EmbeddingStore(path).load().segments) == 6
+
+    # The next commit deletes the oldest version, its mapped embeddings stay readable
+    EmbeddingStore(path).write(*make_segments(20, 3))
+    assert np.array_equal(reader.embeddings, make_segments(0, 4)[1])
+    assert len(data_files(path)) == 4
+
+
+def test_reads_stores_without_versioned_files(tmp_path):
+    path = str(tmp_path)
+    segments, embeddings = make_segments(0, 3)
+    EmbeddingStore(path).write(segments, embeddings)
+    store = EmbeddingStore(path).load()
+    header = dict(store.header)
+    os.rename(os.path.join(path, header.pop("embeddings_file")), os.path.join(path, EmbeddingStore.EMBEDDINGS_FILE))
+    os.rename(os.path.join(path, header.pop("segments_file")), os.path.join(path, EmbeddingStore.SEGMENTS_FILE))
+    with open(os.path.join(path, EmbeddingStore.HEADER_FILE), "w", encoding="utf-8") as f:
+        json.dump(header, f)
+
+    store = EmbeddingStore(path).load()
+    assert [segment["id"] for segment in store.segments] == ["segment-0", "segment-1", "segment-2"]
+    EmbeddingStore(path).write(*make_segments(5, 2))
+    # The unversioned files are the previous version and are kept until the next commit
+    assert EmbeddingStore.EMBEDDINGS_FILE in os.listdir(path)
@@ -0,0 +1,119 @@
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# Add the project root directory to Python path
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from settings import REFUSAL_PREFIX
+from src.chatgpt_client import ChatGPTClient, _may_become_refusal
+from src.rag_pipeline import RAGPipeline
+from src.tracing import Tracer
+
+REFUSAL = ["Hop", "pla", ", das kann ", "ich nicht ", "beantworten."]
+ANSWER = ["Die ", "Antwort ", "ist ", "42."]
+
+
+class FakeStream:
+    '''A streamed chat completion that records how many chunks were read and whether it was closed.'''
+    def __init__(self, texts):
+        self.texts = texts
+        self.read = 0
+        self.closed = False
+
+    def __iter__(self):
+        for text in self.texts:
+            self.read += 1
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+    def close(self):
+        self.closed = True
+
+
+def fake_client(*responses):
+    streams = [FakeStream(texts) for texts in responses]
+    calls = iter(streams)
+    client = ChatGPTClient.__new__(ChatGPTClient)
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(
+        create=lambda **kwargs: next(calls))))
+    client.system_prompt, client.temperature, client.max_tokens = "", 0, 100
+    return client, streams
+
+
+class FakeAnswerCache:
+    def __init__(self):
+        self.stored = []
+
+    def lookup(self, query_embedding, retrieved_docs, fingerprint):
+        return None
+
+    def store(self, query_embedding, retrieved_docs, response, latency, fingerprint):
+        self.stored.append(response)
+
+
+class FakePipeline(RAGPipeline):
+    '''The streaming path of the pipeline without models, index or API.'''
+    def __init__(self, client):
+        self.tracer = Tracer(enabled=True)
+        self.chatgpt_client = client
+        self.answer_cache = FakeAnswerCache()
+        self.answerability_gate = None
+        self.prompt_constructor = SimpleNamespace(token_counter=None,
+                                                  pack_prompt=lambda query, docs: ("prompt", {}))
+        self.document_database = SimpleNamespace(fingerprint="corpus", add_context=lambda docs: docs)
+        self.roots = []
+        self.tracer.exporters.append(self.roots.append)
+
+    def _embed_query(self, query):
+        return [1.0]
+
+    def _retrieve(self, query_embedding, doc_limit, extra_context, query=None, filter=None):
+        return ["doc"] * doc_limit
+
+
+def test_may_become_refusal():
+    assert _may_become_refusal("")
+    assert _may_become_refusal(REFUSAL_PREFIX[:3])
+    assert not _may_become_refusal(REFUSAL_PREFIX)
+    assert not _may_become_refusal("Die")
+
+
+def test_client_yields_the_refusal_head_and_closes_the_stream():
+    client, (stream,) = fake_client(REFUSAL)
+    chunks = list(client.generate_response_stream("prompt", cancel_on_refusal=True))
+    assert chunks == ["Hoppla"]
+    assert stream.closed and stream.read == 2
+
+
+def test_client_does_not_hold_back_answers():
+    client, (stream,) = fake_client(ANSWER)
+    assert list(client.generate_response_stream("prompt", cancel_on_refusal=True)) == ANSWER
+    assert stream.closed
+
+
+def test_refused_try_is_cancelled_traced_and_not_cached():
+    client, (refused, answered) = fake_client(REFUSAL, ANSWER)
+    pipeline = FakePipeline(client)
+
+    assert "".join(pipeline.run_stream("Frage", max_retries=1)) == "".join(ANSWER)
+
+    assert refused.closed and refused.read < len(REFUSAL)
+    assert answered.closed and answered.read == len(ANSWER)
+    assert pipeline.answer_cache.stored == ["".join(ANSWER)]
+
+    (request,) = pipeline.roots
+    first_try, second_try = [span for span in request.children if span.name == "attempt"]
+    (llm,) = [span for span in first_try.children if span.name == "llm"]
+    assert llm.attributes["refusal"] and llm.attributes["cancelled"]
+    (llm,) = [span for span in second_try.children if span.name == "llm"]
+    assert not llm.attributes["refusal"] and "cancelled" not in llm.attributes
+
+
+def test_refusal_of_the_last_try_is_streamed_in_full_and_cached():
+    client, (stream,) = fake_client(REFUSAL)
+    pipeline = FakePipeline(client)
+
+    assert "".join(pipeline.run_stream("Frage", max_retries=0)) == "".join(REFUSAL)
+    assert stream.read == len(REFUSAL)
+    assert pipeline.answer_cache.stored == ["".join(REFUSAL)]